@@ -0,0 +1,305 @@
+"""
+Module for computing attack maps and features of many positions at once.
+
+Positions are loaded into an (N, 64) uint8 array of piece codes, square
+index row * 8 + column as in Position.board. Each kind of piece is then
+packed into a vector of N 64-bit bitboards, bit i standing for square i,
+and attacks are computed for all N positions together with shifts and
+masks. No Piece objects are created and no scopes are calculated.
+
+Requires NumPy.
+"""
+
+import numpy as np
+
+import piece
+
+# Piece code of each board symbol: 0 for an empty square, 1-6 for white
+# and 7-12 for black pieces.
+SYMBOLS = '-PNBRQKpnbrqk'
+
+# Maps the bytes of board symbols to piece codes.
+_CODE_TABLE = np.zeros(256, np.uint8)
+for _code, _symbol in enumerate(SYMBOLS):
+    _CODE_TABLE[ord(_symbol)] = _code
+
+_SQUARES = np.arange(64)
+_COLUMNS = _SQUARES % 8
+
+
+def _bits(squares):
+    """ Return the bitboard of a boolean array of 64 squares. """
+    return np.uint64(sum(1 << int(i) for i in np.flatnonzero(squares)))
+
+
+# Squares left after a shift of 'dc' columns, which must not have wrapped
+# round from the other edge of the board, indexed by dc + 2.
+_COLUMN_MASKS = [_bits((_COLUMNS >= dc) & (_COLUMNS < 8 + dc))
+                 for dc in range(-2, 3)]
+
+_SECOND_RANKS = {'w': _bits(_SQUARES // 8 == 5),
+                 'b': _bits(_SQUARES // 8 == 2)}
+
+# Rows of the squares ahead of a pawn of each colour.
+_PAWN_DIRECTION = {'w': -1, 'b': 1}
+
+_popcount = getattr(np, 'bitwise_count', None)
+if _popcount is None:
+    _BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)],
+                            np.uint8)
+
+    def _popcount(bitboards):
+        return _BYTE_COUNTS[bitboards.view(np.uint8)].reshape(
+            bitboards.shape + (8,)).sum(axis=-1)
+
+
+def shift(bitboards, dr, dc):
+    """ Return bitboards with every square moved 'dr' rows and 'dc'
+        columns, dropping squares which leave the board.
+
+    Args: bitboards (uint64 array): Bitboards to shift.
+          dr (int): Rows to move, positive towards rank 1.
+          dc (int): Columns to move, positive towards the h-file.
+    """
+    delta = dr * 8 + dc
+    if delta > 0:
+        shifted = bitboards << np.uint64(delta)
+    else:
+        shifted = bitboards >> np.uint64(-delta)
+    if dc:
+        shifted &= _COLUMN_MASKS[dc + 2]
+    return shifted
+
+
+def codes(symbols):
+    """ Return the piece codes of a uint8 array of board symbol bytes, in
+        an array of the same shape.
+
+    Args: symbols (uint8 array): ASCII bytes of board symbols.
+    """
+    return _CODE_TABLE[symbols]
+
+
+def encode(positions):
+    """ Return (board, white) for a sequence of positions: the (N, 64)
+        uint8 array of their piece codes and the (N,) boolean array which
+        is True where white is to move.
+
+    Args: positions: Sequence of Position objects.
+    """
+    text = ''.join(symbol for each in positions
+                   for rank in each.board for symbol in rank)
+    board = codes(np.frombuffer(text.encode('ascii'), np.uint8))
+    board = board.reshape(len(positions), 64)
+    white = np.array([each.turn == 'w' for each in positions], bool)
+    return board, white
+
+
+class Batch:
+    """ Attack maps and features of many positions.
+
+    Attributes:
+        board: (N, 64) uint8 array of piece codes.
+        white: (N,) boolean array, True where white is to move.
+        pieces (dict): Bitboards of each board symbol, as (N,) uint64
+                       arrays.
+        occupied: Bitboards of the occupied squares of each colour, keyed
+                  by 'w' and 'b'.
+        empty: Bitboards of the empty squares.
+
+    Methods: attacks, mobility, in_check, hanging, checks, features
+
+    """
+
+    def __init__(self, board, white):
+        """ Constructor for Batch.
+
+        Args: board: (N, 64) uint8 array of piece codes, e.g. from encode.
+              white: (N,) boolean array, True where white is to move.
+        """
+        self.board = board
+        self.white = white
+        packed = {}
+        for code, symbol in enumerate(SYMBOLS):
+            if code:
+                bits = np.packbits(board == code, axis=1, bitorder='little')
+                packed[symbol] = bits.view('<u8').ravel().astype(np.uint64)
+        self.pieces = packed
+        self.occupied = {
+            'w': np.bitwise_or.reduce([packed[s] for s in 'PNBRQK']),
+            'b': np.bitwise_or.reduce([packed[s] for s in 'pnbrqk']),
+        }
+        self.empty = ~(self.occupied['w'] | self.occupied['b'])
+        self._attacks = {}
+
+    @classmethod
+    def from_positions(cls, positions):
+        """ Return the Batch of a sequence of Position objects. """
+        return cls(*encode(positions))
+
+    def _symbol(self, kind, colour):
+        return kind.upper() if colour == 'w' else kind
+
+    def _slides(self, sources, steps):
+        """ Generate the squares reached at each distance along 'steps'
+            from 'sources', stopping at the first occupied square. No two
+            sources reach the same square in the same direction and
+            distance, so counting the bits counts moves. """
+        for dr, dc in steps:
+            front = sources
+            while True:
+                front = shift(front, dr, dc)
+                yield front
+                front = front & self.empty
+                if not front.any():
+                    break
+
+    def _jumps(self, sources, steps):
+        for dr, dc in steps:
+            yield shift(sources, dr, dc)
+
+    def _targets(self, colour):
+        """ Generate the bitboards of squares attacked by each kind of
+            move of 'colour', as (kind, bitboards) pairs. """
+        pieces = self.pieces
+        symbol = lambda kind: pieces[self._symbol(kind, colour)]
+        dr = _PAWN_DIRECTION[colour]
+        for dc in (-1, 1):
+            yield 'p', shift(symbol('p'), dr, dc)
+        for target in self._jumps(symbol('n'), piece.KNIGHT_STEPS):
+            yield 'n', target
+        diagonal = symbol('b') | symbol('q')
+        for target in self._slides(diagonal, piece.DIAGONAL_STEPS):
+            yield 'b', target
+        line = symbol('r') | symbol('q')
+        for target in self._slides(line, piece.LINE_STEPS):
+            yield 'r', target
+        for target in self._jumps(symbol('k'), piece.KING_STEPS):
+            yield 'k', target
+
+    def attacks(self, colour):
+        """ Return the bitboards of the squares attacked by 'colour',
+            including squares occupied by its own pieces.
+
+        Args: colour (str): 'w' or 'b'.
+        """
+        if colour not in self._attacks:
+            attacked = np.zeros(len(self.board), np.uint64)
+            for kind, target in self._targets(colour):
+                attacked |= target
+            self._attacks[colour] = attacked
+        return self._attacks[colour]
+
+    def mobility(self, colour):
+        """ Return the number of pseudo-legal moves of 'colour' in each
+            position, castling and en passant excepted. A promotion counts
+            as one move.
+
+        Args: colour (str): 'w' or 'b'.
+        """
+        enemy = 'b' if colour == 'w' else 'w'
+        not_own = ~self.occupied[colour]
+        count = np.zeros(len(self.board), np.int64)
+        for kind, target in self._targets(colour):
+            if kind == 'p':
+                target = target & self.occupied[enemy]
+            else:
+                target = target & not_own
+            count += _popcount(target)
+        pawns = self.pieces[self._symbol('p', colour)]
+        dr = _PAWN_DIRECTION[colour]
+        single = shift(pawns, dr, 0) & self.empty
+        double = shift(single & _SECOND_RANKS[colour], dr, 0) & self.empty
+        count += _popcount(single) + _popcount(double)
+        return count
+
+    def in_check(self, colour=None):
+        """ Return a boolean array, True where the king of 'colour' is
+            attacked.
+
+        Args: colour (str): 'w' or 'b'. Defaults to the side to move in
+                            each position.
+        """
+        if colour is None:
+            return np.where(self.white, self.in_check('w'),
+                            self.in_check('b'))
+        enemy = 'b' if colour == 'w' else 'w'
+        king = self.pieces[self._symbol('k', colour)]
+        return (king & self.attacks(enemy)) != 0
+
+    def hanging(self, colour):
+        """ Return the bitboards of the pieces of 'colour', kings excepted,
+            which are attacked and not defended.
+
+        Args: colour (str): 'w' or 'b'.
+        """
+        enemy = 'b' if colour == 'w' else 'w'
+        king = self.pieces[self._symbol('k', colour)]
+        return (self.occupied[colour] & ~king & self.attacks(enemy)
+                & ~self.attacks(colour))
+
+    def checks(self, colour):
+        """ Return the number of pseudo-legal moves of 'colour' giving
+            direct check in each position. Discovered checks and
+            promotions to a checking piece are not counted. Only exact
+            where the enemy king is not already in check, as when 'colour'
+            is to move.
+
+        Args: colour (str): 'w' or 'b'.
+        """
+        enemy = 'b' if colour == 'w' else 'w'
+        king = self.pieces[self._symbol('k', enemy)]
+        not_own = ~self.occupied[colour]
+        # Squares from which each kind of piece would attack the king.
+        checking = {
+            'p': shift(king, -_PAWN_DIRECTION[colour], -1)
+                 | shift(king, -_PAWN_DIRECTION[colour], 1),
+            'n': np.bitwise_or.reduce(list(self._jumps(king,
+                                                       piece.KNIGHT_STEPS))),
+            'b': np.bitwise_or.reduce(list(self._slides(
+                king, piece.DIAGONAL_STEPS))),
+            'r': np.bitwise_or.reduce(list(self._slides(king,
+                                                        piece.LINE_STEPS))),
+        }
+        count = np.zeros(len(self.board), np.int64)
+        for kind, target in self._targets(colour):
+            if kind == 'k':
+                continue
+            if kind == 'p':
+                target = target & self.occupied[enemy]
+            else:
+                target = target & not_own
+            count += _popcount(target & checking[kind])
+        # Queens were counted with the bishops and the rooks, on the squares
+        # from which a bishop or a rook would give check. Add the checks a
+        # queen gives from the squares of the other kind of line.
+        queen = self.pieces[self._symbol('q', colour)]
+        for steps, other in ((piece.DIAGONAL_STEPS, checking['r']),
+                             (piece.LINE_STEPS, checking['b'])):
+            for target in self._slides(queen, steps):
+                count += _popcount(target & not_own & other)
+        pawns = self.pieces[self._symbol('p', colour)]
+        dr = _PAWN_DIRECTION[colour]
+        single = shift(pawns, dr, 0) & self.empty
+        double = shift(single & _SECOND_RANKS[colour], dr, 0) & self.empty
+        count += _popcount((single | double) & checking['p'])
+        return count
+
+    def features(self):
+        """ Return a dictionary of (N,) arrays describing the positions
+            from the point of view of the side to move: in_check, mobility,
+            opponent_mobility, checks, hanging (undefended enemy pieces
+            attacked) and own_hanging. """
+        white = self.white
+        pick = lambda w, b: np.where(white, w, b)
+        return {
+            'in_check': self.in_check(),
+            'mobility': pick(self.mobility('w'), self.mobility('b')),
+            'opponent_mobility': pick(self.mobility('b'),
+                                      self.mobility('w')),
+            'checks': pick(self.checks('w'), self.checks('b')),
+            'hanging': pick(_popcount(self.hanging('b')),
+                            _popcount(self.hanging('w'))),
+            'own_hanging': pick(_popcount(self.hanging('w')),
+                                _popcount(self.hanging('b'))),
+        }
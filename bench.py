@@ -0,0 +1,316 @@
+"""
+Module for benchmarking.
+
+Times the hot paths of the position, piece and graphics modules. Results
+are printed in microseconds per operation and can be saved as a JSON
+baseline, or compared against one to flag regressions:
+
+    python bench.py --save baseline.json
+    python bench.py --compare baseline.json --threshold 0.1
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import notation
+import piece
+import position
+
+# Representative positions: the opening, a middlegame and an endgame.
+BENCHMARK_FENS = [
+    position.FEN_START,
+    'r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N2N2/PP2BPPP/R1BQ1RK1 w - - 0 1',
+    '8/5pk1/6p1/3R4/1r5P/6P1/5PK1/8 w - - 0 1',
+]
+
+# Moves cycled through on the graphical board: Nf3 Nf6 Ng1 Ng8.
+BOARD_CYCLE = [((7, 6), (5, 5)), ((0, 6), (2, 5)),
+               ((5, 5), (7, 6)), ((2, 5), (0, 6))]
+
+
+def bench_fen_parsing():
+    def run():
+        for fen in BENCHMARK_FENS:
+            position.Position(fen)
+    return run, len(BENCHMARK_FENS)
+
+
+def bench_generate_fen():
+    positions = [position.Position(fen) for fen in BENCHMARK_FENS]
+
+    def run():
+        for test_position in positions:
+            test_position.generate_fen()
+    return run, len(positions)
+
+
+def bench_calculate_scope(kind):
+    """ Return a benchmark of calculate_scope for one kind of piece.
+
+    Args: kind (str): Lower case piece symbol.
+    """
+    def setup():
+        cases = []
+        for fen in BENCHMARK_FENS:
+            test_position = position.Position(fen)
+            for colour in 'wb':
+                for own_piece in test_position.pieces(colour):
+                    if own_piece.symbol.lower() == kind:
+                        cases.append((own_piece, test_position))
+
+        def run():
+            for own_piece, test_position in cases:
+                own_piece.calculate_scope(test_position)
+        return run, len(cases)
+    return setup
+
+
+def bench_is_legal_move():
+    cases = []
+    for fen in BENCHMARK_FENS:
+        test_position = position.Position(fen)
+        for move in test_position.generate_moves():
+            cases.append((test_position, move))
+
+    def run():
+        for test_position, (own_piece, end) in cases:
+            test_position.is_legal_move(own_piece, end)
+    return run, len(cases)
+
+
+def bench_make_undo():
+    cases = []
+    for fen in BENCHMARK_FENS:
+        test_position = position.Position(fen)
+        for move in test_position.legal_moves():
+            cases.append((test_position, move))
+
+    def run():
+        for test_position, (own_piece, end) in cases:
+            test_position.undo_move(test_position.make_move(own_piece, end))
+    return run, len(cases)
+
+
+def bench_push_pop():
+    cases = []
+    for fen in BENCHMARK_FENS:
+        test_position = position.Position(fen)
+        for move in test_position.legal_moves():
+            cases.append((test_position, move))
+
+    def run():
+        for test_position, (own_piece, end) in cases:
+            test_position.push(own_piece, end)
+            test_position.pop()
+    return run, len(cases)
+
+
+def bench_format_san():
+    cases = []
+    for fen in BENCHMARK_FENS:
+        test_position = position.Position(fen)
+        for own_piece, end in test_position.legal_moves():
+            cases.append((test_position, own_piece, end))
+
+    def run():
+        for test_position, own_piece, end in cases:
+            notation.format_san(test_position, own_piece, end)
+    return run, len(cases)
+
+
+def bench_parse_san():
+    cases = []
+    for fen in BENCHMARK_FENS:
+        test_position = position.Position(fen)
+        for own_piece, end in test_position.legal_moves():
+            cases.append((test_position, notation.format_san(
+                test_position, own_piece, end)))
+
+    def run():
+        for test_position, san in cases:
+            notation.parse_san(test_position, san)
+    return run, len(cases)
+
+
+def bench_batch_features():
+    import batch
+    positions = [position.Position(fen) for fen in BENCHMARK_FENS] * 100
+
+    def run():
+        batch.Batch.from_positions(positions).features()
+    return run, len(positions)
+
+
+def _headless_screen():
+    """ Initialise pygame without a window. Return the screen surface. """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    import graphics
+    pygame.display.init()
+    pygame.font.init()
+    return pygame.display.set_mode(
+        (graphics.SCREEN_WIDTH, graphics.SCREEN_HEIGHT)
+    )
+
+
+def bench_board_draw():
+    screen = _headless_screen()
+    import graphics
+    board = graphics.Board(BENCHMARK_FENS[1])
+    board.add_sprites()
+
+    def run():
+        board.draw(screen, board.board_size)
+    return run, 1
+
+
+def bench_update_board():
+    screen = _headless_screen()
+    import graphics
+    board = graphics.Board(position.FEN_START)
+    board.add_sprites()
+    board.draw(screen, board.board_size)
+
+    def run():
+        for start, end in BOARD_CYCLE:
+            sprite = board.find_piece_on_square(start)
+            board_update_data = board.update_position((sprite, end))
+            board.update_board(screen, board_update_data)
+            board.clear_updated_rects()
+    return run, len(BOARD_CYCLE)
+
+
+def bench_grid_draw():
+    screen = _headless_screen()
+    import graphics
+    grid = graphics.BoardGrid(BENCHMARK_FENS * 5 + [position.FEN_START], 4,
+                              screen.get_rect())
+
+    def run():
+        grid.draw(screen)
+        grid.clear_updated_rects()
+    return run, 1
+
+
+BENCHMARKS = [
+    ('fen_parsing', bench_fen_parsing),
+    ('generate_fen', bench_generate_fen),
+] + [
+    ('calculate_scope_' + name, bench_calculate_scope(kind))
+    for kind, name in (('p', 'pawn'), ('n', 'knight'), ('b', 'bishop'),
+                       ('r', 'rook'), ('q', 'queen'), ('k', 'king'))
+] + [
+    ('is_legal_move', bench_is_legal_move),
+    ('make_undo', bench_make_undo),
+    ('push_pop', bench_push_pop),
+    ('format_san', bench_format_san),
+    ('parse_san', bench_parse_san),
+    ('batch_features', bench_batch_features),
+    ('board_draw', bench_board_draw),
+    ('update_board', bench_update_board),
+    ('grid_draw', bench_grid_draw),
+]
+
+
+def measure(run, operations, min_time=0.2, repeat=5):
+    """ Return the best time per operation in microseconds.
+
+    Args: run: Function performing 'operations' operations per call.
+          operations (int): Operations performed by each call.
+          min_time (float): Minimum duration of each repeat in seconds.
+          repeat (int): Number of repeats; the fastest is reported.
+    """
+    # Calibrate the number of calls so that each repeat lasts min_time.
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    best = elapsed
+    for i in range(repeat - 1):
+        start = time.perf_counter()
+        for i in range(number):
+            run()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e6 / (number * operations)
+
+
+def run_benchmarks(names=None, min_time=0.2, repeat=5):
+    """ Run the benchmarks. Return a dictionary of microseconds per
+        operation, keyed by benchmark name.
+
+    Args: names (str[]): Benchmarks to run. Defaults to all of them.
+          min_time (float): Minimum duration of each repeat in seconds.
+          repeat (int): Number of repeats per benchmark.
+    """
+    results = {}
+    for name, setup in BENCHMARKS:
+        if names and name not in names:
+            continue
+        run, operations = setup()
+        results[name] = measure(run, operations, min_time, repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Return (name, baseline, result, change) for every benchmark that
+        is more than 'threshold' slower than the baseline.
+
+    Args: results (dict): Results of run_benchmarks.
+          baseline (dict): Previously saved results.
+          threshold (float): Allowed relative slowdown, e.g. 0.1 for 10%.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        change = result / baseline[name] - 1
+        if change > threshold:
+            regressions.append((name, baseline[name], result, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('names', nargs='*', help='benchmarks to run')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum duration of each repeat in seconds')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.names, args.min_time, args.repeat)
+    for name, result in results.items():
+        print('%-24s %12.2f us' % (name, result))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, change in regressions:
+            print('REGRESSION %s: %.2f us -> %.2f us (%+.0f%%)'
+                  % (name, before, after, change * 100))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
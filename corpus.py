@@ -0,0 +1,296 @@
+"""
+Module for sharing a corpus of parsed positions between processes.
+
+The positions are parsed once, by the process creating the corpus, and
+packed into a block of shared memory (see multiprocessing.shared_memory).
+The block starts with a header giving the number of positions, followed by
+one fixed-size record per position:
+
+    bytes 0-63   board symbols as ASCII, square index row * 8 + column
+    byte 64      side to move, 'w' or 'b'
+    byte 65      castling rights, one bit each for K, Q, k and q
+    byte 66      en passant column, or 255 if there is none
+    bytes 67-68  squares of the white and black kings
+    bytes 72-79  Zobrist hash key
+
+Worker processes attach to the block by name without copying it, and
+build Position objects straight from the records, with no FEN to parse
+and no key to hash:
+
+    with corpus.Corpus.from_file('puzzles.tsv') as shared:
+        for result in corpus.imap(analyse, shared, workers=32):
+            ...
+
+The creating process owns the block and unlinks it when closed.
+"""
+
+import multiprocessing
+import struct
+from multiprocessing import shared_memory
+
+import position
+
+# Magic bytes, version and number of positions.
+HEADER = struct.Struct('<4sIQ')
+MAGIC = b'PZLC'
+VERSION = 1
+
+# Board, turn, castling bits, en passant column, king squares and key.
+RECORD = struct.Struct('<64scBBBB3xQ')
+
+CASTLING_BITS = (('K', 1), ('Q', 2), ('k', 4), ('q', 8))
+NO_EN_PASSANT = 255
+
+# Positions handed to a worker at a time by imap.
+CHUNK_SIZE = 1000
+
+# Corpora attached by this process, keyed by name, so that each worker
+# attaches once however many chunks it is given.
+_attached = {}
+
+
+def pack(game):
+    """ Return the record of a position as bytes.
+
+    Args: game (Position): Position to pack.
+    """
+    board = ''.join(''.join(rank) for rank in game.board).encode('ascii')
+    castling = 0
+    for right, bit in CASTLING_BITS:
+        if right in game.castling:
+            castling |= bit
+    if game.en_passant == '-':
+        en_passant = NO_EN_PASSANT
+    else:
+        en_passant = 'abcdefgh'.index(game.en_passant[0])
+    white_row, white_col = game.white_king
+    black_row, black_col = game.black_king
+    return RECORD.pack(board, game.turn.encode('ascii'), castling,
+                       en_passant, white_row * 8 + white_col,
+                       black_row * 8 + black_col, game.key)
+
+
+def unpack(buffer, offset=0):
+    """ Return a new Position from the record at 'offset' in 'buffer'.
+
+    Args: buffer: Bytes-like object holding the record.
+          offset (int): Index of the first byte of the record.
+    """
+    (board, turn, castling_bits, en_passant, white_king, black_king,
+     key) = RECORD.unpack_from(buffer, offset)
+    text = board.decode('ascii')
+    turn = turn.decode('ascii')
+    castling = ''.join(right for right, bit in CASTLING_BITS
+                       if castling_bits & bit) or '-'
+    if en_passant == NO_EN_PASSANT:
+        en_passant = '-'
+    else:
+        en_passant = 'abcdefgh'[en_passant] + ('6' if turn == 'w' else '3')
+    return position.Position.from_board(
+        [list(text[i:i + 8]) for i in range(0, 64, 8)],
+        turn, castling, en_passant,
+        divmod(white_king, 8), divmod(black_king, 8), key
+    )
+
+
+class Corpus:
+    """ Positions packed into a block of shared memory.
+
+    Attributes:
+        memory (SharedMemory): The shared block.
+        name (str): Name by which other processes attach to the block.
+        count (int): Number of positions.
+        owner (bool): True if this object created the block, and unlinks
+                      it when closed.
+
+    Methods: create, from_fens, from_file, attach, record, position,
+             positions, batch, close
+
+    """
+
+    def __init__(self, memory, owner=False):
+        """ Constructor for Corpus. Use create or attach instead.
+
+        Args: memory (SharedMemory): Block holding a corpus.
+              owner (bool): True if the block should be unlinked on close.
+        """
+        magic, version, count = HEADER.unpack_from(memory.buf)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a position corpus: ' + memory.name)
+        self.memory = memory
+        self.name = memory.name
+        self.count = count
+        self.owner = owner
+
+    @classmethod
+    def create(cls, positions, name=None):
+        """ Return a new corpus holding 'positions', owned by the caller.
+
+        Args: positions: Iterable of Position objects.
+              name (str): Optional name of the block, else a random one.
+        """
+        records = b''.join(pack(game) for game in positions)
+        count = len(records) // RECORD.size
+        memory = shared_memory.SharedMemory(
+            name=name, create=True, size=HEADER.size + max(len(records), 1)
+        )
+        HEADER.pack_into(memory.buf, 0, MAGIC, VERSION, count)
+        memory.buf[HEADER.size:HEADER.size + len(records)] = records
+        return cls(memory, owner=True)
+
+    @classmethod
+    def from_fens(cls, fens, name=None):
+        """ Return a new corpus of the positions of 'fens', skipping
+            invalid FENs.
+
+        Args: fens: Iterable of FEN strings.
+              name (str): Optional name of the block.
+        """
+        def parse():
+            for fen in fens:
+                try:
+                    yield position.Position(fen)
+                except ValueError:
+                    continue
+        return cls.create(parse(), name)
+
+    @classmethod
+    def from_file(cls, path, name=None):
+        """ Return a new corpus of the positions of a puzzle file: the FEN
+            starting each line, before any tab. FENs without move counters
+            are accepted and invalid ones skipped.
+
+        Args: path (str): Name of the file.
+              name (str): Optional name of the block.
+        """
+        def read():
+            with open(path) as f:
+                for line in f:
+                    fen = line.partition('\t')[0].strip()
+                    if not fen:
+                        continue
+                    if len(fen.split()) == 4:
+                        fen += ' 0 1'
+                    yield fen
+        return cls.from_fens(read(), name)
+
+    @classmethod
+    def attach(cls, name):
+        """ Return the corpus in the existing block 'name', without copying
+            it. The block is left in place when the corpus is closed.
+
+        Args: name (str): Name of the block, see Corpus.name.
+        """
+        return cls(shared_memory.SharedMemory(name=name))
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _offset(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError('Position index out of range: %d' % index)
+        return HEADER.size + index * RECORD.size
+
+    def record(self, index):
+        """ Return the record of a position as a memoryview of the shared
+            block. It must be released before the corpus is closed.
+
+        Args: index (int): Index of the position.
+        """
+        offset = self._offset(index)
+        return self.memory.buf[offset:offset + RECORD.size]
+
+    def position(self, index):
+        """ Return a new Position built from the record of a position.
+
+        Args: index (int): Index of the position.
+        """
+        return unpack(self.memory.buf, self._offset(index))
+
+    def positions(self, start=0, stop=None):
+        """ Generate a new Position for each record from 'start' up to, but
+            not including, 'stop'.
+
+        Args: start (int): Index of the first position.
+              stop (int): Index after the last position, or None for the
+                          end of the corpus.
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        buffer = self.memory.buf
+        for index in range(start, stop):
+            yield unpack(buffer, HEADER.size + index * RECORD.size)
+
+    def batch(self, start=0, stop=None):
+        """ Return a batch.Batch of the positions from 'start' up to, but
+            not including, 'stop', read from the shared block with no
+            Position objects created. Requires NumPy.
+
+        Args: start (int): Index of the first position.
+              stop (int): Index after the last position, or None for the
+                          end of the corpus.
+        """
+        import numpy as np
+
+        import batch
+
+        stop = self.count if stop is None else min(stop, self.count)
+        records = np.frombuffer(
+            self.memory.buf, np.uint8,
+            count=max(stop - start, 0) * RECORD.size,
+            offset=HEADER.size + start * RECORD.size
+        ).reshape(-1, RECORD.size)
+        return batch.Batch(batch.codes(records[:, :64]),
+                           records[:, 64] == ord('w'))
+
+    def close(self):
+        """ Detach from the shared block, unlinking it if this object
+            created it. Positions already built are not affected. """
+        if self.memory is None:
+            return
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+        self.memory = None
+
+
+def imap(function, shared, workers=None, chunk_size=CHUNK_SIZE):
+    """ Generate function(position) for each position of a corpus, in
+        order. Each worker process attaches to the corpus once and builds
+        the positions of the chunks of indices it is given.
+
+    Args: function: Function of a Position, defined at module level so
+                    that it can be sent to the workers.
+          shared (Corpus): Corpus to process.
+          workers (int): Number of worker processes, default one per CPU.
+                         With 1, the positions are processed here.
+          chunk_size (int): Positions handed to a worker at a time.
+    """
+    jobs = [(function, shared.name, start,
+             min(start + chunk_size, len(shared)))
+            for start in range(0, len(shared), chunk_size)]
+    if workers == 1:
+        for function, _, start, stop in jobs:
+            for game in shared.positions(start, stop):
+                yield function(game)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        for results in pool.imap(_map_chunk, jobs):
+            yield from results
+        # Let the workers exit by themselves: leaving the block kills them
+        # with SIGTERM, which a handler they inherited may ignore.
+        pool.close()
+        pool.join()
+
+
+def _map_chunk(args):
+    function, name, start, stop = args
+    shared = _attached.get(name)
+    if shared is None:
+        shared = _attached[name] = Corpus.attach(name)
+    return [function(game) for game in shared.positions(start, stop)]
@@ -0,0 +1,226 @@
+"""
+Module for removing duplicate puzzles from puzzle files.
+
+A puzzle file holds one puzzle per line, starting with its FEN and
+optionally followed by a tab and its moves, as written by pgn.py. Two
+puzzles are duplicates if their positions are the same up to swapping the
+colours, or mirroring the board left to right when neither side can
+castle. Every position is reduced to a canonical FEN and hashed.
+
+Files larger than memory are handled by partitioning: the lines are first
+spread over temporary files by hash, so that all copies of a puzzle land
+in the same file, and each file is then deduplicated on its own:
+
+    python dedup.py feed1.tsv feed2.tsv -o puzzles.tsv --memory 256
+
+The first copy of each puzzle is kept. Output is grouped by partition, and
+keeps the input order within a partition.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+import position
+
+# Default memory budget, in megabytes, for deduplicating one partition.
+MEMORY_LIMIT = 256
+
+# Approximate memory used per distinct puzzle while deduplicating a
+# partition: a set entry for its hash, plus the file buffers.
+BYTES_PER_KEY = 100
+
+
+def flip_colours(fen_position):
+    """ Return the FEN of a position with the colours swapped: the board
+        turned upside down, white and black pieces exchanged and the other
+        side to move.
+
+    Args: fen_position (Position): Position to transform.
+    """
+    board = [[symbol.swapcase() for symbol in rank]
+             for rank in reversed(fen_position.board)]
+    castling = fen_position.castling
+    if castling != '-':
+        castling = ''.join(sorted(castling.swapcase(),
+                                  key='KQkq'.index))
+    en_passant = fen_position.en_passant
+    if en_passant != '-':
+        en_passant = en_passant[0] + str(9 - int(en_passant[1]))
+    turn = 'b' if fen_position.turn == 'w' else 'w'
+    return _fen(board, turn, castling, en_passant)
+
+
+def mirror(fen_position):
+    """ Return the FEN of a position reflected left to right, or None if
+        either side may castle, which makes the reflection a different
+        position.
+
+    Args: fen_position (Position): Position to transform.
+    """
+    if fen_position.castling != '-':
+        return None
+    board = [list(reversed(rank)) for rank in fen_position.board]
+    en_passant = fen_position.en_passant
+    if en_passant != '-':
+        en_passant = 'hgfedcba'['abcdefgh'.index(en_passant[0])] + \
+            en_passant[1]
+    return _fen(board, fen_position.turn, '-', en_passant)
+
+
+def _fen(board, turn, castling, en_passant):
+    """ Return the FEN of a board and its state, without move counters. """
+    ranks = []
+    for rank in board:
+        text = ''
+        blanks = 0
+        for symbol in rank:
+            if symbol == '-':
+                blanks += 1
+                continue
+            if blanks:
+                text += str(blanks)
+                blanks = 0
+            text += symbol
+        if blanks:
+            text += str(blanks)
+        ranks.append(text)
+    return '%s %s %s %s' % ('/'.join(ranks), turn, castling, en_passant)
+
+
+def canonical_fen(fen):
+    """ Return the canonical FEN, without move counters, of the positions
+        equivalent to 'fen'. Raise ValueError if 'fen' is invalid.
+
+    Args: fen (str): FEN string of the position. The move counters may be
+                     left out.
+    """
+    if len(fen.split()) == 4:
+        fen += ' 0 1'
+    original = position.Position(fen)
+    variants = [_fen(original.board, original.turn, original.castling,
+                     original.en_passant)]
+    flipped = flip_colours(original)
+    variants.append(flipped)
+    if original.castling == '-':
+        variants.append(mirror(original))
+        variants.append(mirror(position.Position(flipped + ' 0 1')))
+    return min(variants)
+
+
+def puzzle_key(line):
+    """ Return the 16 byte hash identifying the puzzle on a line of a
+        puzzle file.
+
+    Args: line (str): Line of a puzzle file.
+    """
+    fen = line.split('\t', 1)[0].strip()
+    return hashlib.blake2b(canonical_fen(fen).encode(),
+                           digest_size=16).digest()
+
+
+def partition(paths, directory, partitions):
+    """ Spread the lines of puzzle files over 'partitions' files in
+        'directory' by hash. Return the list of partition file names and
+        the number of puzzles read. Lines with invalid FENs are dropped.
+
+    Args: paths (str[]): Names of the puzzle files.
+          directory (str): Directory for the partition files.
+          partitions (int): Number of partition files.
+    """
+    names = [os.path.join(directory, 'part%04d' % i)
+             for i in range(partitions)]
+    files = [open(name, 'w') for name in names]
+    count = 0
+    try:
+        for path in paths:
+            with open(path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        key = puzzle_key(line)
+                    except ValueError:
+                        continue
+                    count += 1
+                    index = int.from_bytes(key[:4], 'big') % partitions
+                    files[index].write(key.hex() + '\t' + line.rstrip('\n')
+                                       + '\n')
+    finally:
+        for f in files:
+            f.close()
+    return names, count
+
+
+def dedup_partition(name, output):
+    """ Write the first line of each puzzle in a partition file to
+        'output'. Return the number of lines written.
+
+    Args: name (str): Name of the partition file.
+          output: File open for writing.
+    """
+    seen = set()
+    written = 0
+    with open(name) as f:
+        for record in f:
+            key, line = record.split('\t', 1)
+            if key in seen:
+                continue
+            seen.add(key)
+            output.write(line)
+            written += 1
+    return written
+
+
+def dedup(paths, output_path, memory=MEMORY_LIMIT, directory=None):
+    """ Write the distinct puzzles of some puzzle files to 'output_path'.
+        Return (puzzles read, puzzles written).
+
+    Args: paths (str[]): Names of the puzzle files.
+          output_path (str): Name of the output file.
+          memory (int): Memory budget in megabytes for one partition.
+          directory (str): Directory for temporary files. Defaults to the
+                           system's temporary directory.
+    """
+    size = sum(os.path.getsize(path) for path in paths)
+    # A line is rarely shorter than 60 bytes, so this bounds the number of
+    # distinct puzzles per partition.
+    keys = size // 60 + 1
+    partitions = max(1, -(-keys * BYTES_PER_KEY // (memory * 1024 * 1024)))
+
+    work = tempfile.mkdtemp(dir=directory)
+    try:
+        names, read = partition(paths, work, partitions)
+        written = 0
+        with open(output_path, 'w') as output:
+            for name in names:
+                written += dedup_partition(name, output)
+                os.remove(name)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return read, written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Remove duplicate puzzles from puzzle files.'
+    )
+    parser.add_argument('inputs', nargs='+')
+    parser.add_argument('-o', '--output', required=True, metavar='FILE')
+    parser.add_argument('--memory', type=int, default=MEMORY_LIMIT,
+                        help='memory budget in megabytes')
+    parser.add_argument('--tmp', metavar='DIR',
+                        help='directory for temporary partition files')
+    args = parser.parse_args(argv)
+
+    read, written = dedup(args.inputs, args.output, args.memory, args.tmp)
+    print('%d puzzles read, %d distinct, %d duplicates removed'
+          % (read, written, read - written))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""
+Module for generating mate puzzles from random games.
+
+Positions are reached by playing random legal moves from the starting
+position, or from seed FENs. Each position is screened with cheap tests:
+the side to move must have a piece to mate with and a checking move, and
+the enemy king few flight squares. The survivors are searched for a
+forced mate, and a mate is kept only if its first move is the only one
+mating as quickly. Every worker process plays, screens and proves its
+own batch of games; the main process drops duplicates and streams the
+puzzles to disk as they arrive:
+
+    python generate.py -o puzzles.tsv --count 1000 --workers 8 --mate 2
+
+Output lines are in the format written by pgn.py: the FEN, a tab and the
+mating line in SAN.
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+
+import dedup
+import notation
+import piece
+import position
+import search
+
+# Games played by a worker per batch.
+BATCH_SIZE = 20
+
+# Plies of each random game, and the first ply screened.
+MAX_PLIES = 120
+MIN_PLIES = 16
+
+# Most flight squares of the king to be mated in a screened position. Few
+# mates in two are found in positions where the king has more.
+MAX_FLIGHTS = 2
+
+
+def playout(fen, rng, max_plies=MAX_PLIES, min_plies=MIN_PLIES):
+    """ Play random legal moves from 'fen', generating the Position after
+        each ply from 'min_plies' on. Stops early if the game ends. The
+        same Position object is updated between yields.
+
+    Args: fen (str): FEN string of the starting position.
+          rng (random.Random): Source of the random moves.
+          max_plies (int): Number of moves to play.
+          min_plies (int): First ply after which positions are generated.
+    """
+    game = position.Position(fen)
+    for ply in range(max_plies):
+        moves = list(game.legal_moves())
+        if not moves:
+            return
+        own_piece, end = rng.choice(moves)
+        game.push(own_piece, end)
+        if ply + 1 >= min_plies:
+            yield game
+
+
+def screen(game, max_flights=MAX_FLIGHTS):
+    """ Return True if the side to move could plausibly have a forced
+        mate: it has a piece other than pawns and its king, is not in
+        check, the enemy king has at most 'max_flights' flight squares and
+        there is a move giving direct check.
+
+    Args: game (Position): Position to test.
+          max_flights (int): Most flight squares allowed.
+    """
+    colour = game.turn
+    own = str.isupper if colour == 'w' else str.islower
+    if not any(own(symbol) and symbol not in 'PpKk'
+               for rank in game.board for symbol in rank):
+        return False
+    if game.is_check():
+        return False
+    if flights(game) > max_flights:
+        return False
+    return has_check(game)
+
+
+def flights(game):
+    """ Return the number of squares next to the king of the side not to
+        move which are neither occupied by its own pieces nor attacked.
+
+    Args: game (Position): Position to examine.
+    """
+    colour = game.turn
+    if colour == 'w':
+        row, col = game.black_king
+        blocked = str.islower
+    else:
+        row, col = game.white_king
+        blocked = str.isupper
+    board = game.board
+    count = 0
+    for dr, dc in piece.KING_STEPS:
+        r, c = row + dr, col + dc
+        if (0 <= r <= 7 and 0 <= c <= 7 and not blocked(board[r][c])
+                and not game.is_attacked((r, c), colour)):
+            count += 1
+    return count
+
+
+def has_check(game):
+    """ Return True if the side to move has a pseudo-legal move giving
+        direct check. Each piece's scope is only calculated if the enemy
+        king could be attacked from one of its squares.
+
+    Args: game (Position): Position to test.
+    """
+    board = game.board
+    colour = game.turn
+    enemy_king = game.black_king if colour == 'w' else game.white_king
+    # Squares from which each kind of piece would attack the enemy king.
+    check_squares = {}
+    for kind in 'pnbrq':
+        symbol = kind if colour == 'w' else kind.upper()
+        probe = piece.PieceFactory.create(symbol, enemy_king)
+        check_squares[kind] = set(probe.attacks(board))
+    for own_piece in game.pieces(colour):
+        kind = own_piece.symbol.lower()
+        if kind == 'k':
+            continue
+        if check_squares[kind].intersection(own_piece.calculate_scope(game)):
+            return True
+    return False
+
+
+def prove(fen, max_moves):
+    """ Return the SAN mating line of a position if the side to move has a
+        forced mate in at most 'max_moves' moves with a unique first move,
+        else None.
+
+    Args: fen (str): FEN string of the position.
+          max_moves (int): Longest mate looked for.
+    """
+    line = search.mate_in(fen, max_moves)
+    if line is None:
+        return None
+    moves = (len(line) + 1) // 2
+    if len(search.mating_moves(fen, moves)) != 1:
+        return None
+    return notation.format_line(
+        position.Position(fen),
+        [(own_piece, end, None) for own_piece, end in line]
+    )
+
+
+def generate(seeds, rng, games, max_moves=2, max_plies=MAX_PLIES,
+             min_plies=MIN_PLIES, max_flights=MAX_FLIGHTS):
+    """ Play 'games' random games and return (puzzles, counts): the list
+        of (fen, line) puzzles found and a dictionary counting the
+        positions played, screened in and proven.
+
+    Args: seeds (str[]): FENs of the starting positions, picked at random.
+          rng (random.Random): Source of randomness.
+          games (int): Number of games to play.
+          max_moves (int): Longest mate looked for.
+          max_plies (int): Length of each game.
+          min_plies (int): First ply screened.
+          max_flights (int): See screen.
+    """
+    puzzles = []
+    counts = {'positions': 0, 'screened': 0, 'proven': 0}
+    for i in range(games):
+        for game in playout(rng.choice(seeds), rng, max_plies, min_plies):
+            counts['positions'] += 1
+            if not screen(game, max_flights):
+                continue
+            counts['screened'] += 1
+            fen = game.generate_fen()
+            line = prove(fen, max_moves)
+            if line is not None:
+                counts['proven'] += 1
+                puzzles.append((fen, line))
+    return puzzles, counts
+
+
+def _generate_batch(args):
+    seeds, seed, games, max_moves, max_plies, min_plies, max_flights = args
+    return generate(seeds, random.Random(seed), games, max_moves, max_plies,
+                    min_plies, max_flights)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generate mate puzzles from random games.'
+    )
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the puzzles to FILE instead of '
+                             'standard output')
+    parser.add_argument('--seeds', metavar='FILE',
+                        help='start the games from the FENs in FILE, one '
+                             'per line, instead of the starting position')
+    parser.add_argument('--count', type=int, default=100,
+                        help='number of distinct puzzles wanted')
+    parser.add_argument('--batches', type=int, default=None,
+                        help='stop after this many batches of games')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--mate', type=int, default=2,
+                        help='longest mate looked for, in moves')
+    parser.add_argument('--plies', type=int, default=MAX_PLIES,
+                        help='length of each random game')
+    parser.add_argument('--max-flights', type=int, default=MAX_FLIGHTS,
+                        help='most flight squares of the king to be mated '
+                             'in a screened position')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='games played by a worker at a time')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='random seed, for repeatable runs')
+    args = parser.parse_args(argv)
+
+    seeds = [position.FEN_START]
+    if args.seeds:
+        with open(args.seeds) as f:
+            seeds = [line.strip() for line in f if line.strip()]
+    rng = random.Random(args.seed)
+    min_plies = min(MIN_PLIES, args.plies)
+
+    def jobs():
+        batch = 0
+        while args.batches is None or batch < args.batches:
+            batch += 1
+            yield (seeds, rng.getrandbits(64), args.batch_size, args.mate,
+                   args.plies, min_plies, args.max_flights)
+
+    seen = set()
+    totals = {'positions': 0, 'screened': 0, 'proven': 0}
+    output = open(args.output, 'w') if args.output else sys.stdout
+    pending = jobs()
+    pool = None
+    try:
+        if args.workers > 1:
+            pool = multiprocessing.Pool(args.workers)
+        while len(seen) < args.count:
+            # Hand out a few batches per worker at a time: the jobs never
+            # run out, so they must not be queued all at once.
+            window = list(itertools.islice(pending, 2 * args.workers))
+            if not window:
+                break
+            if pool is not None:
+                results = pool.imap_unordered(_generate_batch, window)
+            else:
+                results = map(_generate_batch, window)
+            for puzzles, counts in results:
+                for name in totals:
+                    totals[name] += counts[name]
+                _write(output, puzzles, seen, args.count)
+        if pool is not None:
+            # Every batch handed out is done: let the workers exit by
+            # themselves rather than by SIGTERM, which they may ignore.
+            pool.close()
+            pool.join()
+            pool = None
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if output is not sys.stdout:
+            output.close()
+    print('%d positions, %d screened in, %d proven, %d distinct puzzles'
+          % (totals['positions'], totals['screened'], totals['proven'],
+             len(seen)), file=sys.stderr)
+    return 0
+
+
+def _write(output, puzzles, seen, count):
+    """ Write the puzzles whose keys are not in 'seen', up to 'count' in
+        all, adding their keys. """
+    for fen, line in puzzles:
+        if len(seen) >= count:
+            break
+        key = dedup.puzzle_key(fen)
+        if key in seen:
+            continue
+        seen.add(key)
+        output.write('%s\t%s\n' % (fen, ' '.join(line)))
+    output.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
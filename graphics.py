@@ -2,9 +2,11 @@
 Module responsible for the graphical chess board.
 """
 
+import collections
 import os
 import pygame
 
+import movecache
 import piece
 import position
 
@@ -19,12 +21,168 @@ SCREEN_WIDTH = 600
 BOARD_SIZE = 600
 SQUARE_SIZE = BOARD_SIZE//8
 
+# Height of the text box below the board.
+TEXT_HEIGHT = SCREEN_HEIGHT - BOARD_SIZE
+
+# Smallest board the window can be resized to.
+MIN_BOARD_SIZE = 160
+
+# Number of surfaces kept by each cache of scaled surfaces.
+CACHE_CAPACITY = 64
+
+# Gap in pixels between the boards of a grid.
+GRID_GAP = 8
+
+# Order of the pieces in an atlas.
+ATLAS_SYMBOLS = 'PNBRQKpnbrqk'
+
+# Length of a move animation in milliseconds.
+ANIMATION_MS = 250
+
+# Text box font. None selects the font bundled with pygame.
+FONT_NAME = None
+FONT_SIZE = 22
+
+# Distance between the tops of consecutive lines of text.
+LINE_HEIGHT = 20
+
+
+class SurfaceCache:
+    """ Least recently used cache of surfaces.
+
+    Attributes:
+        capacity (int): Maximum number of surfaces kept.
+        surfaces (OrderedDict): Cached surfaces, least recently used first.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that created a surface.
+
+    Methods: get, clear
+
+    """
+
+    def __init__(self, capacity=CACHE_CAPACITY):
+        self.capacity = capacity
+        self.surfaces = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    def get(self, key, create):
+        """ Return the surface cached under 'key', calling 'create' to make
+            it if it is missing and evicting the least recently used
+            surfaces beyond capacity.
+
+        Args: key: Hashable cache key.
+              create: Function returning a new surface.
+        """
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = create()
+        self.surfaces[key] = surface
+        while len(self.surfaces) > self.capacity:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        """ Empty the cache. """
+        self.surfaces.clear()
+
+
+# Scaled piece images keyed by (symbol, size, directory), and empty boards
+# keyed by (square size, light colour, dark colour).
+IMAGE_CACHE = SurfaceCache()
+BACKGROUND_CACHE = SurfaceCache(8)
+
+# Rendered lines of text keyed by (text, colour).
+TEXT_CACHE = SurfaceCache(128)
+
+# Decoded source images keyed by file name. There are only twelve, so they
+# are never evicted and resizing never reads the files again.
+_source_images = {}
+
+
+def piece_image(symbol, size, dir='img'):
+    """ Return the image of a piece scaled to 'size', from the cache.
+
+    Args: symbol (str): Character representing a piece.
+          size (int): Width/height of square.
+          dir (str): Directory containing the image files.
+    """
+    def create():
+        file = os.path.join(dir, PieceSprite.piece_sprites[symbol])
+        picture = _source_images.get(file)
+        if picture is None:
+            picture = pygame.image.load(file)
+            _source_images[file] = picture
+        image = pygame.transform.scale(picture, (size, size))
+        # Convert to the display's pixel format, keeping transparency.
+        return image.convert_alpha()
+    return IMAGE_CACHE.get((symbol, size, dir), create)
+
+
+def board_background(square_size, light, dark):
+    """ Return an empty chessboard with squares of 'square_size', from the
+        cache.
+
+    Args: square_size (int): Width/height of a square.
+          light (rgb tuple): Colour of the light squares.
+          dark (rgb tuple): Colour of the dark squares.
+    """
+    def create():
+        size = square_size * 8
+        surface = pygame.Surface((size, size))
+        surface.fill(light)
+        for row in range(8):
+            for col in range(8):
+                if (row + col) % 2 == 1:
+                    pygame.draw.rect(surface, dark, (
+                        col * square_size, row * square_size,
+                        square_size, square_size
+                    ))
+        return surface.convert()
+    return BACKGROUND_CACHE.get((square_size, light, dark), create)
+
+
+def piece_atlas(size, dir='img'):
+    """ Return a surface holding every piece image scaled to 'size' side by
+        side, in the order of ATLAS_SYMBOLS, from the cache.
+
+    Args: size (int): Width/height of square.
+          dir (str): Directory containing the image files.
+    """
+    def create():
+        atlas = pygame.Surface((size * len(ATLAS_SYMBOLS), size),
+                               pygame.SRCALPHA)
+        atlas.blits([(piece_image(symbol, size, dir), (i * size, 0))
+                     for i, symbol in enumerate(ATLAS_SYMBOLS)],
+                    doreturn=False)
+        return atlas.convert_alpha()
+    return IMAGE_CACHE.get(('atlas', size, dir), create)
+
+
+def atlas_area(symbol, size):
+    """ Return the Rect of the image of 'symbol' in an atlas of pieces of
+        'size'.
+
+    Args: symbol (str): Character representing a piece.
+          size (int): Width/height of square.
+    """
+    return pygame.Rect(ATLAS_SYMBOLS.index(symbol) * size, 0, size, size)
+
 
 class PieceSprite(pygame.sprite.Sprite):
     """ Represents a chess piece.
     
     Attributes: 
         image: PNG image loaded from a file.
+        size (int): Width/height of the image.
+        dir (str): Directory containing the image files.
         rect: Rect describing the location occupied by the image.
         piece: Piece object defined in module 'piece'.
         selected: True if the piece has been clicked and is being dragged
@@ -81,15 +239,11 @@ class PieceSprite(pygame.sprite.Sprite):
               size (int): Width/height of square.
               dir (str): Directory containing the image files.
         """
-
-        filename = PieceSprite.piece_sprites[symbol]
-        file = os.path.join(dir, filename)
-        picture = pygame.image.load(file)
-        self.image = pygame.transform.scale(picture, (size, size))
-        # Convert to the correct pixel format
-        self.image.convert() 
-        # Set the transparent background colour
-        self.image.set_colorkey(WHITE)
+        # Each image is decoded and scaled once, then shared by every
+        # sprite showing the same piece at the same size.
+        self.image = piece_image(symbol, size, dir)
+        self.size = size
+        self.dir = dir
 
     
     def update(self, location, square, promotion=None):
@@ -99,49 +253,117 @@ class PieceSprite(pygame.sprite.Sprite):
               square (int, int): New square.
               promotion (str): Promotion piece selected by user.
         """
-        if location[0] < 0 or location[0] > BOARD_SIZE:
+        if location[0] < 0 or location[0] > self.size * 8:
             return
 
-        if location[1] < 0 or location[1] > BOARD_SIZE:
+        if location[1] < 0 or location[1] > self.size * 8:
             return
 
         if promotion is not None:
-            self.load_image(symbol, SQUARE_SIZE)
+            self.load_image(promotion, self.size, self.dir)
+            self.piece = piece.PieceFactory.create(promotion, square)
 
         self.rect.x = location[0]
         self.rect.y = location[1]
         self.piece.square = square
 
 
+class Slide:
+    """ A sprite sliding in a straight line between two points.
+
+    Attributes:
+        sprite (PieceSprite): The moving sprite.
+        origin (int, int): Coordinates the slide starts from.
+        target (int, int): Coordinates the slide ends at.
+        start (float): Start time in milliseconds.
+        duration (float): Length of the slide in milliseconds.
+
+    Methods: position, finished
+
+    """
+
+    def __init__(self, sprite, origin, target, start, duration):
+        self.sprite = sprite
+        self.origin = origin
+        self.target = target
+        self.start = start
+        self.duration = duration
+
+    def position(self, now):
+        """ Return the sprite's coordinates at time 'now'.
+
+        Args: now (float): Current time in milliseconds.
+        """
+        if self.duration <= 0:
+            return self.target
+        t = min(1.0, max(0.0, (now - self.start) / self.duration))
+        # Ease out: fast at first, settling gently on the square.
+        t = 1 - (1 - t) ** 2
+        return (round(self.origin[0] + (self.target[0] - self.origin[0]) * t),
+                round(self.origin[1] + (self.target[1] - self.origin[1]) * t))
+
+    def finished(self, now):
+        """ Return True once the slide has reached its target.
+
+        Args: now (float): Current time in milliseconds.
+        """
+        return now - self.start >= self.duration
+
+
 class Board(position.Position):
     """ Graphical chess board. Subclass of Position.
 
     Attributes:
         light: (rgb tuple): Colour of the light squares.
         dark: (rgb tuple): Colour of the dark squares.
+        board_size (int): Width/height of the chessboard.
+        square_size (int): Width/height of a square.
         board_rect (pygame.Rect): Rect describing the chessboard region.
         sprite_list: Group of PieceSprite objects representing all
                     the pieces on the board.
         moving_pieces: Group of PieceSprite objects to be moved.
         updated_rects: List of Rects to be updated on the next frame.
+        full_update (bool): True if the whole screen must be updated on
+                            the next frame.
+        dragging (PieceSprite): Sprite being dragged, or None.
+        background (pygame.Surface): Static layer cached during a drag.
+        drag_offset (int, int): Sprite position relative to the cursor.
+        animations: List of running Slide objects.
+        pending_moves: Queue of (start, end) moves waiting to be animated.
         text_box (graphics.TextBox): Text box object.
+        solution (SolutionTree): Solution lines the moves of the solver
+                                 must follow, or None to allow any legal
+                                 move.
         
-    Methods: add_sprites, draw, square_from_cursor, coordinates_from_square,
-             clear_square, update, whole_board_update, clear_updated_rects,
+    Methods: add_sprites, draw, draw_squares, square_from_cursor,
+             coordinates_from_square, clear_square, select_piece,
+             static_layer, start_drag, drag, end_drag, process_move,
+             keeps_to_solution, finish_move, move_piece, place_sprite,
+             animate_move, play_line, is_animating, step_animations,
+             update, take_back, redo_move, reset_sprites, resize,
+             print_text, erase_text, flush_text, whole_board_update,
+             clear_updated_rects,
     """
 
-    def __init__(self, fen): 
+    def __init__(self, fen, board_size=BOARD_SIZE): 
         super().__init__(fen)
         self.light = WHITE
         self.dark = BLUE
-        self.board_rect = pygame.Rect(0, 0, BOARD_SIZE, BOARD_SIZE)
+        self.board_size = board_size
+        self.square_size = board_size // 8
+        self.board_rect = pygame.Rect(0, 0, board_size, board_size)
         self.sprite_list = pygame.sprite.Group()
         self.moving_pieces = pygame.sprite.Group()
         self.updated_rects = []
-        text_rect = pygame.Rect(
-            0, BOARD_SIZE, SCREEN_WIDTH, SCREEN_HEIGHT - BOARD_SIZE
-        )
+        self.full_update = True
+        self.dragging = None
+        self.background = None
+        self.animations = []
+        self.pending_moves = []
+        self.drag_offset = (0, 0)
+        text_rect = pygame.Rect(0, board_size, board_size, TEXT_HEIGHT)
         self.textbox = TextBox(text_rect, self.dark)
+        self.solution = None
 
     def add_sprites(self):
         """ Initialise the PieceSprite objects for every piece on the board.
@@ -150,13 +372,13 @@ class Board(position.Position):
             left corner of the square occupied by the piece. """
         for row, rank in enumerate(self.board):
             # y-coordinate of top border of the row 
-            y = SQUARE_SIZE * row      
+            y = self.square_size * row      
             for column, symbol in enumerate(rank):
                 # x-coordinate of left border of the column
-                x = SQUARE_SIZE * column
+                x = self.square_size * column
                 if symbol.isalpha():
                     piece_sprite = PieceSprite(
-                        symbol, x, y, (row, column), SQUARE_SIZE
+                        symbol, x, y, (row, column), self.square_size
                     )
                     self.sprite_list.add(piece_sprite)
 
@@ -167,27 +389,23 @@ class Board(position.Position):
               size (int): width/height of chessboard.
 
         """
-        screen.fill(self.light)
-
-        def draw_squares(square_size, x_start, y_start):
-            """ Draw squares on a series of rows in a chessboard pattern.
-
-            Args: square_size (int): width/height of a square
-                  x_start (int): x-coordinate of first square in a row.
-                  y_start (int): y-coordinate of first square in a row.
-
-            """
-            for x in range(x_start, size, square_size*2):
-                for y in range(y_start, size, square_size*2): 
-                    dark_square = (x, y, square_size, square_size)
-                    pygame.draw.rect(screen, self.dark, dark_square) 
-
-        draw_squares(SQUARE_SIZE, 0, SQUARE_SIZE)
-        draw_squares(SQUARE_SIZE, SQUARE_SIZE, 0)
+        self.draw_squares(screen, size)
         
         self.sprite_list.draw(screen)
 
         self.textbox.draw(screen)
+        self.full_update = True
+
+    def draw_squares(self, surface, size):
+        """ Draw the empty chessboard.
+
+        Args: surface: pygame surface.
+              size (int): width/height of chessboard.
+
+        """
+        surface.fill(self.light)
+        surface.blit(board_background(size // 8, self.light, self.dark),
+                     (0, 0))
 
     def square_from_cursor(self, pos):
         """ Return row and column of square pointed at by cursor.
@@ -195,10 +413,10 @@ class Board(position.Position):
         Args: pos (int, int): (x, y) position of the mouse cursor.
         """
         def get_coordinate(point):
-            if point == BOARD_SIZE:
+            if point == self.board_size:
                 return 7
             else:
-                return point // SQUARE_SIZE
+                return point // self.square_size
         
         row = get_coordinate(pos[1])
         column = get_coordinate(pos[0])
@@ -210,8 +428,8 @@ class Board(position.Position):
         
         Args: square (int, int): Array indices of a square. 
         """
-        x = square[1] * SQUARE_SIZE
-        y = square[0] * SQUARE_SIZE
+        x = square[1] * self.square_size
+        y = square[0] * self.square_size
         return x, y
     
     def clear_square(self, screen, square):
@@ -229,7 +447,7 @@ class Board(position.Position):
         corner = self.coordinates_from_square(square)
         
         erased_rect = pygame.Rect(
-            corner[0], corner[1], SQUARE_SIZE, SQUARE_SIZE
+            corner[0], corner[1], self.square_size, self.square_size
         )
         pygame.draw.rect(screen, colour, erased_rect)
 
@@ -248,17 +466,83 @@ class Board(position.Position):
                 piece_sprite.selected = True
                 PieceSprite.selected_count += 1
 
+    def static_layer(self, excluded):
+        """ Return a surface showing the board and every sprite except
+            those in 'excluded'.
+
+        Args: excluded: Sprites to leave out.
+        """
+        background = pygame.Surface(self.board_rect.size)
+        self.draw_squares(background, self.board_size)
+        background.blits([(other.image, other.rect)
+                          for other in self.sprite_list
+                          if other not in excluded], doreturn=False)
+        return background
+
+    def start_drag(self, pos):
+        """ Start dragging the selected piece, if any. Caches the static
+            layer (the board and every other piece) so that each frame of
+            the drag only restores and redraws the sprite's rects.
+
+        Args: pos (int, int): Coordinates of mouse cursor.
+        """
+        for piece_sprite in self.sprite_list:
+            if piece_sprite.selected:
+                break
+        else:
+            return
+        self.background = self.static_layer([piece_sprite])
+        self.dragging = piece_sprite
+        self.drag_offset = (piece_sprite.rect.x - pos[0],
+                            piece_sprite.rect.y - pos[1])
+
+    def drag(self, screen, pos):
+        """ Move the dragged sprite so that it follows the cursor.
+
+        Args: screen: Active pygame surface.
+              pos (int, int): Coordinates of mouse cursor.
+        """
+        piece_sprite = self.dragging
+        if piece_sprite is None:
+            return
+        old_rect = piece_sprite.rect.copy()
+        screen.blit(self.background, old_rect, old_rect)
+        piece_sprite.rect.topleft = (pos[0] + self.drag_offset[0],
+                                     pos[1] + self.drag_offset[1])
+        piece_sprite.rect.clamp_ip(self.board_rect)
+        screen.blit(piece_sprite.image, piece_sprite.rect)
+        if old_rect.colliderect(piece_sprite.rect):
+            self.updated_rects.append(old_rect.union(piece_sprite.rect))
+        else:
+            self.updated_rects.append(old_rect)
+            self.updated_rects.append(piece_sprite.rect.copy())
+
+    def end_drag(self, screen):
+        """ Stop dragging, returning the sprite to its square.
+
+        Args: screen: Active pygame surface.
+        """
+        piece_sprite = self.dragging
+        if piece_sprite is None:
+            return
+        old_rect = piece_sprite.rect.copy()
+        screen.blit(self.background, old_rect, old_rect)
+        x, y = self.coordinates_from_square(piece_sprite.piece.square)
+        piece_sprite.rect.topleft = x, y
+        screen.blit(piece_sprite.image, piece_sprite.rect)
+        self.updated_rects.append(old_rect.union(piece_sprite.rect))
+        self.dragging = None
+        self.background = None
+
     def process_move(self, screen, pos):
         """ Test a move indicated by user mouse movement.
-            Return move data (piece object, end square). 
+            Return move data (piece object, end square), or None if the
+            move is illegal or, in a puzzle, leaves the solution.
 
         Args: screen: Active pygame surface.
               pos (int, int): Coordinates of mouse cursor.
 
         """
-        if not self.board_rect.collidepoint(pos):
-            return None
-
         selected_sprite = None
         for piece_sprite in self.sprite_list:
             if piece_sprite.selected:
@@ -266,18 +550,55 @@ class Board(position.Position):
         if selected_sprite is None: 
             return None
 
+        self.end_drag(screen)
+
         dest_square = self.square_from_cursor(pos)
         selected = selected_sprite.piece
+        legal = movecache.MOVE_CACHE.get(self)
+
+        if (self.board_rect.collidepoint(pos) and
+            legal.is_legal(selected.square, dest_square)):
+            if self.keeps_to_solution(selected.square, dest_square):
+                return selected_sprite, dest_square
+            self.erase_text(screen)
+            self.print_text(screen, 'Not the solution, try again.')
+        selected_sprite.selected = False
+        PieceSprite.selected_count -= 1
+        return None
 
-        if (selected.is_valid_move(self, dest_square) and
-            self.is_legal_move(selected_sprite.piece, dest_square, 
-                               self.sprite_list) 
-           ):
-            return selected_sprite, dest_square
-        else:
-            selected_sprite.selected = False
-            PieceSprite.selected_count -= 1
-            return None
+    def keeps_to_solution(self, start, end):
+        """ Return True if the move from 'start' to 'end' may be played in
+            the puzzle: there is no puzzle, it is the opponent's move, or
+            the move follows a solution line.
+
+        Args: start (int, int): Square of the piece to move.
+              end (int, int): Destination square.
+        """
+        return (self.solution is None or self.turn != self.solution.solver
+                or self.solution.accepts(self, start, end))
+
+    def finish_move(self, screen):
+        """ Report the end of the game after a move played by the user
+            and, in a puzzle, either report it solved or queue the next
+            move of the solution.
+
+        Args: screen: Active pygame surface.
+        """
+        legal = movecache.MOVE_CACHE.get(self)
+        if legal.checkmate:
+            self.print_text(screen, 'Checkmate.')
+        elif legal.stalemate:
+            self.print_text(screen, 'Stalemate.')
+        elif self.is_repetition():
+            self.print_text(screen, 'Draw by repetition.')
+        # Answer a puzzle move with the next move of the line.
+        if self.solution is not None:
+            if self.solution.is_solved(self):
+                self.print_text(screen, 'Solved.')
+            else:
+                reply = self.solution.reply(self)
+                if reply is not None:
+                    self.play_line([reply])
 
     def find_piece_on_square(self, square):
         """ Search for a piece sprite whose square matches the passed square. 
@@ -291,7 +612,8 @@ class Board(position.Position):
         return
 
     def move_piece(self, screen, piece_sprite, end):
-        """ Move a piece sprite to the 'end' square. 
+        """ Move a piece sprite to the 'end' square, marking both squares
+            for update.
 
             Args: screen: Active pygame surface.
                   piece_sprite: Sprite to move.
@@ -301,10 +623,117 @@ class Board(position.Position):
         start = piece_sprite.piece.square
         src_rect = self.clear_square(screen, start)
         self.updated_rects.append(src_rect)
+        self.place_sprite(piece_sprite, end)
+        self.updated_rects.append(pygame.Rect(
+            self.coordinates_from_square(end),
+            (self.square_size, self.square_size)
+        ))
+
+    def place_sprite(self, piece_sprite, end):
+        """ Put a piece sprite on the 'end' square without drawing it,
+            deselecting it and showing any promotion.
+
+            Args: piece_sprite: Sprite to move.
+                  end (int, int): Destination coordinates.
+
+        """
         location = self.coordinates_from_square(end)
-        piece_sprite.update(location, end)
-        piece_sprite.selected = False
-        PieceSprite.selected_count -= 1
+        # A pawn reaching the last rank has been promoted on the board.
+        promotion = self.board[end[0]][end[1]]
+        if promotion == piece_sprite.piece.symbol:
+            promotion = None
+        piece_sprite.update(location, end, promotion)
+        if piece_sprite.selected:
+            piece_sprite.selected = False
+            PieceSprite.selected_count -= 1
+
+    def animate_move(self, screen, board_update_data, now,
+                     duration=ANIMATION_MS):
+        """ Start sliding the pieces moved by update_position to their new
+            squares. The slides are advanced by step_animations.
+
+        Args: screen: Active pygame surface.
+              board_update_data: tuple returned by update_position.
+              now (float): Current time in milliseconds.
+              duration (float): Length of the slide in milliseconds.
+        """
+        piece_sprite, end, capture, castle = board_update_data
+
+        if capture is not None:
+            captured_piece = self.find_piece_on_square(capture)
+            self.sprite_list.remove(captured_piece)
+
+        moves = [(piece_sprite, end)]
+        if castle is not None:
+            moves.append((self.find_piece_on_square(castle[0]), castle[1]))
+        self.background = self.static_layer([sprite for sprite, _ in moves])
+
+        if capture is not None:
+            # The captured piece disappears as the slide starts.
+            captured_rect = pygame.Rect(
+                self.coordinates_from_square(capture),
+                (self.square_size, self.square_size)
+            )
+            screen.blit(self.background, captured_rect, captured_rect)
+            self.updated_rects.append(captured_rect)
+
+        for sprite, square in moves:
+            origin = sprite.rect.topleft
+            self.place_sprite(sprite, square)
+            target = sprite.rect.topleft
+            sprite.rect.topleft = origin
+            self.animations.append(
+                Slide(sprite, origin, target, now, duration)
+            )
+
+    def play_line(self, moves):
+        """ Queue moves to be played on the board and animated one after
+            another by step_animations.
+
+        Args: moves: Sequence of (start, end) squares.
+        """
+        self.pending_moves.extend(moves)
+
+    def is_animating(self):
+        """ Return True while slides are running or moves are queued. """
+        return bool(self.animations or self.pending_moves)
+
+    def step_animations(self, screen, now):
+        """ Advance the running slides to time 'now', starting the next
+            queued move when they finish. A queued move which is no longer
+            legal, e.g. because the position changed since it was queued,
+            is dropped with the rest of the queue. Only the union of each
+            sprite's old and new rects is redrawn, from the cached static
+            layer.
+
+        Args: screen: Active pygame surface.
+              now (float): Current time in milliseconds.
+        """
+        if not self.animations:
+            if not self.pending_moves:
+                return
+            start, end = self.pending_moves.pop(0)
+            if not movecache.MOVE_CACHE.get(self).is_legal(start, end):
+                self.pending_moves = []
+                return
+            piece_sprite = self.find_piece_on_square(start)
+            board_update_data = self.update_position((piece_sprite, end))
+            self.animate_move(screen, board_update_data, now)
+
+        old_rects = [slide.sprite.rect.copy() for slide in self.animations]
+        for old_rect in old_rects:
+            screen.blit(self.background, old_rect, old_rect)
+        for slide in self.animations:
+            slide.sprite.rect.topleft = slide.position(now)
+        screen.blits([(slide.sprite.image, slide.sprite.rect)
+                      for slide in self.animations], doreturn=False)
+        for old_rect, slide in zip(old_rects, self.animations):
+            self.updated_rects.append(old_rect.union(slide.sprite.rect))
+
+        self.animations = [slide for slide in self.animations
+                           if not slide.finished(now)]
+        if not self.animations:
+            self.background = None
 
     def update_board(self, screen, board_update_data):
         """ Update the graphical board. 
@@ -335,44 +764,271 @@ class Board(position.Position):
         if castle is not None:
             castling_piece = self.find_piece_on_square(castle[0])
             self.move_piece(screen, castling_piece, castle[1])
-            self.moving_pieces.add(castling_sprite)
+            self.moving_pieces.add(castling_piece)
         
         self.moving_pieces.draw(screen)
 
+    def take_back(self, screen):
+        """ Take back the last move and redraw the board. Return True if a
+            move was taken back.
+
+        Args: screen: Active pygame surface.
+        """
+        if self.pop() is None:
+            return False
+        self.reset_sprites(screen)
+        return True
+
+    def redo_move(self, screen):
+        """ Replay the last move taken back and redraw the board. Return
+            True if a move was replayed.
+
+        Args: screen: Active pygame surface.
+        """
+        if self.redo() is None:
+            return False
+        self.reset_sprites(screen)
+        return True
+
+    def reset_sprites(self, screen):
+        """ Rebuild every sprite from the board and redraw everything.
+
+        Args: screen: Active pygame surface.
+        """
+        self.fen = self.generate_fen()
+        self.sprite_list.empty()
+        self.moving_pieces.empty()
+        PieceSprite.selected_count = 0
+        self.dragging = None
+        self.animations = []
+        self.pending_moves = []
+        self.add_sprites()
+        self.draw(screen, self.board_size)
+
+    def resize(self, screen, board_size):
+        """ Change the size of the board and redraw everything. Scaled
+            images and backgrounds come from the caches when possible.
+
+        Args: screen: Active pygame surface.
+              board_size (int): New width/height of the chessboard.
+        """
+        board_size = max(MIN_BOARD_SIZE, board_size - board_size % 8)
+        self.board_size = board_size
+        self.square_size = board_size // 8
+        self.board_rect = pygame.Rect(0, 0, board_size, board_size)
+        self.textbox.move(pygame.Rect(0, board_size, board_size,
+                                      TEXT_HEIGHT))
+
+        # Finish any drag or animation at once.
+        self.dragging = None
+        self.background = None
+        self.animations = []
+        for piece_sprite in self.sprite_list:
+            piece_sprite.load_image(piece_sprite.piece.symbol,
+                                    self.square_size, piece_sprite.dir)
+            piece_sprite.rect = piece_sprite.image.get_rect(
+                topleft=self.coordinates_from_square(piece_sprite.piece.square)
+            )
+        self.draw(screen, board_size)
+
+    def print_text(self, screen, text):
+        """ Print a line in the text box and mark it for update.
+
+        Args: screen: Active pygame surface.
+              text (str): Text to print.
+        """
+        area = self.textbox.print(screen, text)
+        if area is not None:
+            self.updated_rects.append(area)
+
+    def erase_text(self, screen):
+        """ Clear the text box. Lines are repainted by print_text, or by
+            flush_text if nothing is printed over them.
+
+        Args: screen: Active pygame surface.
+        """
+        self.textbox.clear(screen)
+
+    def flush_text(self, screen):
+        """ Erase the text left over since the last erase_text and mark it
+            for update. Called once per frame, before the display update.
+
+        Args: screen: Active pygame surface.
+        """
+        self.updated_rects.extend(self.textbox.flush(screen))
+
     def whole_board_update(self):
         """ Return True if the entire surface needs to be updated. """
-        return self.updated_rects == []
+        return self.full_update
 
     def clear_updated_rects(self):
         """ Empty the updated_rects field. """
         self.updated_rects = []
+        self.full_update = False
 
         
+class BoardGrid:
+    """ A grid of small boards for reviewing several positions at once.
+
+    The boards are not interactive and have no sprites. Every board is
+    drawn from one cached background and one atlas of pieces, with a single
+    Surface.blits call.
+
+    Attributes:
+        rect (pygame.Rect): Region covered by the grid.
+        columns (int): Number of boards in each row.
+        square_size (int): Width/height of a square on every board.
+        light: (rgb tuple): Colour of the light squares.
+        dark: (rgb tuple): Colour of the dark squares.
+        fens (str[]): FEN of the position in each cell.
+        boards: 8x8 board (see Position.board) of each cell.
+        updated_rects: List of screen regions changed since the last call
+                       to clear_updated_rects.
+
+    Methods: cell_rect, cell_at, set_cell, draw, clear_updated_rects
+
+    """
+
+    def __init__(self, fens, columns, rect, light=WHITE, dark=BLUE):
+        """ Constructor for BoardGrid.
+
+        Args: fens (str[]): FEN of the position in each cell.
+              columns (int): Number of boards in each row.
+              rect (pygame.Rect): Region covered by the grid.
+              light: (rgb tuple): Colour of the light squares.
+              dark: (rgb tuple): Colour of the dark squares.
+        """
+        self.rect = rect
+        self.columns = columns
+        cell = (min(rect.width, rect.height)
+                - GRID_GAP * (columns - 1)) // columns
+        self.square_size = max(1, cell // 8)
+        self.light = light
+        self.dark = dark
+        self.fens = list(fens)
+        self.boards = [position.Position(fen).board for fen in self.fens]
+        self.updated_rects = []
+
+    def cell_rect(self, index):
+        """ Return the Rect of the board in cell 'index'.
+
+        Args: index (int): Cell number, counting across the rows.
+        """
+        row, column = divmod(index, self.columns)
+        size = self.square_size * 8
+        step = size + GRID_GAP
+        return pygame.Rect(self.rect.left + column * step,
+                           self.rect.top + row * step, size, size)
+
+    def cell_at(self, pos):
+        """ Return the number of the cell containing 'pos', or None.
+
+        Args: pos (int, int): Screen coordinates.
+        """
+        for index in range(len(self.boards)):
+            if self.cell_rect(index).collidepoint(pos):
+                return index
+        return None
+
+    def _blit_sequence(self, index):
+        """ Return the (source, destination, area) triples drawing the
+            board in cell 'index'. """
+        size = self.square_size
+        left, top = self.cell_rect(index).topleft
+        atlas = piece_atlas(size)
+        sequence = [(board_background(size, self.light, self.dark),
+                     (left, top))]
+        for row, rank in enumerate(self.boards[index]):
+            for column, symbol in enumerate(rank):
+                if symbol != '-':
+                    sequence.append((atlas,
+                                     (left + column * size, top + row * size),
+                                     atlas_area(symbol, size)))
+        return sequence
+
+    def set_cell(self, screen, index, fen):
+        """ Show another position in one cell, redrawing only that cell.
+
+        Args: screen: Active pygame surface.
+              index (int): Cell number.
+              fen (str): FEN of the new position.
+        """
+        if index == len(self.boards):
+            self.fens.append(fen)
+            self.boards.append(position.Position(fen).board)
+        else:
+            self.fens[index] = fen
+            self.boards[index] = position.Position(fen).board
+        screen.blits(self._blit_sequence(index), doreturn=False)
+        self.updated_rects.append(self.cell_rect(index))
+
+    def draw(self, screen):
+        """ Draw every board in the grid.
+
+        Args: screen: Active pygame surface.
+        """
+        screen.fill(BLACK, self.rect)
+        sequence = []
+        for index in range(len(self.boards)):
+            sequence.extend(self._blit_sequence(index))
+        screen.blits(sequence, doreturn=False)
+        self.updated_rects.append(self.rect)
+
+    def clear_updated_rects(self):
+        """ Forget the regions changed so far. """
+        self.updated_rects = []
+
+
 class TextBox:
     """ Describes and manages the text box below the chess board.
 
+    Text is printed a line at a time. Clearing the box only rewinds to the
+    first line: each line is repainted when different text is printed on
+    it, and lines left over from before the clear are erased by flush.
+
     Attributes:
         text_rect (pygame.Rect): Rect describing the text box region.
         border ((int, int), (int, int):
             Start and end coordinates of the border line.
         colour (rgb tuple): Background colour.
-        font (pygame.Font): Text font.
+        font (pygame.Font): Text font, loaded on first use.
         self.x_offset: Horizontal distance of next blank line,
                        from left of text_rect.
         self.y_offset: Vertical distance of next blank line,
                        from top of text_rect.
+        lines (str[]): Text shown on each line, None for a blank line.
+        line (int): Number of lines printed since the last clear.
         
-    Methods: draw, print, clear
+    Methods: move, draw, line_rect, render, print, clear, flush
     
     """
     def __init__(self, rect, colour):
+        self.colour = colour
+        self._font = None
+        self.move(rect)
+
+    def move(self, rect):
+        """ Move the text box to a new region, emptying it.
+
+        Args: rect (pygame.Rect): New text box region.
+        """
         self.rect = rect
         self.border = ( (rect.left, rect.top+2),
                         (rect.left + rect.width, rect.top+2) )
-        self.colour = colour
-        self.font = pygame.font.SysFont('Arial', 16)
         self.x_offset = 20
-        self.y_offset = BOARD_SIZE + 20
+        self.y_offset = rect.top + 20
+        self.lines = []
+        self.line = 0
+
+    @property
+    def font(self):
+        # Loading pygame's bundled font avoids scanning the system fonts,
+        # and is deferred until there is text to print.
+        if self._font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            self._font = pygame.font.Font(FONT_NAME, FONT_SIZE)
+        return self._font
 
     def draw(self, screen):
         """ Draw the text box.
@@ -382,24 +1038,73 @@ class TextBox:
         """
         pygame.draw.rect(screen, self.colour, self.rect) 
         pygame.draw.line(screen, BLACK, self.border[0], self.border[1], 5)
+        self.lines = []
+
+    def line_rect(self, index):
+        """ Return the region of line 'index', clipped to the text box.
+
+        Args: index (int): Line number, from 0.
+        """
+        return pygame.Rect(
+            self.rect.left, self.rect.top + 20 + index * LINE_HEIGHT,
+            self.rect.width, LINE_HEIGHT
+        ).clip(self.rect)
+
+    def render(self, text, colour=BLACK):
+        """ Return a surface showing 'text', from the cache.
+
+        Args: text (str): Text to render.
+              colour (rgb tuple): Colour of the text.
+        """
+        return TEXT_CACHE.get((text, colour),
+                              lambda: self.font.render(text, True, colour))
 
     def print(self, screen, text):
-        """ Print text in the text box.
+        """ Print text on the next line of the text box. Return the region
+            repainted, or None if the line already showed 'text'.
 
         Args: screen: Active pygame surface.
               text (str): Text to print.        
         """
-        screen_text = self.font.render(text, True, BLACK)
-        screen.blit(screen_text, (self.x_offset, self.y_offset))
-        self.y_offset += 20
+        index = self.line
+        self.line += 1
+        self.y_offset += LINE_HEIGHT
+        if index < len(self.lines) and self.lines[index] == text:
+            return None
+        while len(self.lines) <= index:
+            self.lines.append(None)
+        self.lines[index] = text
+        area = self.line_rect(index)
+        if not area:
+            return None     # Below the bottom of the text box.
+        screen.fill(self.colour, area)
+        screen.blit(self.render(text), (self.x_offset, area.top),
+                    pygame.Rect(0, 0, max(0, area.right - self.x_offset),
+                                area.height))
+        return area
 
     def clear(self, screen):
-        """ Clear the text box. 
+        """ Rewind to the first line of the text box. Nothing is painted
+            until the next print or flush.
 
         Args: screen: Active pygame surface.
 
         """
-        pygame.draw.rect(screen, self.colour, self.rect) 
-        pygame.draw.line(screen, BLACK, self.border[0], self.border[1], 10)
         self.x_offset = 20
-        self.y_offset = BOARD_SIZE + 20
+        self.y_offset = self.rect.top + 20
+        self.line = 0
+
+    def flush(self, screen):
+        """ Erase the lines printed before the last clear and not printed
+            over since. Return the list of regions erased.
+
+        Args: screen: Active pygame surface.
+        """
+        erased = []
+        for index in range(self.line, len(self.lines)):
+            if self.lines[index] is not None:
+                area = self.line_rect(index)
+                screen.fill(self.colour, area)
+                erased.append(area)
+        del self.lines[self.line:]
+        return erased
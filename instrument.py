@@ -0,0 +1,125 @@
+"""
+Module for opt-in instrumentation of the hot paths.
+
+enable() replaces the instrumented methods with wrappers that count calls
+and accumulate time spent inside them; disable() puts the original methods
+back. While instrumentation is disabled the original methods are in place,
+so it costs nothing. Timings are inclusive: time spent in is_legal_move
+includes its calls to make_move and is_check.
+"""
+
+import functools
+import json
+import time
+
+import piece
+import position
+
+# Label -> [number of calls, total seconds].
+stats = {}
+
+# (owner, attribute name, original function) for every installed wrapper.
+_originals = []
+
+
+def targets(include_graphics=True):
+    """ Return (owner, attribute name, label) for every instrumented
+        method. The graphics methods are left out if pygame is missing.
+
+    Args: include_graphics (bool): Include the graphics.Board methods.
+    """
+    found = []
+    for cls in (piece.Pawn, piece.Knight, piece.Bishop, piece.Rook,
+                piece.Queen, piece.King):
+        found.append((cls, 'calculate_scope',
+                      cls.__name__ + '.calculate_scope'))
+    for name in ('is_check', 'is_legal_move', 'make_move', 'generate_fen'):
+        found.append((position.Position, name, 'Position.' + name))
+    if include_graphics:
+        try:
+            import graphics
+        except ImportError:
+            return found
+        for name in ('draw', 'update_board'):
+            found.append((graphics.Board, name, 'Board.' + name))
+    return found
+
+
+def _wrap(function, label):
+    """ Return a wrapper around 'function' recording its calls under
+        'label'. """
+    record = stats.setdefault(label, [0, 0.0])
+    clock = time.perf_counter
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record[0] += 1
+            record[1] += clock() - start
+
+    return wrapper
+
+
+def enable(include_graphics=True):
+    """ Install the instrumentation wrappers. Does nothing if they are
+        already installed.
+
+    Args: include_graphics (bool): Also instrument graphics.Board.
+    """
+    if _originals:
+        return
+    for owner, name, label in targets(include_graphics):
+        function = owner.__dict__[name]
+        _originals.append((owner, name, function))
+        setattr(owner, name, _wrap(function, label))
+
+
+def disable():
+    """ Remove the instrumentation wrappers, restoring the originals. """
+    while _originals:
+        owner, name, function = _originals.pop()
+        setattr(owner, name, function)
+
+
+def is_enabled():
+    """ Return True if the wrappers are installed. """
+    return bool(_originals)
+
+
+def reset():
+    """ Zero every counter. """
+    for record in stats.values():
+        record[0] = 0
+        record[1] = 0.0
+
+
+def report():
+    """ Return a dictionary of the statistics gathered so far, keyed by
+        label, ordered by total time. """
+    result = {}
+    for label, (calls, seconds) in sorted(stats.items(),
+                                          key=lambda item: -item[1][1]):
+        result[label] = {
+            'calls': calls,
+            'total_ms': seconds * 1000,
+            'mean_us': seconds * 1e6 / calls if calls else 0.0,
+        }
+    return result
+
+
+def to_json():
+    """ Return the statistics as a JSON string. """
+    return json.dumps(report(), indent=2)
+
+
+def dump(path):
+    """ Write the statistics to a JSON file.
+
+    Args: path (str): Name of the file to write.
+    """
+    with open(path, 'w') as f:
+        f.write(to_json())
+        f.write('\n')
@@ -1,50 +1,308 @@
+import time
+
+# Taken before anything else is imported, for the startup report.
+STARTED = time.perf_counter()
+
+import argparse
 import pygame
 
 import graphics
+import instrument
+import movecache
 import position        
-    
-def main():
+import replay
+import search
+import solution
+import telemetry
+
+# Milliseconds of hint search performed on each frame.
+HINT_BUDGET_MS = 10
+
+# Frames per second the main loop is limited to.
+FRAME_RATE = 60
+
+# Frames between refreshes of the performance overlay.
+OVERLAY_INTERVAL = 15
+
+# Boards in each row of the review grid.
+REVIEW_COLUMNS = 4
+
+
+def describe_hint(board, result):
+    """ Return a line of text describing a search result.
+
+    Args: board (graphics.Board): The board being searched.
+          result: (depth, best_move, score) tuple produced by a search.
+    """
+    depth, (start, end), score = result
+    move = board.algebraic(start) + '-' + board.algebraic(end)
+    if score >= search.MATE_SCORE - depth:
+        evaluation = 'mate in %d' % ((search.MATE_SCORE - score + 1) // 2)
+    elif score <= -search.MATE_SCORE + depth:
+        evaluation = 'mated in %d' % ((search.MATE_SCORE + score) // 2)
+    else:
+        evaluation = '%+d' % score
+    return 'Hint (depth %d): %s, %s' % (depth, move, evaluation)
+
+
+def review(screen, clock, fens):
+    """ Show positions in a grid until one of them is clicked. Return the
+        FEN of the clicked position, or None if the window was closed.
+
+    Args: screen: Active pygame surface.
+          clock (pygame.time.Clock): Clock limiting the frame rate.
+          fens (str[]): FENs of the positions. Only as many as fit in a
+                        REVIEW_COLUMNS x REVIEW_COLUMNS grid are shown.
+    """
+    fens = fens[:REVIEW_COLUMNS ** 2]
+    grid = graphics.BoardGrid(fens, REVIEW_COLUMNS, screen.get_rect())
+    grid.draw(screen)
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return None
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                return None
+            elif event.type == pygame.VIDEORESIZE:
+                screen = pygame.display.get_surface()
+                grid = graphics.BoardGrid(fens, REVIEW_COLUMNS,
+                                          screen.get_rect())
+                grid.draw(screen)
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                index = grid.cell_at(event.pos)
+                if index is not None:
+                    return grid.fens[index]
+        if grid.updated_rects:
+            pygame.display.update(grid.updated_rects)
+            grid.clear_updated_rects()
+        clock.tick(FRAME_RATE)
+
+
+def parse_args(argv=None):
+    """ Parse the command line.
+
+    Args: argv (str[]): Arguments to parse. Defaults to sys.argv.
+    """
+    parser = argparse.ArgumentParser(description='Chess Puzzle Trainer')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='instrument the hot paths and write the '
+                             'statistics to FILE as JSON on exit')
+    parser.add_argument('--telemetry', metavar='FILE',
+                        help='write the frame-time histogram of the '
+                             'session to FILE as JSON on exit')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='print the time taken by each startup phase')
+    parser.add_argument('--record', metavar='FILE',
+                        help='record mouse events to FILE for replay.py')
+    parser.add_argument('--review', metavar='FILE',
+                        help='pick the starting position from a grid of '
+                             'the FENs in FILE, one per line')
+    parser.add_argument('--puzzles', metavar='FILE',
+                        help='solve a puzzle from FILE, one solution line '
+                             'per row as written by pgn.py; several '
+                             'puzzles are shown in a grid to pick from')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """ Main program function. """
-    pygame.init()
-    pygame.font.init()
+    startup = telemetry.StartupTimer(STARTED)
+    startup.mark('imports')
+    args = parse_args(argv)
+    if args.profile:
+        instrument.enable()
+
+    # Only the display is needed for the first frame. The font module is
+    # initialised by the text box when it first prints.
+    pygame.display.init()
+    startup.mark('display init')
 
     size = [graphics.SCREEN_WIDTH, graphics.SCREEN_HEIGHT]
-    screen = pygame.display.set_mode(size)
+    screen = pygame.display.set_mode(size, pygame.RESIZABLE)
 
     pygame.display.set_caption("Chess Puzzle Trainer")
+    startup.mark('window')
 
     running = True
     clock = pygame.time.Clock()
-    board = graphics.Board(position.FEN_START)
+    fen = position.FEN_START
+    puzzles = {}
+    fens = []
+    if args.puzzles:
+        puzzles = solution.load(args.puzzles)
+        fens = list(puzzles)
+    elif args.review:
+        with open(args.review) as f:
+            fens = [line.strip() for line in f if line.strip()]
+    if len(fens) == 1 and not args.review:
+        fen = fens[0]
+    elif fens:
+        fen = review(screen, clock, fens)
+        if fen is None:
+            pygame.quit()
+            return
+        screen = pygame.display.get_surface()
+        startup.mark('review')
+    board = graphics.Board(fen)
+    board.solution = puzzles.get(fen)
     board.add_sprites()
-    board.draw(screen, graphics.BOARD_SIZE)
+    if screen.get_size() != tuple(size):
+        width, height = screen.get_size()
+        board.resize(screen, min(width, height - graphics.TEXT_HEIGHT))
+    startup.mark('sprites')
+    board.draw(screen, board.board_size)
+    pygame.display.update()
+    startup.mark('first frame')
+    if args.startup_report:
+        for line in startup.report():
+            print(line)
+    hint = None
+    hint_move = None
+    hint_played = None
+    recorder = None
+    if args.record:
+        recorder = replay.Recorder(args.record, board.fen, board.solution)
+    frame_stats = telemetry.FrameStats()
+    show_overlay = False
+    drop_time = None
+    frame_start = time.perf_counter()
 
     while running:
+        drag_pos = None
         for event in pygame.event.get():
+            if recorder is not None:
+                recorder.record(event)
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.VIDEORESIZE:
+                screen = pygame.display.get_surface()
+                board.resize(screen, min(event.w,
+                                         event.h - graphics.TEXT_HEIGHT))
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
                 running = False
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_d:
                 board.erase_text(screen)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+                show_overlay = not show_overlay
+                board.erase_text(screen)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_LEFT:
+                if hint is not None:
+                    hint.close()
+                    hint = None
+                hint_move = None
+                board.take_back(screen)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_RIGHT:
+                if hint is not None:
+                    hint.close()
+                    hint = None
+                hint_move = None
+                board.redo_move(screen)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_h:
+                # The position changes once the queued moves are played.
+                if board.is_animating():
+                    continue
+                if hint is not None:
+                    hint.close()
+                hint = search.Search(board.fen)
+                board.erase_text(screen)
+                board.print_text(screen, 'Thinking...')
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
+                # Play the hinted move, if the puzzle allows it.
+                if hint_move is None or board.is_animating():
+                    continue
+                if not board.keeps_to_solution(*hint_move):
+                    board.erase_text(screen)
+                    board.print_text(screen, 'Not the solution, try again.')
+                else:
+                    board.play_line([hint_move])
+                    hint_played = board.ply
+                    if recorder is not None:
+                        recorder.record_hint(*hint_move)
+                if hint is not None:
+                    hint.close()
+                    hint = None
+                hint_move = None
             elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                if board.is_animating():
+                    continue
+                # Any move makes the hint obsolete.
+                if hint is not None:
+                    hint.close()
+                    hint = None
+                hint_move = None
                 board.select_piece(event.pos)
+                board.start_drag(event.pos)
+            elif event.type == pygame.MOUSEMOTION:
+                # Only the latest position matters for this frame.
+                drag_pos = event.pos
             elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                drag_pos = None
+                drop_time = time.perf_counter()
                 move_data = board.process_move(screen, event.pos)
                 if move_data is not None:
+                    # A hint asked for while dragging is now obsolete.
+                    if hint is not None:
+                        hint.close()
+                        hint = None
+                    hint_move = None
                     board_update_data = board.update_position(move_data)
                     board.update_board(screen, board_update_data)
+                    board.finish_move(screen)
+
+        if drag_pos is not None:
+            board.drag(screen, drag_pos)
+        board.step_animations(screen, time.perf_counter() * 1000)
+        # A hinted move is finished like a dropped one once it has slid.
+        if hint_played is not None and not board.is_animating():
+            if board.ply > hint_played:
+                board.finish_move(screen)
+            hint_played = None
+
+        # Think about the hint for a fixed slice of the frame.
+        if hint is not None:
+            results = hint.step(HINT_BUDGET_MS)
+            if results:
+                hint_move = results[-1][1]
+                board.erase_text(screen)
+                board.print_text(screen, describe_hint(board, results[-1]))
+            if hint.finished:
+                hint = None
+
+        if show_overlay and frame_stats.frames % OVERLAY_INTERVAL == 0:
+            board.erase_text(screen)
+            for line in frame_stats.summary():
+                board.print_text(screen, line)
+            cache = movecache.MOVE_CACHE
+            board.print_text(screen, 'Move cache %d/%d  hit rate %.0f%%' % (
+                len(cache), cache.capacity, 100 * cache.hit_rate()))
 
         # Update the screen
+        board.flush_text(screen)
         if board.whole_board_update():
+            rect_count = None
             pygame.display.update()
         else:
-            pygame.display.update(board.updated_rects)
-            board.clear_updated_rects()
+            rect_count = len(board.updated_rects)
+            if rect_count:
+                pygame.display.update(board.updated_rects)
+        board.clear_updated_rects()
 
-        clock.tick(30)
+        presented = time.perf_counter()
+        if drop_time is not None:
+            frame_stats.record_latency((presented - drop_time) * 1000)
+            drop_time = None
+        busy_ms = (presented - frame_start) * 1000
+        frame_ms = clock.tick(FRAME_RATE)
+        frame_start = time.perf_counter()
+        frame_stats.record_frame(frame_ms, busy_ms, rect_count)
 
     pygame.quit()
+    if recorder is not None:
+        recorder.close()
+    if args.profile:
+        instrument.dump(args.profile)
+    if args.telemetry:
+        frame_stats.dump(args.telemetry)
 
 if __name__ == "__main__":
     main()
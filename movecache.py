@@ -0,0 +1,152 @@
+"""
+Module for caching the legal moves of positions.
+
+Puzzles are retried and solutions are checked over and over, reaching the
+same positions each time. The legal moves of a position, and whether it is
+check, mate or stalemate, are kept in a least recently used cache keyed by
+its Zobrist key (see Position.key), so they are only generated once.
+
+The cache trusts the key: a position whose board was changed without push
+or pop must not be looked up.
+"""
+
+import collections
+
+# Default number of positions kept.
+CACHE_CAPACITY = 2048
+
+
+class LegalMoves:
+    """ Legal moves of a position and the facts derived from them.
+
+    Attributes:
+        moves: List of legal (piece, end) moves, in the order of
+               Position.generate_moves.
+        targets (dict): Set of destination squares of the moves, keyed by
+                        start square.
+        check (bool): True if the side to move is in check.
+        checkmate (bool): True if the side to move is mated.
+        stalemate (bool): True if the side to move is stalemated.
+
+    Methods: is_legal, ordered
+
+    """
+
+    def __init__(self, position):
+        """ Generate the legal moves of 'position'.
+
+        Args: position (Position): Position to examine.
+        """
+        self.moves = list(position.legal_moves())
+        self.targets = {}
+        for own_piece, end in self.moves:
+            self.targets.setdefault(own_piece.square, set()).add(end)
+        self.check = position.is_check()
+        self.checkmate = self.check and not self.moves
+        self.stalemate = not self.check and not self.moves
+
+    def is_legal(self, start, end):
+        """ Return True if the piece on 'start' may legally move to 'end'.
+
+        Args: start (int, int): Square of the piece to move.
+              end (int, int): Destination square.
+        """
+        return end in self.targets.get(start, ())
+
+    def ordered(self, first=None):
+        """ Return the moves with the move from 'first[0]' to 'first[1]'
+            put first, if it is legal.
+
+        Args: first ((int, int), (int, int)): Optional (start, end) move,
+                  e.g. the best move of a previous search.
+        """
+        if first is None or not self.is_legal(*first):
+            return self.moves
+        head = [move for move in self.moves
+                if (move[0].square, move[1]) == first]
+        return head + [move for move in self.moves
+                       if (move[0].square, move[1]) != first]
+
+
+class MoveCache:
+    """ Least recently used cache of LegalMoves keyed by position key.
+
+    Attributes:
+        capacity (int): Maximum number of positions kept.
+        entries (OrderedDict): Cached LegalMoves, least recently used first.
+        hits (int): Number of calls to get served from the cache.
+        misses (int): Number of calls to get that generated the moves.
+
+    Methods: get, is_checkmate, clear, hit_rate, stats
+
+    """
+
+    def __init__(self, capacity=CACHE_CAPACITY):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, position):
+        """ Return the LegalMoves of 'position', generating them if they
+            are missing and evicting the least recently used positions
+            beyond capacity.
+
+        Args: position (Position): Position to look up.
+        """
+        key = position.key
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        entry = LegalMoves(position)
+        self.entries[key] = entry
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return entry
+
+    def is_checkmate(self, position):
+        """ Return True if the side to move in 'position' is mated. A
+            cached position is answered from the cache; otherwise the test
+            stops at the first legal move found, and nothing is cached.
+            Either way the hit and miss counters, which measure get, are
+            left unchanged.
+
+        Args: position (Position): Position to examine.
+        """
+        entry = self.entries.get(position.key)
+        if entry is not None:
+            self.entries.move_to_end(position.key)
+            return entry.checkmate
+        return position.is_checkmate()
+
+    def clear(self):
+        """ Empty the cache and reset the counters. """
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        """ Return the fraction of lookups served from the cache. """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """ Return a dictionary of the size, capacity, hits, misses and hit
+            rate of the cache. """
+        return {
+            'size': len(self.entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate(),
+        }
+
+
+# Cache shared by the board, the hints and solution checking.
+MOVE_CACHE = MoveCache()
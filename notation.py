@@ -0,0 +1,295 @@
+"""
+Module for reading and writing moves in standard algebraic notation (SAN)
+and in the coordinate notation of the UCI protocol.
+
+Moves are given as (piece, end, promotion) triples, where piece is a Piece
+of the side to move, end the destination square and promotion the symbol
+of the piece a pawn becomes on the last rank, or None.
+
+Both parse_san and format_san find the legal moves to the destination
+square with one backward pass from that square, instead of calculating the
+scope of every piece of the moving kind. The line functions convert whole
+solution lines on a single position, reading check and mate from the
+position reached rather than trying each move twice.
+"""
+
+import re
+
+import piece
+
+SAN_REGEX = re.compile(
+    r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$'
+)
+
+UCI_REGEX = re.compile(r'([a-h][1-8])([a-h][1-8])([nbrq])?$')
+
+CASTLING_SAN = {'O-O': 6, 'O-O-O': 2, '0-0': 6, '0-0-0': 2}
+
+FILES = 'abcdefgh'
+
+
+def square_name(square):
+    """ Return the algebraic name of a square, e.g. 'e4'.
+
+    Args: square (int, int): Array coordinates of the square.
+    """
+    return FILES[square[1]] + str(8 - square[0])
+
+
+def name_square(name):
+    """ Return the array coordinates of a square named e.g. 'e4'.
+
+    Args: name (str): Algebraic name of the square.
+    """
+    return 8 - int(name[1]), FILES.index(name[0])
+
+
+def legal_movers(position, end):
+    """ Return (square, symbol) for each piece of the side to move that
+        can legally move to 'end', castling excepted.
+
+    Args: position (Position): Position in which the move is played.
+          end (int, int): Destination square.
+    """
+    return [(start, symbol) for start, symbol in movers(position, end)
+            if _is_legal(position, start, symbol, end)]
+
+
+def movers(position, end):
+    """ Return (square, symbol) for each piece of the side to move that
+        can move to 'end' if the move does not leave its king in check,
+        castling excepted. Works backwards from 'end', so no piece scopes
+        are calculated.
+
+    Args: position (Position): Position in which the move is played.
+          end (int, int): Destination square.
+    """
+    colour = position.turn
+    target = position.board[end[0]][end[1]]
+    if target != '-' and target.isupper() == (colour == 'w'):
+        return []
+    capture = target != '-' or square_name(end) == position.en_passant
+
+    found = []
+    for start, symbol in position.attackers(end, colour):
+        # Pawns only move diagonally to capture.
+        if capture or symbol not in 'Pp':
+            found.append((start, symbol))
+    if target == '-':
+        found.extend((start, symbol) for start, symbol
+                     in position.movers_to(end, colour)
+                     if start[1] == end[1] and symbol in 'Pp')
+    return found
+
+
+def _is_legal(position, start, symbol, end):
+    return position.is_legal_move(piece.PieceFactory.create(symbol, start),
+                                  end)
+
+
+def parse_san(position, san):
+    """ Return the legal (piece, end, promotion) move described by 'san'.
+        Raise ValueError if no legal move, or more than one, matches.
+
+    Args: position (Position): Position in which the move is played.
+          san (str): Move in SAN, e.g. 'Nbd7', 'exd8=Q+' or 'O-O'.
+    """
+    text = san.rstrip('+#!?')
+    colour = position.turn
+
+    if text in CASTLING_SAN:
+        if colour == 'w':
+            row, col = position.white_king
+        else:
+            row, col = position.black_king
+        king = piece.PieceFactory.create(position.board[row][col], (row, col))
+        end = row, CASTLING_SAN[text]
+        if (col == 4 and end in king.calculate_scope(position)
+                and position.is_legal_move(king, end)):
+            return king, end, None
+        raise ValueError('Illegal move: %s' % san)
+
+    match = SAN_REGEX.match(text)
+    if not match:
+        raise ValueError('Invalid SAN: %s' % san)
+    kind, file, rank, destination, promotion = match.groups()
+    symbol = kind or 'P'
+    if colour == 'b':
+        symbol = symbol.lower()
+        promotion = promotion and promotion.lower()
+    end = name_square(destination)
+    if file is None and kind is None:
+        file = destination[0]     # A pawn move without a file is a push.
+
+    found = [
+        start for start, mover in movers(position, end)
+        if mover == symbol
+        and (file is None or start[1] == FILES.index(file))
+        and (rank is None or start[0] == 8 - int(rank))
+        and _is_legal(position, start, symbol, end)
+    ]
+    if not found:
+        raise ValueError('Illegal move: %s' % san)
+    if len(found) > 1:
+        raise ValueError('Ambiguous move: %s' % san)
+    return piece.PieceFactory.create(symbol, found[0]), end, promotion
+
+
+def format_san(position, own_piece, end, promotion=None, check=True):
+    """ Return the SAN of a legal move.
+
+    Args: position (Position): Position in which the move is played.
+          own_piece (Piece): The piece to move.
+          end (int, int): Destination square.
+          promotion (str): Optional promotion piece symbol. Pawns reaching
+                           the last rank become queens by default.
+          check (bool): Append '+' or '#' for check or mate. This plays
+                        the move and takes it back.
+    """
+    start = own_piece.square
+    symbol = own_piece.symbol
+    kind = symbol.upper()
+
+    if kind == 'K' and abs(end[1] - start[1]) == 2:
+        san = 'O-O' if end[1] == 6 else 'O-O-O'
+    elif kind == 'P':
+        san = ''
+        if start[1] != end[1]:
+            san = FILES[start[1]] + 'x'
+        san += square_name(end)
+        if end[0] in (0, 7):
+            san += '=' + (promotion or 'Q').upper()
+    else:
+        rivals = [square for square, mover in movers(position, end)
+                  if mover == symbol and square != start
+                  and _is_legal(position, square, symbol, end)]
+        origin = square_name(start)
+        if not rivals:
+            qualifier = ''
+        elif all(square[1] != start[1] for square in rivals):
+            qualifier = origin[0]
+        elif all(square[0] != start[0] for square in rivals):
+            qualifier = origin[1]
+        else:
+            qualifier = origin
+        capture = position.board[end[0]][end[1]] != '-'
+        san = kind + qualifier + ('x' if capture else '') + square_name(end)
+
+    if check:
+        san += _check_suffix(position, own_piece, end, promotion)
+    return san
+
+
+def _check_suffix(position, own_piece, end, promotion):
+    """ Return '+' if the move gives check, '#' if it mates, else ''. """
+    with position.trial_move(own_piece, end, promotion):
+        return _suffix(position)
+
+
+def _suffix(position):
+    """ Return '+' or '#' if the side to move is in check or mated. """
+    if not position.is_check():
+        return ''
+    return '+' if position.has_legal_move() else '#'
+
+
+def parse_uci(position, uci):
+    """ Return the legal (piece, end, promotion) move described by 'uci'.
+        Raise ValueError if the move is invalid or illegal.
+
+    Args: position (Position): Position in which the move is played.
+          uci (str): Move in UCI notation, e.g. 'g1f3' or 'e7e8q'.
+    """
+    match = UCI_REGEX.match(uci)
+    if not match:
+        raise ValueError('Invalid UCI move: %s' % uci)
+    start, end = name_square(match.group(1)), name_square(match.group(2))
+    symbol = position.board[start[0]][start[1]]
+    if symbol == '-' or symbol.isupper() != (position.turn == 'w'):
+        raise ValueError('Illegal move: %s' % uci)
+    promotion = match.group(3)
+    if promotion and position.turn == 'w':
+        promotion = promotion.upper()
+    own_piece = piece.PieceFactory.create(symbol, start)
+    if symbol in 'Kk' and abs(end[1] - start[1]) == 2:
+        legal = (start[1] == 4
+                 and end in own_piece.calculate_scope(position)
+                 and position.is_legal_move(own_piece, end))
+    else:
+        legal = ((start, symbol) in movers(position, end)
+                 and _is_legal(position, start, symbol, end))
+    if not legal:
+        raise ValueError('Illegal move: %s' % uci)
+    return own_piece, end, promotion
+
+
+def format_uci(own_piece, end, promotion=None):
+    """ Return the UCI notation of a move.
+
+    Args: own_piece (Piece): The piece to move.
+          end (int, int): Destination square.
+          promotion (str): Optional promotion piece symbol. Pawns reaching
+                           the last rank become queens by default.
+    """
+    uci = square_name(own_piece.square) + square_name(end)
+    if own_piece.symbol in 'Pp' and end[0] in (0, 7):
+        uci += (promotion or 'q').lower()
+    return uci
+
+
+def parse_line(position, moves, parse=parse_san):
+    """ Play a line of moves on 'position', returning the list of
+        (piece, end, promotion) moves. Raise ValueError at the first
+        invalid move, leaving the moves before it played.
+
+    Args: position (Position): Starting position, updated in place.
+          moves (str[]): Moves in SAN or UCI notation.
+          parse: parse_san or parse_uci.
+    """
+    parsed = []
+    for move in moves:
+        own_piece, end, promotion = parse(position, move)
+        position.push(own_piece, end, promotion)
+        parsed.append((own_piece, end, promotion))
+    return parsed
+
+
+def format_line(position, moves):
+    """ Play a line of (piece, end, promotion) moves on 'position',
+        returning the SAN of each. Check and mate are read from the
+        position each move reaches.
+
+    Args: position (Position): Starting position, updated in place.
+          moves: List of (piece, end, promotion) moves.
+    """
+    sans = []
+    for own_piece, end, promotion in moves:
+        san = format_san(position, own_piece, end, promotion, check=False)
+        position.push(own_piece, end, promotion)
+        sans.append(san + _suffix(position))
+    return sans
+
+
+def san_to_uci(position, sans):
+    """ Convert a line of SAN moves played from 'position' to UCI.
+
+    Args: position (Position): Starting position, updated in place.
+          sans (str[]): Moves in SAN.
+    """
+    return [format_uci(own_piece, end, promotion)
+            for own_piece, end, promotion in parse_line(position, sans)]
+
+
+def uci_to_san(position, ucis):
+    """ Convert a line of UCI moves played from 'position' to SAN.
+
+    Args: position (Position): Starting position, updated in place.
+          ucis (str[]): Moves in UCI notation.
+    """
+    sans = []
+    for uci in ucis:
+        own_piece, end, promotion = parse_uci(position, uci)
+        san = format_san(position, own_piece, end, promotion, check=False)
+        position.push(own_piece, end, promotion)
+        sans.append(san + _suffix(position))
+    return sans
@@ -0,0 +1,225 @@
+"""
+Module for mining puzzle candidates from PGN game collections.
+
+Games are streamed from the file a line at a time, so collections of any
+size can be read. The file is split into byte ranges aligned to the start
+of a game, and the ranges are shared among worker processes:
+
+    python pgn.py games.pgn -o candidates.tsv --workers 8 --mate 2
+
+Each output line holds the FEN of a position in which the side to move has
+a forced mate, a tab, and the mating line in SAN.
+"""
+
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+
+import notation
+import position
+import search
+
+# Bytes of the file given to a worker at a time.
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Every game starts with its Event tag.
+GAME_START = b'[Event '
+
+TAG_REGEX = re.compile(r'\[(\w+)\s+"(.*)"\]')
+
+# Comments, variations (innermost first), NAGs, move numbers and results.
+COMMENT_REGEX = re.compile(r'\{[^}]*\}|;[^\n]*')
+VARIATION_REGEX = re.compile(r'\([^()]*\)')
+NOISE_REGEX = re.compile(r'\$\d+|\d+\.(\.\.)?|1-0|0-1|1/2-1/2|\*')
+
+RESULTS = {'1-0': 'w', '0-1': 'b'}
+
+
+def games(file, start=0, end=None):
+    """ Generate (headers, moves) for each game starting in the byte range
+        [start, end) of an open binary file. headers is a dictionary of the
+        tag pairs and moves the list of SAN moves of the main line.
+
+    Args: file: PGN file opened in binary mode.
+          start (int): Offset of the start of a game.
+          end (int): Offset at which to stop. Defaults to the end of file.
+    """
+    file.seek(start)
+    offset = start
+    headers = {}
+    movetext = []
+    for line in file:
+        if line.startswith(GAME_START) and (headers or movetext):
+            yield headers, split_moves(' '.join(movetext))
+            headers, movetext = {}, []
+        if end is not None and offset >= end and line.startswith(GAME_START):
+            return
+        offset += len(line)
+        text = line.decode('utf-8', 'replace').strip()
+        if text.startswith('['):
+            match = TAG_REGEX.match(text)
+            if match:
+                headers[match.group(1)] = match.group(2)
+        elif text:
+            movetext.append(text)
+    if headers or movetext:
+        yield headers, split_moves(' '.join(movetext))
+
+
+def split_moves(movetext):
+    """ Return the SAN moves of the main line of a game's movetext.
+
+    Args: movetext (str): Movetext of one game.
+    """
+    movetext = COMMENT_REGEX.sub(' ', movetext)
+    while True:
+        stripped = VARIATION_REGEX.sub(' ', movetext)
+        if stripped == movetext:
+            break
+        movetext = stripped
+    return NOISE_REGEX.sub(' ', movetext).split()
+
+
+def candidates(headers, moves, max_moves=2, window=10):
+    """ Generate (fen, line) for each position of a game in which the side
+        to move has a forced mate in at most 'max_moves' moves. line is the
+        list of SAN moves of the mate. Only positions with the eventual
+        winner to move, within 'window' moves of the end of a decisive
+        game, are searched. Games with unreadable moves are cut short.
+
+    Args: headers (dict): Tag pairs of the game.
+          moves (str[]): SAN moves of the game.
+          max_moves (int): Longest mate looked for.
+          window (int): Number of the winner's last moves searched, or 0
+                        to search every position of the game.
+    """
+    winner = RESULTS.get(headers.get('Result'))
+    if winner is None:
+        return
+    try:
+        game = position.Position(headers.get('FEN', position.FEN_START))
+    except ValueError:
+        return
+    first = 0
+    if window:
+        first = max(0, len(moves) - 2 * window)
+
+    for ply, san in enumerate(moves):
+        if ply >= first and game.turn == winner:
+            fen = game.generate_fen()
+            line = search.mate_in(fen, max_moves)
+            if line is not None:
+                yield fen, notation.format_line(
+                    position.Position(fen),
+                    [(own_piece, end, None) for own_piece, end in line]
+                )
+        try:
+            own_piece, end, promotion = notation.parse_san(game, san)
+        except ValueError:
+            return
+        game.push(own_piece, end, promotion)
+
+
+def shards(path, chunk_size=CHUNK_SIZE):
+    """ Return (start, end) byte ranges covering a PGN file, each starting
+        at the beginning of a game.
+
+    Args: path (str): Name of the PGN file.
+          chunk_size (int): Approximate length of a range.
+    """
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, 'rb') as f:
+        offset = chunk_size
+        while offset < size:
+            start = _next_game(f, offset)
+            if start >= size:
+                break
+            if start > starts[-1]:
+                starts.append(start)
+            offset = max(start, offset) + chunk_size
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _next_game(f, offset):
+    """ Return the offset of the first game starting after 'offset'. """
+    f.seek(offset)
+    f.readline()    # Skip the rest of a partly read line.
+    position_in_file = f.tell()
+    for line in f:
+        if line.startswith(GAME_START):
+            return position_in_file
+        position_in_file += len(line)
+    return position_in_file
+
+
+def mine(path, start, end, max_moves=2, window=10):
+    """ Return the candidates of the games in one byte range of a file as
+        a list of (fen, line) pairs.
+
+    Args: path (str): Name of the PGN file.
+          start (int): Offset of the start of the range.
+          end (int): Offset of the end of the range.
+          max_moves (int): Longest mate looked for.
+          window (int): See candidates.
+    """
+    found = []
+    with open(path, 'rb') as f:
+        for headers, moves in games(f, start, end):
+            found.extend(candidates(headers, moves, max_moves, window))
+    return found
+
+
+def _mine_shard(args):
+    return mine(*args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Mine mate puzzles from a PGN file.'
+    )
+    parser.add_argument('pgn')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the candidates to FILE instead of '
+                             'standard output')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--mate', type=int, default=2,
+                        help='longest mate looked for, in moves')
+    parser.add_argument('--window', type=int, default=10,
+                        help="winner's moves searched at the end of each "
+                             "game; 0 searches whole games")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='bytes of the file given to a worker at a time')
+    args = parser.parse_args(argv)
+
+    jobs = [(args.pgn, start, end, args.mate, args.window)
+            for start, end in shards(args.pgn, args.chunk_size)]
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        if args.workers > 1:
+            with multiprocessing.Pool(args.workers) as pool:
+                results = pool.imap_unordered(_mine_shard, jobs)
+                for found in results:
+                    _write(output, found)
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                _write(output, _mine_shard(job))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+def _write(output, found):
+    for fen, line in found:
+        output.write('%s\t%s\n' % (fen, ' '.join(line)))
+    output.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,17 @@
 from abc import ABC, abstractmethod
 
+# Material values in pawns, indexed by lower case symbol. The king is given
+# a prohibitive value so that it is always the last piece to recapture.
+VALUES = {'p': 1, 'n': 3, 'b': 3, 'r': 5, 'q': 9, 'k': 100}
+
+# (row, column) steps taken by each kind of piece.
+KNIGHT_STEPS = ((1, 2), (2, 1), (2, -1), (1, -2),
+                (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+KING_STEPS = ((0, 1), (1, 1), (1, 0), (1, -1),
+              (0, -1), (-1, -1), (-1, 0), (-1, 1))
+DIAGONAL_STEPS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+LINE_STEPS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+
 class PieceFactory:
     """ Factory to create Piece subclasses. """
     @staticmethod
@@ -58,14 +70,35 @@ class Piece(ABC):
         square (int, int): current location of the piece.
 
     Methods:
-        calculate_scope, remove, legal_move, generate_diagonals, 
-        generate_lines, test_square, test_squares_until
+        calculate_scope, attacks, calculate_captures, remove, legal_move,
+        generate_diagonals, 
+        generate_lines, test_square, test_squares_until, attacks_by_steps,
+        attacks_along
     """
 
     @abstractmethod
     def calculate_scope(self, position):
         pass
 
+    @abstractmethod
+    def attacks(self, board):
+        pass
+
+    def calculate_captures(self, position):
+        """ Return the squares on which the piece can capture an enemy
+            piece. Cheaper than filtering calculate_scope, since sliding
+            pieces only look at the end of each ray.
+
+        Args: position (Position): Current position.
+        """
+        board = position.board
+        if self.symbol.isupper():
+            enemy = str.islower
+        else:
+            enemy = str.isupper
+        return [(row, col) for row, col in self.attacks(board)
+                if enemy(board[row][col])]
+
     def is_valid_move(self, position, dest_square):
         """ Return True if the move is valid, False otherwise. 
 
@@ -145,6 +178,34 @@ class Piece(ABC):
                 break
         return valid_squares
 
+    def attacks_by_steps(self, steps):
+        """ Return the on-board squares a single step away from the piece.
+
+        Args: steps: Sequence of (row, column) steps.
+        """
+        row, col = self.square
+        return [(row+dr, col+dc) for dr, dc in steps
+                if 0 <= row+dr <= 7 and 0 <= col+dc <= 7]
+
+    def attacks_along(self, board, steps):
+        """ Return the squares attacked along rays from the piece's square.
+            Each ray stops at (and includes) the first occupied square.
+
+        Args: board (str[][]): Textual representation of a chess position.
+              steps: Sequence of (row, column) ray directions.
+        """
+        attacked = []
+        for dr, dc in steps:
+            row = self.square[0] + dr
+            col = self.square[1] + dc
+            while 0 <= row <= 7 and 0 <= col <= 7:
+                attacked.append((row, col))
+                if board[row][col] != '-':
+                    break
+                row += dr
+                col += dc
+        return attacked
+
 class Pawn(Piece):
     """ Class representing a pawn. Subclass of Piece. 
     
@@ -153,7 +214,7 @@ class Pawn(Piece):
         square (int, int): current location of the piece.
 
     Methods:
-        calculate_scope, test_and_add_squares
+        calculate_scope, attacks, calculate_captures, test_and_add_squares
     """
     def __init__(self, symbol, square):
         self.symbol = symbol
@@ -194,6 +255,22 @@ class Pawn(Piece):
             test_and_add_squares(row+1, row+2, 1, str.isupper)
 
         return scope
+
+    def attacks(self, board):
+        """ Return the two forward diagonal squares, whatever occupies them.
+
+        Args: board (str[][]): Textual representation of a chess position.
+        """
+        direction = -1 if self.symbol.isupper() else 1
+        return self.attacks_by_steps(((direction, -1), (direction, 1)))
+
+    def calculate_captures(self, position):
+        captures = super().calculate_captures(position)
+        if position.en_passant != '-':
+            square = position.square(position.en_passant)
+            if square in self.attacks(position.board):
+                captures.append(square)
+        return captures
         
 
 class Knight(Piece):
@@ -204,7 +281,7 @@ class Knight(Piece):
         square (int, int): current location of the piece.
 
     Methods:
-        calculate_scope
+        calculate_scope, attacks
     """
     def __init__(self, symbol, square):
         self.symbol = symbol 
@@ -239,6 +316,9 @@ class Knight(Piece):
 
         return scope
 
+    def attacks(self, board):
+        return self.attacks_by_steps(KNIGHT_STEPS)
+
 
 class Bishop(Piece):
     """ Class representing a bishop. Subclass of Piece. 
@@ -248,7 +328,7 @@ class Bishop(Piece):
         square (int, int): current location of the piece.
 
     Methods:
-        calculate_scope
+        calculate_scope, attacks
     """
     def __init__(self, symbol, square):
         self.symbol = symbol 
@@ -273,6 +353,9 @@ class Bishop(Piece):
             scope.extend(squares)
         return scope
 
+    def attacks(self, board):
+        return self.attacks_along(board, DIAGONAL_STEPS)
+
 
 class Rook(Piece):
     """ Class representing a rook. Subclass of Piece. 
@@ -282,7 +365,7 @@ class Rook(Piece):
         square (int, int): current location of the piece.
 
     Methods:
-        calculate_scope
+        calculate_scope, attacks
     """
     def __init__(self, symbol, square):
         self.symbol = symbol 
@@ -307,6 +390,9 @@ class Rook(Piece):
             scope.extend(squares)
         return scope
 
+    def attacks(self, board):
+        return self.attacks_along(board, LINE_STEPS)
+
 
 class Queen(Piece):
     """ Class representing a queen. Subclass of Piece. 
@@ -316,7 +402,7 @@ class Queen(Piece):
         square (int, int): current location of the piece.
 
     Methods:
-        calculate_scope
+        calculate_scope, attacks
     """
     def __init__(self, symbol, square):
         self.symbol = symbol 
@@ -348,6 +434,9 @@ class Queen(Piece):
 
         return scope
 
+    def attacks(self, board):
+        return self.attacks_along(board, DIAGONAL_STEPS + LINE_STEPS)
+
 
 class King(Piece):
     """ Class representing a king. Subclass of Piece. 
@@ -357,7 +446,7 @@ class King(Piece):
         square (int, int): current location of the piece.
 
     Methods:
-        calculate_scope
+        calculate_scope, attacks
     """
     def __init__(self, symbol, square):
         self.symbol = symbol 
@@ -407,3 +496,6 @@ class King(Piece):
                 scope.append(castle_q_square)
 
         return scope
+
+    def attacks(self, board):
+        return self.attacks_by_steps(KING_STEPS)
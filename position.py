@@ -2,14 +2,54 @@
 Defines a class ChessPosition that represents static chess position.
 """
 
+import contextlib
 import piece
+import random
 import re
+import tables
 
 FEN_START = (
     'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
 ) 
 
 
+# Squares of the rook before and after each kind of castling.
+CASTLE_ROOKS = {
+    'K': ((7, 7), (7, 5)),
+    'Q': ((7, 0), (7, 3)),
+    'k': ((0, 7), (0, 5)),
+    'q': ((0, 0), (0, 3)),
+}
+
+# Castling rights lost when a piece moves from or to each square.
+CASTLING_SQUARES = {
+    (7, 4): 'KQ', (7, 7): 'K', (7, 0): 'Q',
+    (0, 4): 'kq', (0, 7): 'k', (0, 0): 'q',
+}
+
+# Zobrist hashing keys, generated from a fixed seed so that keys are
+# stable between runs and processes.
+_zobrist_random = random.Random(20240229)
+ZOBRIST_PIECES = {
+    symbol: [[_zobrist_random.getrandbits(64) for col in range(8)]
+             for row in range(8)]
+    for symbol in 'PNBRQKpnbrqk'
+}
+ZOBRIST_CASTLING = {
+    right: _zobrist_random.getrandbits(64) for right in 'KQkq'
+}
+ZOBRIST_EN_PASSANT = [_zobrist_random.getrandbits(64) for col in range(8)]
+ZOBRIST_TURN = _zobrist_random.getrandbits(64)
+
+
+def piece_value(symbol):
+    """ Return the material value of a board symbol ('-' is worth 0).
+
+    Args: symbol (str): Board symbol.
+    """
+    return piece.VALUES.get(symbol.lower(), 0)
+
+
 class Position:
     """Represents a static chess position.
 
@@ -22,15 +62,26 @@ class Position:
                           be made on the following move (if any).
         white_king (int, int): Location of the white king.
         black_king (int, int): Location of the black king.
-
-    Methods: generate_fen, square, algebraic, update_position, print_board,
-             print_info, print_position
+        key (int): Zobrist hash key of the position.
+        history (list): Preallocated stack of undo records, one per move
+                        played with push. Records beyond 'ply' are kept
+                        for redo.
+        ply (int): Number of moves on the history stack.
+
+    Methods: from_board, generate_fen, square, algebraic, attackers,
+             is_attacked, see, is_check, pinned, check_blockers,
+             is_legal_move, has_legal_move, is_checkmate, is_stalemate,
+             squares_between, movers_to, pieces, generate_moves,
+             legal_moves, make_move, undo_move, hash_key, push, pop,
+             trial_move, redo, is_repetition, update_position,
+             print_board, print_info, print_position
 
     """ 
     FEN_REGEX = (
         '([\dBbKkNnPpQqRr]{1,8}/){7}[\dBbKkNnPpQqRr]{1,8} '
         '[wb] ((K?Q?k?q?)|-) (([a-h][1-8])|-) \d{1,2} \d{1,4}'
     )
+    HISTORY_SIZE = 256
 
 
     def __init__(self, fen):
@@ -76,6 +127,46 @@ class Position:
         self.castling = data[2]
         self.en_passant = data[3]
 
+        self.key = self.hash_key()
+        self.history = [None] * Position.HISTORY_SIZE
+        self.ply = 0
+        self.history_end = 0
+        self.key_counts = {self.key: 1}
+
+    @classmethod
+    def from_board(cls, board, turn, castling, en_passant, white_king=None,
+                   black_king=None, key=None):
+        """ Return a position built directly from its parts, without
+            parsing or checking a FEN. Its 'fen' attribute is None.
+
+        Args: board (str[][]): 8x8 board, which becomes the position's own.
+              turn (str): 'w' or 'b'.
+              castling (str): Castling rights, e.g. 'KQk' or '-'.
+              en_passant (str): En passant square, e.g. 'e3', or '-'.
+              white_king (int, int): Square of the white king. Found on
+                                     the board if not given.
+              black_king (int, int): Square of the black king, likewise.
+              key (int): Zobrist hash key. Computed if not given.
+        """
+        self = cls.__new__(cls)
+        self.fen = None
+        self.board = board
+        self.turn = turn
+        self.castling = castling
+        self.en_passant = en_passant
+        if white_king is None or black_king is None:
+            text = ''.join(''.join(rank) for rank in board)
+            white_king = divmod(text.index('K'), 8)
+            black_king = divmod(text.index('k'), 8)
+        self.white_king = white_king
+        self.black_king = black_king
+        self.key = key if key is not None else self.hash_key()
+        self.history = [None] * Position.HISTORY_SIZE
+        self.ply = 0
+        self.history_end = 0
+        self.key_counts = {self.key: 1}
+        return self
+
     def generate_fen(self):
         """ Generate FEN from the class attributes. """
         fen = []
@@ -122,13 +213,130 @@ class Position:
         file = chr(ord('a') + square[1])
         return file + rank
 
-    def is_check(self, piece_list):
+    def attackers(self, square, colour, board=None):
+        """ Generate (square, symbol) for each piece of 'colour' attacking
+            'square', cheapest kinds first. Works backwards from the target
+            square, so no piece scopes are calculated.
+
+        Args: square (int, int): Array coordinates of the target square.
+              colour (str): Colour of the attacking side ('w' or 'b').
+              board (str[][]): Board to examine. Defaults to self.board.
+        """
+        if board is None:
+            board = self.board
+        row, col = square
+        if colour == 'w':
+            pawn, knight, bishop, rook, queen, king = 'PNBRQK'
+            pawn_row = row + 1
+        else:
+            pawn, knight, bishop, rook, queen, king = 'pnbrqk'
+            pawn_row = row - 1
+
+        if 0 <= pawn_row <= 7:
+            for pawn_col in (col-1, col+1):
+                if 0 <= pawn_col <= 7 and board[pawn_row][pawn_col] == pawn:
+                    yield (pawn_row, pawn_col), pawn
+
+        for dr, dc in piece.KNIGHT_STEPS:
+            r, c = row + dr, col + dc
+            if 0 <= r <= 7 and 0 <= c <= 7 and board[r][c] == knight:
+                yield (r, c), knight
+
+        for steps, slider in ((piece.DIAGONAL_STEPS, bishop),
+                              (piece.LINE_STEPS, rook)):
+            for dr, dc in steps:
+                r, c = row + dr, col + dc
+                while 0 <= r <= 7 and 0 <= c <= 7:
+                    symbol = board[r][c]
+                    if symbol != '-':
+                        if symbol == slider or symbol == queen:
+                            yield (r, c), symbol
+                        break
+                    r += dr
+                    c += dc
+
+        for dr, dc in piece.KING_STEPS:
+            r, c = row + dr, col + dc
+            if 0 <= r <= 7 and 0 <= c <= 7 and board[r][c] == king:
+                yield (r, c), king
+
+    def is_attacked(self, square, colour, board=None):
+        """ Return True if any piece of 'colour' attacks 'square'.
+
+        Args: square (int, int): Array coordinates of the target square.
+              colour (str): Colour of the attacking side ('w' or 'b').
+              board (str[][]): Board to examine. Defaults to self.board.
+        """
+        for attacker in self.attackers(square, colour, board):
+            return True
+        return False
+
+    def see(self, piece, end):
+        """ Static exchange evaluation of moving 'piece' to 'end'.
+            Return the material balance, in pawns, for the moving side
+            once both sides have made every profitable recapture on 'end'.
+            The position itself is left untouched.
+
+        Args: piece (Piece): The piece making the capture.
+              end (int, int): Destination square.
+        """
+        board = [list(rank) for rank in self.board]
+        start = piece.square
+        symbol = piece.symbol
+        target = board[end[0]][end[1]]
+
+        # En passant captures a pawn that is not on the destination square.
+        if (target == '-' and symbol in 'Pp'
+                and self.algebraic(end) == self.en_passant):
+            behind = end[0] + 1 if symbol == 'P' else end[0] - 1
+            target = board[behind][end[1]]
+            board[behind][end[1]] = '-'
+
+        gain = [piece_value(target)]
+        board[start[0]][start[1]] = '-'
+        board[end[0]][end[1]] = symbol
+        colour = 'w' if symbol.islower() else 'b'
+
+        while True:
+            candidates = list(self.attackers(end, colour, board))
+            if not candidates:
+                break
+            square, attacker = min(
+                candidates, key=lambda a: piece_value(a[1])
+            )
+            board[square[0]][square[1]] = '-'
+            board[end[0]][end[1]] = attacker
+            enemy = 'b' if colour == 'w' else 'w'
+            # A king may not recapture onto a defended square.
+            if attacker in 'Kk' and self.is_attacked(end, enemy, board):
+                break
+            gain.append(piece_value(symbol) - gain[-1])
+            symbol = attacker
+            colour = enemy
+
+        # Either side may decline to continue the exchange.
+        while len(gain) > 1:
+            gain[-2] = -max(-gain[-2], gain[-1])
+            gain.pop()
+        return gain[0]
+
+    def is_check(self, piece_list=None):
+        """ Return True if the king of the side to move is attacked.
+
+        Args: piece_list: Optional iterable of piece sprites whose scopes
+                          are searched. By default the attacks are read
+                          directly from the board.
+        """
         if self.turn == 'w':
             king_square = self.white_king
             filter = lambda p : p.symbol.isupper()
         if self.turn == 'b':
             king_square = self.black_king
-            filter = lambda p : p.symbol.lower()
+            filter = lambda p : p.symbol.islower()
+
+        if piece_list is None:
+            enemy = 'b' if self.turn == 'w' else 'w'
+            return self.is_attacked(king_square, enemy)
 
         for piece_sprite in piece_list:
             piece = piece_sprite.piece
@@ -138,17 +346,330 @@ class Position:
                 return True
         return False
 
-    def is_legal_move(self, piece, end, piece_list):
-        # TODO: Ensure castling is legal by examining FEN string
-        move_data = self.make_move(piece, end)
-        if self.is_check(piece_list):
-            self.undo_move(move_data) 
-            return False
+    def pinned(self, colour=None):
+        """ Return the set of squares of the pieces of 'colour' pinned to
+            their king by an enemy bishop, rook or queen.
+
+        Args: colour (str): 'w' or 'b'. Defaults to the side to move.
+        """
+        if colour is None:
+            colour = self.turn
+        if colour == 'w':
+            king, own, diagonal, line = self.white_king, str.isupper, 'bq', 'rq'
+        else:
+            king, own, diagonal, line = self.black_king, str.islower, 'BQ', 'RQ'
+        board = self.board
+        pins = set()
+        for step in tables.DIRECTIONS:
+            found = tables.first_pieces(board, king, step)
+            if len(found) < 2 or not own(found[0][1]):
+                continue
+            pinner = found[1][1]
+            if pinner in (diagonal if step[0] and step[1] else line):
+                pins.add(found[0][0])
+        return pins
+
+    def check_blockers(self):
+        """ Return None if the side to move is not in check. Otherwise
+            return the set of squares to which a piece other than the king
+            must move to stop the check: the checker's square and any
+            squares between it and the king. The set is empty in double
+            check. """
+        if self.turn == 'w':
+            king_square, enemy = self.white_king, 'b'
         else:
+            king_square, enemy = self.black_king, 'w'
+        checkers = list(self.attackers(king_square, enemy))
+        if not checkers:
+            return None
+        if len(checkers) > 1:
+            return set()
+        checker_square = checkers[0][0]
+        return set(tables.between(king_square, checker_square)
+                   + (checker_square,))
+
+    def is_legal_move(self, piece, end, piece_list=None, constraints=None):
+        """ Return True if the move does not leave the mover in check.
+            The board is restored before returning.
+
+        Args: piece (Piece): The piece to move.
+              end (int, int): Destination square.
+              piece_list: Optional piece sprites, passed on to is_check.
+              constraints: Optional (pinned(), check_blockers()) pair for
+                           the current position. Moves other than king
+                           moves and en passant are then decided from it
+                           without playing them.
+        """
+        symbol = piece.symbol
+        if constraints is not None and symbol not in 'Kk' and not (
+                symbol in 'Pp' and end[1] != piece.square[1]
+                and self.board[end[0]][end[1]] == '-'):
+            pins, blockers = constraints
+            if blockers is not None and end not in blockers:
+                return False
+            if piece.square in pins:
+                king = self.white_king if symbol.isupper() else self.black_king
+                return end in tables.LINE[king, piece.square]
             return True
 
-    def make_move(self, piece, end):
-        """ Update the board. Return data to undo the update. """
+        if symbol in 'Kk' and abs(end[1] - piece.square[1]) == 2:
+            if not self.can_castle(piece, end):
+                return False
+        move_data = self.make_move(piece, end)
+        king_moved = symbol in 'Kk'
+        if king_moved:
+            saved_kings = self.white_king, self.black_king
+            if symbol == 'K':
+                self.white_king = end
+            else:
+                self.black_king = end
+        in_check = self.is_check(piece_list)
+        if king_moved:
+            self.white_king, self.black_king = saved_kings
+        self.undo_move(move_data)
+        return not in_check
+
+    def has_legal_move(self):
+        """ Return True as soon as one legal move is found for the side to
+            move. King moves are tried first. When in check only evasions
+            are tried: capturing or blocking a single checker. Other moves
+            are decided from the pinned pieces without playing them. """
+        colour = self.turn
+        if colour == 'w':
+            enemy, king_square, own = 'b', self.white_king, str.isupper
+        else:
+            enemy, king_square, own = 'w', self.black_king, str.islower
+        board = self.board
+
+        king = piece.PieceFactory.create(board[king_square[0]][king_square[1]],
+                                         king_square)
+        # Castling is never the only legal move: the king could instead
+        # step to the square it passes through.
+        for row, col in king.attacks(board):
+            if not own(board[row][col]) and self.is_legal_move(king, (row, col)):
+                return True
+
+        checkers = list(self.attackers(king_square, enemy))
+        if len(checkers) > 1:
+            return False
+
+        pins = self.pinned(colour)
+        if checkers:
+            checker_square, checker = checkers[0]
+            targets = [checker_square]
+            if checker.lower() in 'brq':
+                targets.extend(tables.between(king_square, checker_square))
+            constraints = pins, set(targets)
+            for target in targets:
+                for start, symbol in self.movers_to(target, colour):
+                    mover = piece.PieceFactory.create(symbol, start)
+                    if self.is_legal_move(mover, target,
+                                          constraints=constraints):
+                        return True
+            # A checking pawn may be captured en passant.
+            if checker.lower() == 'p' and self.en_passant != '-':
+                ep_square = self.square(self.en_passant)
+                for start, symbol in self.attackers(ep_square, colour):
+                    if symbol.lower() == 'p':
+                        mover = piece.PieceFactory.create(symbol, start)
+                        if self.is_legal_move(mover, ep_square):
+                            return True
+            return False
+
+        constraints = pins, None
+        for own_piece in self.pieces(colour):
+            if own_piece.square == king_square:
+                continue
+            for end in own_piece.calculate_scope(self):
+                if self.is_legal_move(own_piece, end,
+                                      constraints=constraints):
+                    return True
+        return False
+
+    def is_checkmate(self):
+        """ Return True if the side to move has been checkmated. """
+        return self.is_check() and not self.has_legal_move()
+
+    def is_stalemate(self):
+        """ Return True if the side to move has been stalemated. """
+        return not self.is_check() and not self.has_legal_move()
+
+    def squares_between(self, start, end):
+        """ Return the squares strictly between two squares on a shared
+            line or diagonal. Return [] if they share neither.
+
+        Args: start (int, int): Array coordinates of the first square.
+              end (int, int): Array coordinates of the second square.
+        """
+        return list(tables.between(start, end))
+
+    def movers_to(self, square, colour):
+        """ Generate (square, symbol) for each piece of 'colour', other than
+            the king, that may be able to move to 'square': captures if it
+            is occupied and pawn pushes if it is empty. En passant is not
+            included.
+
+        Args: square (int, int): Array coordinates of the target square.
+              colour (str): Colour of the moving side ('w' or 'b').
+        """
+        board = self.board
+        row, col = square
+        empty = board[row][col] == '-'
+        for start, symbol in self.attackers(square, colour):
+            if symbol in 'Kk' or (empty and symbol in 'Pp'):
+                continue
+            yield start, symbol
+        if empty:
+            if colour == 'w':
+                pawn, step, double_row = 'P', 1, 4
+            else:
+                pawn, step, double_row = 'p', -1, 3
+            behind = row + step
+            if 0 <= behind <= 7:
+                if board[behind][col] == pawn:
+                    yield (behind, col), pawn
+                elif (row == double_row and board[behind][col] == '-'
+                      and board[behind + step][col] == pawn):
+                    yield (behind + step, col), pawn
+
+    def can_castle(self, king, end):
+        """ Return True if the castling rights allow the king to castle to
+            'end', the rook is in place, the squares between them are empty
+            and the king neither starts in, passes through nor lands on an
+            attacked square.
+
+        Args: king (Piece): The king to move.
+              end (int, int): Destination square of the king.
+        """
+        right = 'K' if end[1] == 6 else 'Q'
+        enemy = 'b'
+        if king.symbol == 'k':
+            right = right.lower()
+            enemy = 'w'
+        if right not in self.castling:
+            return False
+        rook_start = CASTLE_ROOKS[right][0]
+        rook = 'R' if enemy == 'b' else 'r'
+        if self.board[rook_start[0]][rook_start[1]] != rook:
+            return False
+        for row, col in tables.between(king.square, rook_start):
+            if self.board[row][col] != '-':
+                return False
+        passing = king.square[0], (king.square[1] + end[1]) // 2
+        return not (self.is_attacked(king.square, enemy)
+                    or self.is_attacked(passing, enemy)
+                    or self.is_attacked(end, enemy))
+
+    def pieces(self, colour):
+        """ Generate a Piece object for every piece of 'colour'.
+
+        Args: colour (str): 'w' or 'b'.
+        """
+        own = str.isupper if colour == 'w' else str.islower
+        for row, rank in enumerate(self.board):
+            for col, symbol in enumerate(rank):
+                if symbol != '-' and own(symbol):
+                    yield piece.PieceFactory.create(symbol, (row, col))
+
+    def generate_moves(self, hash_move=None):
+        """ Lazily generate pseudo-legal (piece, end) moves for the side to
+            move, in stages:
+               1. the hash move, if it is valid here;
+               2. captures, most valuable victim / least valuable attacker
+                  first;
+               3. quiet moves which give direct check;
+               4. the remaining quiet moves.
+            Later stages are only computed if the consumer asks for them.
+            Discovered checks are generated with the quiet moves.
+
+        Args: hash_move ((int, int), (int, int)): Optional (start, end)
+                  squares of a move to try first, e.g. from a previous
+                  search.
+        """
+        board = self.board
+        colour = self.turn
+        hash_piece = None
+
+        if hash_move is not None:
+            start, end = hash_move
+            symbol = board[start[0]][start[1]]
+            if symbol != '-' and (symbol.isupper() == (colour == 'w')):
+                hash_piece = piece.PieceFactory.create(symbol, start)
+                if end not in hash_piece.calculate_scope(self):
+                    hash_piece = None
+            if hash_piece is not None:
+                yield hash_piece, end
+            else:
+                hash_move = None
+
+        own_pieces = list(self.pieces(colour))
+
+        captures = []
+        for own_piece in own_pieces:
+            attacker_value = piece_value(own_piece.symbol)
+            for end in own_piece.calculate_captures(self):
+                if (own_piece.square, end) == hash_move:
+                    continue
+                victim = board[end[0]][end[1]]
+                # En passant: the victim is a pawn.
+                victim_value = piece_value(victim) if victim != '-' else 1
+                captures.append(
+                    (-victim_value, attacker_value, own_piece, end)
+                )
+        captures.sort(key=lambda c: (c[0], c[1]))
+        for _, _, own_piece, end in captures:
+            yield own_piece, end
+
+        # Squares from which each kind of piece would attack the enemy king
+        # are the squares that kind of piece attacks from the king itself.
+        enemy_king = self.black_king if colour == 'w' else self.white_king
+        check_squares = {}
+        for kind in 'pnbrq':
+            symbol = kind if colour == 'w' else kind.upper()
+            probe = piece.PieceFactory.create(symbol, enemy_king)
+            check_squares[kind] = set(probe.attacks(board))
+
+        quiet_moves = []
+        for own_piece in own_pieces:
+            kind = own_piece.symbol.lower()
+            checks = check_squares.get(kind, ())
+            for end in own_piece.calculate_scope(self):
+                if board[end[0]][end[1]] != '-':
+                    continue
+                if (own_piece.square, end) == hash_move:
+                    continue
+                if kind == 'p' and end[1] != own_piece.square[1]:
+                    continue    # En passant, already generated.
+                if end in checks:
+                    yield own_piece, end
+                else:
+                    quiet_moves.append((own_piece, end))
+
+        for own_piece, end in quiet_moves:
+            yield own_piece, end
+
+    def legal_moves(self, hash_move=None):
+        """ Lazily generate legal (piece, end) moves in the order of
+            generate_moves. The pinned pieces and check blocking squares
+            are found once, so only king moves and en passant captures are
+            played to test them. The position must be unchanged whenever
+            the next move is asked for.
+
+        Args: hash_move ((int, int), (int, int)): Optional move to try first.
+        """
+        constraints = self.pinned(), self.check_blockers()
+        for own_piece, end in self.generate_moves(hash_move):
+            if self.is_legal_move(own_piece, end, constraints=constraints):
+                yield own_piece, end
+
+    def make_move(self, piece, end, promotion=None):
+        """ Update the board. Return data to undo the update.
+
+        Args: piece (Piece): The piece to move.
+              end (int, int): Destination square.
+              promotion (str): Symbol of the piece a pawn reaching the last
+                               rank becomes. Defaults to a queen.
+        """
         start = piece.square
         symbol = piece.symbol
         capture = None
@@ -198,6 +719,12 @@ class Position:
                 self.board[0][0] = '-'
                 self.board[0][3] = 'r'
 
+        # Process promotion.
+        if symbol == 'P' and end[0] == 0:
+            self.board[0][end[1]] = promotion.upper() if promotion else 'Q'
+        elif symbol == 'p' and end[0] == 7:
+            self.board[7][end[1]] = promotion.lower() if promotion else 'q'
+
         return start, symbol, end, capture, castle
 
     def undo_move(self, move_data):
@@ -231,6 +758,157 @@ class Position:
             self.board[0][3] = '-'
 
 
+    def hash_key(self):
+        """ Compute the Zobrist hash key of the position from scratch. """
+        key = 0
+        for row, rank in enumerate(self.board):
+            for col, symbol in enumerate(rank):
+                if symbol != '-':
+                    key ^= ZOBRIST_PIECES[symbol][row][col]
+        for right in self.castling:
+            if right != '-':
+                key ^= ZOBRIST_CASTLING[right]
+        if self.en_passant != '-':
+            key ^= ZOBRIST_EN_PASSANT[ord(self.en_passant[0]) - ord('a')]
+        if self.turn == 'b':
+            key ^= ZOBRIST_TURN
+        return key
+
+    def push(self, piece, end, promotion=None):
+        """ Play a move, updating the side to move, castling rights, en
+            passant square, king locations and hash key, and record it on
+            the history stack. Return the data returned by make_move.
+
+        Args: piece (Piece): The piece to move.
+              end (int, int): Destination square.
+              promotion (str): Optional promotion piece symbol.
+        """
+        board = self.board
+        start = piece.square
+        old_key = self.key
+        state = (self.turn, self.castling, self.en_passant,
+                 self.white_king, self.black_king)
+
+        # Squares whose contents change, with their contents beforehand.
+        changed = {start: piece.symbol, end: board[end[0]][end[1]]}
+        move_data = self.make_move(piece, end, promotion)
+        symbol, capture, castle = move_data[1], move_data[3], move_data[4]
+        if capture is not None:
+            changed[capture[0]] = capture[1]
+        if castle is not None:
+            rook_start, rook_end = CASTLE_ROOKS[castle]
+            changed[rook_start] = board[rook_end[0]][rook_end[1]]
+            changed[rook_end] = '-'
+
+        key = old_key ^ ZOBRIST_TURN
+        for (row, col), before in changed.items():
+            after = board[row][col]
+            if before != after:
+                if before != '-':
+                    key ^= ZOBRIST_PIECES[before][row][col]
+                if after != '-':
+                    key ^= ZOBRIST_PIECES[after][row][col]
+
+        self.turn = 'b' if self.turn == 'w' else 'w'
+
+        if self.en_passant != '-':
+            key ^= ZOBRIST_EN_PASSANT[ord(self.en_passant[0]) - ord('a')]
+        if symbol == 'P' and start[0] == 6 and end[0] == 4:
+            self.en_passant = self.algebraic((5, start[1]))
+        elif symbol == 'p' and start[0] == 1 and end[0] == 3:
+            self.en_passant = self.algebraic((2, start[1]))
+        else:
+            self.en_passant = '-'
+        if self.en_passant != '-':
+            key ^= ZOBRIST_EN_PASSANT[start[1]]
+
+        lost = CASTLING_SQUARES.get(start, '') + CASTLING_SQUARES.get(end, '')
+        if lost and self.castling != '-':
+            rights = ''
+            for right in self.castling:
+                if right in lost:
+                    key ^= ZOBRIST_CASTLING[right]
+                else:
+                    rights += right
+            self.castling = rights or '-'
+
+        if symbol == 'K':
+            self.white_king = end
+        elif symbol == 'k':
+            self.black_king = end
+
+        if self.ply == len(self.history):
+            self.history.extend([None] * len(self.history))
+        redo = self.history[self.ply]
+        if (self.ply >= self.history_end or redo is None
+                or redo[0][:3] != (start, piece.symbol, end)
+                or redo[3] != promotion):
+            self.history_end = self.ply + 1
+        self.history[self.ply] = move_data, state, old_key, promotion
+        self.ply += 1
+        self.key = key
+        self.key_counts[key] = self.key_counts.get(key, 0) + 1
+
+        return move_data
+
+    def pop(self):
+        """ Take back the last move played with push. The move is kept on
+            the history stack for redo. Return its make_move data, or None
+            if there is no move to take back. """
+        if self.ply == 0:
+            return None
+        count = self.key_counts[self.key] - 1
+        if count:
+            self.key_counts[self.key] = count
+        else:
+            del self.key_counts[self.key]
+        self.ply -= 1
+        move_data, state, self.key, promotion = self.history[self.ply]
+        self.undo_move(move_data)
+        (self.turn, self.castling, self.en_passant,
+         self.white_king, self.black_king) = state
+        return move_data
+
+    @contextlib.contextmanager
+    def trial_move(self, piece, end, promotion=None):
+        """ Play a move for the duration of a with block and take it back
+            afterwards, keeping the moves held for redo. The block is given
+            the make_move data of the move.
+
+        Args: piece (Piece): The piece to move.
+              end (int, int): Destination square.
+              promotion (str): Optional promotion piece symbol.
+        """
+        saved = None
+        if self.ply < len(self.history):
+            saved = self.history[self.ply]
+        saved_end = self.history_end
+        move_data = self.push(piece, end, promotion)
+        try:
+            yield move_data
+        finally:
+            self.pop()
+            self.history[self.ply] = saved
+            self.history_end = saved_end
+
+    def redo(self):
+        """ Replay the move most recently taken back with pop. Return its
+            make_move data, or None if there is nothing to redo. """
+        if self.ply >= self.history_end:
+            return None
+        move_data, state, key, promotion = self.history[self.ply]
+        start, symbol, end = move_data[:3]
+        return self.push(piece.PieceFactory.create(symbol, start), end,
+                         promotion)
+
+    def is_repetition(self, count=3):
+        """ Return True if the current position has occurred at least
+            'count' times since the position was set up.
+
+        Args: count (int): Number of occurrences to test for.
+        """
+        return self.key_counts.get(self.key, 0) >= count
+
     def update_position(self, move_data):
         """ Update the position according to a move.
             Return data to be used in updating graphical board:
@@ -243,31 +921,16 @@ class Position:
         Args: move_data: Tuple containing the piece sprite and end square.
         """
         piece_sprite, end = move_data 
-        start, symbol, end, capture, castle = self.make_move(piece_sprite.piece, end)
-
-        if self.turn == 'w':
-            self.turn = 'b'
-        elif self.turn == 'b':
-            self.turn = 'w'
+        start, symbol, end, capture, castle = self.push(piece_sprite.piece,
+                                                        end)
 
-        # Update en passant square.
-        if symbol == 'P' and start[0] == 6 and end[0] == 4:
-            self.en_passant = self.algebraic((5, start[1]))
-        elif symbol == 'p' and start[0] == 1 and end[0] == 3:
-            self.en_passant = self.algebraic((2, start[1]))
-        else:
-            self.en_passant = '-'
-        
         if capture is not None:
             capture_square, captured_piece = capture
         else:
             capture_square = None
 
-        # TODO: Update castling string for fen
-        # 1. If w (b) castles either side, remove KQ (kq) from string.
-        # 2. If w (b) moves king's rook, remove K (k) from string.
-        # 3. If w (b) moves queen's rook, remove Q (q) from string.
-        # 4. If w (b) moves king, remove KQ (kq) from string.
+        if castle is not None:
+            castle = CASTLE_ROOKS[castle]
 
         self.fen = self.generate_fen()
 
@@ -0,0 +1,261 @@
+"""
+Module for recording and replaying input to the graphical board.
+
+A recording is a JSON lines file. The first line holds the starting FEN,
+with the solution lines when a puzzle is being solved, and each following line one event with its time in milliseconds since
+recording started: a mouse event, a takeback or redo key, a resize of the
+window or a hinted move played. Replaying runs the events headlessly
+through the same Board methods as main.main, frame by frame so that moves
+slide and clicks during a slide are ignored as they were, and times each
+stage of a drop, giving repeatable end-to-end latency figures:
+
+    python main.py --record session.jsonl
+    python replay.py session.jsonl --json timings.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import telemetry
+
+# Stages timed during a replay, in the order they run for a drop.
+STAGES = ['select_piece', 'drag', 'process_move', 'update_position',
+          'update_board']
+
+# Length of a frame of main.main, at its frame rate of 60.
+FRAME_MS = 1000 / 60
+
+
+class Recorder:
+    """ Writes the events which change the board to a recording file.
+
+    Attributes:
+        file: The open recording file.
+        start (float): perf_counter time at which recording started.
+
+    Methods: record, record_hint, close
+
+    """
+
+    def __init__(self, path, fen, solution=None):
+        """ Start a recording.
+
+        Args: path (str): Name of the recording file.
+              fen (str): FEN of the position on the board.
+              solution (SolutionTree): Solution of the puzzle being solved,
+                                       if any.
+        """
+        self.file = open(path, 'w')
+        self.start = time.perf_counter()
+        header = {'fen': fen}
+        if solution is not None:
+            header['solution'] = solution.lines
+        self.file.write(json.dumps(header) + '\n')
+
+    def record(self, event):
+        """ Write 'event' to the recording if it is a mouse event, the key
+            of a takeback or redo, or a resize of the window.
+
+        Args: event (pygame.event.Event): Event taken from the queue.
+        """
+        import pygame
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            entry = {'type': 'down', 'pos': list(event.pos),
+                     'button': event.button}
+        elif event.type == pygame.MOUSEBUTTONUP:
+            entry = {'type': 'up', 'pos': list(event.pos),
+                     'button': event.button}
+        elif event.type == pygame.MOUSEMOTION:
+            entry = {'type': 'motion', 'pos': list(event.pos)}
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_LEFT:
+            entry = {'type': 'takeback'}
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_RIGHT:
+            entry = {'type': 'redo'}
+        elif event.type == pygame.VIDEORESIZE:
+            entry = {'type': 'resize', 'size': [event.w, event.h]}
+        else:
+            return
+        self._write(entry)
+
+    def record_hint(self, start, end):
+        """ Write a hinted move played on the board. The move is recorded
+            rather than the key, as the search may find another.
+
+        Args: start (int, int): Square of the piece moved.
+              end (int, int): Destination square.
+        """
+        self._write({'type': 'hint', 'move': [list(start), list(end)]})
+
+    def _write(self, entry):
+        entry['t'] = round((time.perf_counter() - self.start) * 1000, 3)
+        self.file.write(json.dumps(entry) + '\n')
+
+    def close(self):
+        """ Finish the recording. """
+        self.file.close()
+
+
+def load(path):
+    """ Read a recording. Return (fen, lines, events), where 'lines' are
+        the SAN solution lines of the puzzle, or None if there was none.
+
+    Args: path (str): Name of the recording file.
+    """
+    with open(path) as f:
+        header = json.loads(f.readline())
+        events = [json.loads(line) for line in f if line.strip()]
+    return header['fen'], header.get('solution'), events
+
+
+def replay(path):
+    """ Replay a recording headlessly. Return a dictionary mapping each
+        stage in STAGES, plus 'drop' for a whole drop, to the list of its
+        timings in milliseconds.
+
+    Args: path (str): Name of the recording file.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    import graphics
+    import solution
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode(
+        (graphics.SCREEN_WIDTH, graphics.SCREEN_HEIGHT)
+    )
+
+    fen, lines, events = load(path)
+    graphics.PieceSprite.selected_count = 0
+    board = graphics.Board(fen)
+    if lines is not None:
+        board.solution = solution.SolutionTree(fen, lines)
+    board.add_sprites()
+    board.draw(screen, board.board_size)
+
+    timings = {stage: [] for stage in STAGES + ['drop']}
+    clock = time.perf_counter
+
+    def timed(stage, function, *args):
+        start = clock()
+        result = function(*args)
+        timings[stage].append((clock() - start) * 1000)
+        return result
+
+    def update_display():
+        if board.whole_board_update():
+            pygame.display.update()
+        elif board.updated_rects:
+            pygame.display.update(board.updated_rects)
+        board.clear_updated_rects()
+
+    # Time of the next frame, and the ply before a hinted move which is
+    # finished once it has slid, as in main.main.
+    now = 0.0
+    hint_played = None
+    for event in events:
+        # Run the frames before the event, skipping those with nothing
+        # moving.
+        while now < event['t']:
+            if not board.is_animating() and hint_played is None:
+                now = event['t']
+                break
+            board.step_animations(screen, now)
+            if hint_played is not None and not board.is_animating():
+                if board.ply > hint_played:
+                    board.finish_move(screen)
+                hint_played = None
+            update_display()
+            now += FRAME_MS
+
+        kind = event['type']
+        if kind == 'takeback':
+            board.take_back(screen)
+        elif kind == 'redo':
+            board.redo_move(screen)
+        elif kind == 'resize':
+            width, height = event['size']
+            screen = pygame.display.set_mode((width, height))
+            board.resize(screen, min(width, height - graphics.TEXT_HEIGHT))
+        elif kind == 'hint':
+            if not board.is_animating():
+                start, end = (tuple(square) for square in event['move'])
+                board.play_line([(start, end)])
+                hint_played = board.ply
+        elif kind == 'motion':
+            timed('drag', board.drag, screen, tuple(event['pos']))
+        elif event.get('button') != 1:
+            continue
+        elif kind == 'down':
+            if board.is_animating():
+                continue
+            pos = tuple(event['pos'])
+            timed('select_piece', board.select_piece, pos)
+            board.start_drag(pos)
+        elif kind == 'up':
+            drop_start = clock()
+            move_data = timed('process_move', board.process_move, screen,
+                              tuple(event['pos']))
+            if move_data is not None:
+                board_update_data = timed('update_position',
+                                          board.update_position, move_data)
+                timed('update_board', board.update_board, screen,
+                      board_update_data)
+                board.finish_move(screen)
+            update_display()
+            timings['drop'].append((clock() - drop_start) * 1000)
+        update_display()
+
+    return timings
+
+
+def summarise(timings):
+    """ Return a dictionary of count, mean, p50, p90 and max for every
+        stage in 'timings'.
+
+    Args: timings (dict): Result of replay.
+    """
+    summary = {}
+    for stage, values in timings.items():
+        summary[stage] = {
+            'count': len(values),
+            'mean_ms': sum(values) / len(values) if values else 0,
+            'p50_ms': telemetry.percentile(values, 0.5),
+            'p90_ms': telemetry.percentile(values, 0.9),
+            'max_ms': max(values, default=0),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Replay a recorded session and time each stage.'
+    )
+    parser.add_argument('recording')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the summary to FILE as JSON')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of times to replay the recording')
+    args = parser.parse_args(argv)
+
+    timings = {}
+    for i in range(args.repeat):
+        for stage, values in replay(args.recording).items():
+            timings.setdefault(stage, []).extend(values)
+    summary = summarise(timings)
+
+    for stage, row in summary.items():
+        print('%-16s n=%-5d mean %7.3f  p50 %7.3f  p90 %7.3f  max %7.3f ms'
+              % (stage, row['count'], row['mean_ms'], row['p50_ms'],
+                 row['p90_ms'], row['max_ms']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+            f.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""
+Module for searching chess positions.
+
+The search is written as a generator so that it can be advanced a little
+at a time, e.g. for a fixed budget on every frame of the graphical board.
+"""
+
+import time
+
+import movecache
+import position
+
+MATE_SCORE = 10000
+
+
+class Search:
+    """ Anytime iterative-deepening alpha-beta search.
+
+    Attributes:
+        position (Position): Private copy of the position being searched.
+        max_depth (int): Deepest iteration to run.
+        yield_every (int): Number of nodes searched between yields.
+        depth (int): Depth of the last completed iteration.
+        best_move ((int, int), (int, int)): Best (start, end) move found
+                                           so far, or None.
+        score (int): Score of best_move in pawns, from the point of view of
+                     the side to move. Mates are scored as +/- MATE_SCORE.
+        nodes (int): Number of positions visited.
+        finished (bool): True once every iteration has completed.
+        cache (MoveCache): Cache of the legal moves of the positions
+                           visited, reused by later iterations.
+
+    Methods: run, step, close, evaluate
+
+    """
+
+    def __init__(self, fen, max_depth=4, yield_every=64, cache=None):
+        """ Prepare a search of the position given by 'fen'.
+
+        Args: fen (str): FEN string of the position to search.
+              max_depth (int): Deepest iteration to run.
+              yield_every (int): Nodes searched between yields.
+              cache (MoveCache): Legal move cache. Defaults to the shared
+                                 movecache.MOVE_CACHE.
+        """
+        self.position = position.Position(fen)
+        self.max_depth = max_depth
+        self.yield_every = yield_every
+        self.depth = 0
+        self.best_move = None
+        self.score = None
+        self.nodes = 0
+        self.finished = False
+        self.cache = cache if cache is not None else movecache.MOVE_CACHE
+        self._generator = self.run()
+
+    def run(self):
+        """ Generator performing the search. Yields None while working and
+            (depth, best_move, score) whenever an iteration completes. """
+        for depth in range(1, self.max_depth + 1):
+            root_best = None
+            alpha = -MATE_SCORE - 1
+            beta = MATE_SCORE + 1
+            legal = self.cache.get(self.position)
+            for piece, end in legal.ordered(self.best_move):
+                self.position.push(piece, end)
+                score = yield from self._negamax(depth - 1, -beta, -alpha, 1)
+                self.position.pop()
+                score = -score
+                if root_best is None or score > alpha:
+                    alpha = score
+                    root_best = piece.square, end
+            if root_best is None:
+                break   # No legal moves: nothing to hint.
+            self.depth = depth
+            self.best_move = root_best
+            self.score = alpha
+            yield depth, root_best, alpha
+            if abs(alpha) >= MATE_SCORE - self.max_depth:
+                break   # Mate found, deeper iterations won't improve it.
+        self.finished = True
+
+    def _negamax(self, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes % self.yield_every == 0:
+            yield None
+
+        if self.position.is_repetition(2):
+            return 0
+
+        if depth == 0:
+            return self.evaluate()
+
+        any_move = False
+        for piece, end in self.position.legal_moves():
+            any_move = True
+            self.position.push(piece, end)
+            score = yield from self._negamax(depth - 1, -beta, -alpha, ply+1)
+            self.position.pop()
+            score = -score
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+
+        if not any_move:
+            if self.position.is_check():
+                return -MATE_SCORE + ply
+            return 0
+        return alpha
+
+    def evaluate(self):
+        """ Return the material balance from the side to move's view. """
+        balance = 0
+        for rank in self.position.board:
+            for symbol in rank:
+                if symbol == '-' or symbol in 'Kk':
+                    continue
+                if symbol.isupper():
+                    balance += position.piece_value(symbol)
+                else:
+                    balance -= position.piece_value(symbol)
+        return balance if self.position.turn == 'w' else -balance
+
+    def step(self, budget_ms):
+        """ Advance the search for roughly 'budget_ms' milliseconds.
+            Return the list of (depth, best_move, score) results completed
+            during this slice.
+
+        Args: budget_ms (float): Time budget in milliseconds.
+        """
+        results = []
+        if self.finished:
+            return results
+        deadline = time.perf_counter() + budget_ms / 1000
+        for result in self._generator:
+            if result is not None:
+                results.append(result)
+            if time.perf_counter() >= deadline:
+                break
+        return results
+
+    def close(self):
+        """ Abandon the search immediately. """
+        self._generator.close()
+        self.finished = True
+
+
+def mate_in(fen, max_moves, cache=None):
+    """ Look for a forced mate for the side to move in at most 'max_moves'
+        moves. Return the main line of the shortest mate found as a list of
+        (piece, end) moves, the defence being the one that resists longest,
+        or None if there is no such mate. Promotions are to queens.
+
+    Args: fen (str): FEN string of the position.
+          max_moves (int): Greatest number of moves of the mating side.
+          cache (MoveCache): Legal move cache, which lets each deeper try
+                             reuse the moves found by the last. Defaults to
+                             the shared movecache.MOVE_CACHE.
+    """
+    if cache is None:
+        cache = movecache.MOVE_CACHE
+    mate_position = position.Position(fen)
+    for moves in range(1, max_moves + 1):
+        line = _prove_mate(mate_position, moves, cache)
+        if line is not None:
+            return line
+    return None
+
+
+def mating_moves(fen, max_moves, cache=None):
+    """ Return every (piece, end) move of the side to move which forces
+        mate in at most 'max_moves' moves, e.g. to test that a puzzle has
+        only one solution. Promotions are to queens.
+
+    Args: fen (str): FEN string of the position.
+          max_moves (int): Greatest number of moves of the mating side.
+          cache (MoveCache): Legal move cache. Defaults to the shared
+                             movecache.MOVE_CACHE.
+    """
+    if cache is None:
+        cache = movecache.MOVE_CACHE
+    mate_position = position.Position(fen)
+    found = []
+    for piece, end in cache.get(mate_position).moves:
+        mate_position.push(piece, end)
+        if max_moves == 1:
+            mates = cache.is_checkmate(mate_position)
+        else:
+            mates = _defend_mate(mate_position, max_moves - 1,
+                                 cache) is not None
+        mate_position.pop()
+        if mates:
+            found.append((piece, end))
+    return found
+
+
+def _prove_mate(mate_position, moves, cache):
+    """ Return a line mating in 'moves' moves for the side to move, or
+        None. """
+    for piece, end in cache.get(mate_position).moves:
+        mate_position.push(piece, end)
+        if moves == 1:
+            line = [] if cache.is_checkmate(mate_position) else None
+        else:
+            line = _defend_mate(mate_position, moves - 1, cache)
+        mate_position.pop()
+        if line is not None:
+            return [(piece, end)] + line
+    return None
+
+
+def _defend_mate(mate_position, moves, cache):
+    """ Return the longest line by which the side to move is mated within
+        'moves' further moves of the opponent, or None if some defence
+        avoids it. A defence that avoids the mate is usually among the first
+        replies tried, so the moves are generated lazily, not cached. """
+    if not mate_position.has_legal_move():
+        return [] if mate_position.is_check() else None
+    longest = None
+    for piece, end in mate_position.legal_moves():
+        mate_position.push(piece, end)
+        line = _prove_mate(mate_position, moves, cache)
+        mate_position.pop()
+        if line is None:
+            return None
+        if longest is None or len(line) + 1 > len(longest):
+            longest = [(piece, end)] + line
+    return longest
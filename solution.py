@@ -0,0 +1,177 @@
+"""
+Module for checking moves against the solutions of a puzzle.
+
+A puzzle may have several solution lines, e.g. one per defence or several
+equally good moves for the solver. The lines are merged into a graph of
+positions, each node standing for a position and identified by its Zobrist
+key (see Position.key), so lines which transpose share their nodes. Lines
+are kept as SAN text and the moves leaving a node are only parsed the first
+time the node is reached. After that, checking a move is one dictionary
+lookup, whichever line led to the position.
+
+Puzzle files hold one line per solution, its FEN, a tab and its moves in
+SAN, as written by pgn.py. Lines with the same FEN belong to one puzzle.
+"""
+
+import collections
+
+import notation
+import position
+
+
+class Node:
+    """ A position reached by one or more solution lines.
+
+    Attributes:
+        key (int): Zobrist hash key of the position.
+        children (dict): Node reached by each solution move, keyed by its
+                         (start, end) squares.
+        pending: List of (line, ply) continuations not parsed yet: the
+                 index of a line in SolutionTree.lines and of its next move.
+        final (bool): True if a solution line ends here.
+
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.children = {}
+        self.pending = []
+        self.final = False
+
+
+class SolutionTree:
+    """ The solution lines of a puzzle, as a graph of shared positions.
+
+    Attributes:
+        fen (str): FEN string of the puzzle.
+        solver (str): Colour of the side to move in the puzzle.
+        lines: List of the SAN moves of each solution line.
+        root (Node): Node of the puzzle position.
+        nodes (dict): Every node created so far, keyed by position key.
+
+    Methods: add_line, expand, accepts, replies, reply, is_solved
+
+    """
+
+    def __init__(self, fen, lines=()):
+        """ Constructor for SolutionTree.
+
+        Args: fen (str): FEN string of the puzzle.
+              lines: Optional sequence of solution lines, each a list of
+                     SAN moves played from the puzzle position.
+        """
+        start = position.Position(fen)
+        self.fen = fen
+        self.solver = start.turn
+        self.lines = []
+        self.root = Node(start.key)
+        self.nodes = {start.key: self.root}
+        for line in lines:
+            self.add_line(line)
+
+    def add_line(self, moves):
+        """ Add a solution line. Its moves are parsed as they are reached.
+
+        Args: moves (str[]): SAN moves played from the puzzle position.
+        """
+        if not moves:
+            self.root.final = True
+            return
+        self.lines.append(list(moves))
+        self.root.pending.append((len(self.lines) - 1, 0))
+
+    def expand(self, game):
+        """ Return the node of the position of 'game', parsing the moves of
+            the lines that continue from it, or None if no solution line
+            reaches it. A line with an illegal move is cut short there.
+
+        Args: game (Position): The position, which is left unchanged.
+        """
+        node = self.nodes.get(game.key)
+        if node is None:
+            return None
+        while node.pending:
+            index, ply = node.pending.pop(0)
+            line = self.lines[index]
+            try:
+                own_piece, end, promotion = notation.parse_san(game, line[ply])
+            except ValueError:
+                continue
+            with game.trial_move(own_piece, end, promotion):
+                key = game.key
+
+            child = self.nodes.get(key)
+            if child is None:
+                child = self.nodes[key] = Node(key)
+            node.children[own_piece.square, end] = child
+            if ply + 1 < len(line):
+                child.pending.append((index, ply + 1))
+            else:
+                child.final = True
+        return node
+
+    def accepts(self, game, start, end):
+        """ Return True if moving from 'start' to 'end' in the position of
+            'game' keeps to a solution line.
+
+        Args: game (Position): Position in which the move is played.
+              start (int, int): Square of the piece to move.
+              end (int, int): Destination square.
+        """
+        node = self.expand(game)
+        return node is not None and (start, end) in node.children
+
+    def replies(self, game):
+        """ Return the (start, end) moves by which the solution lines go on
+            from the position of 'game', in the order of the lines.
+
+        Args: game (Position): Position reached.
+        """
+        node = self.expand(game)
+        if node is None:
+            return []
+        return list(node.children)
+
+    def reply(self, game):
+        """ Return the first (start, end) move by which the solution goes
+            on from the position of 'game', or None.
+
+        Args: game (Position): Position reached.
+        """
+        replies = self.replies(game)
+        return replies[0] if replies else None
+
+    def is_solved(self, game):
+        """ Return True if the position of 'game' ends a solution line.
+
+        Args: game (Position): Position reached.
+        """
+        node = self.nodes.get(game.key)
+        return node is not None and node.final
+
+
+def load(path):
+    """ Return the puzzles of a puzzle file as a dictionary of
+        SolutionTree objects keyed by FEN, in the order of the file. Lines
+        with invalid FENs are skipped.
+
+    Args: path (str): Name of the puzzle file.
+    """
+    lines = collections.OrderedDict()
+    with open(path) as f:
+        for text in f:
+            fen, _, moves = text.strip().partition('\t')
+            fen = fen.strip()
+            if not fen:
+                continue
+            if len(fen.split()) == 4:
+                fen += ' 0 1'
+            lines.setdefault(fen, []).append(moves.split())
+
+    puzzles = collections.OrderedDict()
+    for fen, moves in lines.items():
+        try:
+            puzzles[fen] = SolutionTree(fen, moves)
+        except ValueError:
+            continue
+    return puzzles
@@ -0,0 +1,94 @@
+"""
+Module of precomputed square tables.
+
+Squares are (row, column) pairs as in Position.board. The tables are built
+once on import and replace walking the board square by square.
+"""
+
+import piece
+
+SQUARES = [(row, col) for row in range(8) for col in range(8)]
+
+# Steps of the eight directions a line can take.
+DIRECTIONS = piece.DIAGONAL_STEPS + piece.LINE_STEPS
+
+
+def _ray(square, step):
+    """ Return the squares from 'square' to the edge of the board in the
+        direction of 'step', excluding 'square'. """
+    row, col = square
+    dr, dc = step
+    squares = []
+    row, col = row + dr, col + dc
+    while 0 <= row <= 7 and 0 <= col <= 7:
+        squares.append((row, col))
+        row, col = row + dr, col + dc
+    return tuple(squares)
+
+
+# RAYS[square][step]: squares from 'square' to the edge of the board in the
+# direction of 'step', nearest first.
+RAYS = {square: {step: _ray(square, step) for step in DIRECTIONS}
+        for square in SQUARES}
+
+# BETWEEN[start, end]: squares strictly between two squares on a shared
+# line or diagonal, nearest 'start' first. Pairs sharing neither are
+# missing.
+BETWEEN = {}
+
+# DIRECTION[start, end]: step leading from 'start' towards 'end' for pairs
+# on a shared line or diagonal.
+DIRECTION = {}
+
+# LINE[start, end]: set of the squares of the whole line or diagonal
+# through two squares, from edge to edge and including both. A piece pinned
+# on 'end' to a king on 'start' may only move within it.
+LINE = {}
+
+for _square in SQUARES:
+    for _step, _squares in RAYS[_square].items():
+        _back = RAYS[_square][(-_step[0], -_step[1])]
+        _line = frozenset(_squares + _back + (_square,))
+        for _distance, _end in enumerate(_squares):
+            BETWEEN[_square, _end] = _squares[:_distance]
+            DIRECTION[_square, _end] = _step
+            LINE[_square, _end] = _line
+
+
+def between(start, end):
+    """ Return the squares strictly between two squares on a shared line or
+        diagonal, or () if they share neither.
+
+    Args: start (int, int): First square.
+          end (int, int): Second square.
+    """
+    return BETWEEN.get((start, end), ())
+
+
+def line(start, end):
+    """ Return the set of squares of the line or diagonal through two
+        squares, or an empty set if they share neither.
+
+    Args: start (int, int): First square.
+          end (int, int): Second square.
+    """
+    return LINE.get((start, end), frozenset())
+
+
+def first_pieces(board, square, step, count=2):
+    """ Return up to 'count' (square, symbol) pairs for the first pieces
+        met along a ray from 'square'.
+
+    Args: board (str[][]): Board to examine.
+          square (int, int): Start of the ray, not included.
+          step (int, int): Direction of the ray.
+          count (int): Number of pieces wanted.
+    """
+    found = []
+    for row, col in RAYS[square][step]:
+        symbol = board[row][col]
+        if symbol != '-':
+            found.append(((row, col), symbol))
+            if len(found) == count:
+                break
+    return found
@@ -0,0 +1,174 @@
+"""
+Module for frame-time telemetry of the graphical board.
+
+FrameStats keeps a window of recent frames for the on-screen overlay and a
+histogram covering the whole session, which can be written to a file.
+StartupTimer times the phases of starting the trainer.
+"""
+
+import collections
+import json
+import time
+
+
+def percentile(values, fraction):
+    """ Return the value below which 'fraction' of 'values' lie, using the
+        nearest rank. Return 0 if there are no values.
+
+    Args: values: Sequence of numbers.
+          fraction (float): Between 0 and 1.
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(fraction * len(ordered)))
+    return ordered[index]
+
+
+class FrameStats:
+    """ Frame-time statistics.
+
+    Attributes:
+        frame_times: Recent frame intervals in milliseconds.
+        busy_times: Recent time spent working on each frame, excluding
+                    the wait for the next tick, in milliseconds.
+        dirty_rects: Recent numbers of rects passed to display.update.
+        latencies: Recent delays between a drop event being handled and
+                   the resulting frame being presented, in milliseconds.
+        frames (int): Number of frames recorded this session.
+        full_updates (int): Frames presented with a full display.update.
+        partial_updates (int): Frames presented with a list of rects.
+                               Frames with nothing to update count as
+                               neither.
+        histogram (dict): Whole-session count of frame intervals, keyed by
+                          bucket in milliseconds.
+        bucket_ms (int): Width of a histogram bucket.
+
+    Methods: record_frame, record_latency, summary, dump
+
+    """
+
+    def __init__(self, window=300, bucket_ms=2):
+        """ Constructor for FrameStats.
+
+        Args: window (int): Number of recent frames kept for percentiles.
+              bucket_ms (int): Width of a histogram bucket in milliseconds.
+        """
+        self.frame_times = collections.deque(maxlen=window)
+        self.busy_times = collections.deque(maxlen=window)
+        self.dirty_rects = collections.deque(maxlen=window)
+        self.latencies = collections.deque(maxlen=window)
+        self.frames = 0
+        self.full_updates = 0
+        self.partial_updates = 0
+        self.histogram = collections.Counter()
+        self.bucket_ms = bucket_ms
+
+    def record_frame(self, frame_ms, busy_ms, rect_count):
+        """ Record a presented frame.
+
+        Args: frame_ms (float): Time since the previous frame.
+              busy_ms (float): Time spent preparing the frame.
+              rect_count (int): Number of dirty rects updated, or None
+                                for a full display update.
+        """
+        self.frames += 1
+        self.frame_times.append(frame_ms)
+        self.busy_times.append(busy_ms)
+        if rect_count is None:
+            self.full_updates += 1
+            self.dirty_rects.append(0)
+        else:
+            if rect_count:
+                self.partial_updates += 1
+            self.dirty_rects.append(rect_count)
+        bucket = int(frame_ms // self.bucket_ms) * self.bucket_ms
+        self.histogram[bucket] += 1
+
+    def record_latency(self, latency_ms):
+        """ Record an event-to-present latency.
+
+        Args: latency_ms (float): Latency in milliseconds.
+        """
+        self.latencies.append(latency_ms)
+
+    def summary(self):
+        """ Return lines of text describing the recent frames. """
+        frames = self.frame_times
+        busy = self.busy_times
+        rects = self.dirty_rects
+        lines = [
+            'Frame ms p50 %.1f  p90 %.1f  p99 %.1f  max %.1f' % (
+                percentile(frames, 0.5), percentile(frames, 0.9),
+                percentile(frames, 0.99), max(frames, default=0)),
+            'Busy ms p50 %.1f  p90 %.1f  p99 %.1f' % (
+                percentile(busy, 0.5), percentile(busy, 0.9),
+                percentile(busy, 0.99)),
+            'Dirty rects/frame mean %.1f  max %d' % (
+                sum(rects) / len(rects) if rects else 0,
+                max(rects, default=0)),
+            'Updates full %d  partial %d' % (
+                self.full_updates, self.partial_updates),
+        ]
+        if self.latencies:
+            lines.append('Drop latency ms p50 %.1f  max %.1f' % (
+                percentile(self.latencies, 0.5), max(self.latencies)))
+        return lines
+
+    def dump(self, path):
+        """ Write the session histogram and counters to a JSON file.
+
+        Args: path (str): Name of the file to write.
+        """
+        data = {
+            'bucket_ms': self.bucket_ms,
+            'frames': self.frames,
+            'histogram': {str(bucket): count for bucket, count
+                          in sorted(self.histogram.items())},
+            'full_updates': self.full_updates,
+            'partial_updates': self.partial_updates,
+            'latency_ms': list(self.latencies),
+        }
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.write('\n')
+
+
+class StartupTimer:
+    """ Records the time at which each phase of startup finished.
+
+    Attributes:
+        start (float): perf_counter time at which startup began.
+        marks: List of (label, perf_counter time) pairs.
+
+    Methods: mark, report
+
+    """
+
+    def __init__(self, start=None):
+        """ Constructor for StartupTimer.
+
+        Args: start (float): perf_counter time at which startup began.
+                             Defaults to now.
+        """
+        self.start = time.perf_counter() if start is None else start
+        self.marks = []
+
+    def mark(self, label):
+        """ Record the end of a phase.
+
+        Args: label (str): Name of the phase.
+        """
+        self.marks.append((label, time.perf_counter()))
+
+    def report(self):
+        """ Return lines of text giving the duration of each phase and
+            the time elapsed since startup began. """
+        lines = []
+        previous = self.start
+        for label, moment in self.marks:
+            lines.append('%-16s %8.1f ms  (at %8.1f ms)' % (
+                label, (moment - previous) * 1000,
+                (moment - self.start) * 1000))
+            previous = moment
+        return lines
@@ -2,13 +2,38 @@
 Module for unit testing.
 """
 
+import contextlib
+import io
+import json
+import os
 import pygame
+import shutil
 import sys
+import tempfile
 import unittest
 
+import bench
+import corpus
+import dedup
+import generate
 import graphics
+import instrument
+import movecache
+import notation
+import pgn
 import piece
 import position
+import replay
+import search
+import solution
+import tables
+import telemetry
+import themes
+
+try:
+    import batch
+except ImportError:     # NumPy is optional.
+    batch = None
 
 class TestPosition(unittest.TestCase):
     FEN_POSITIONS = [ 
@@ -195,12 +220,248 @@ class TestPosition(unittest.TestCase):
         # TODO: Add promotion test
 
     def test_is_check(self):
-        # Create Board and call add_sprites to get a sprite list to pass to is_check.
-        # Rest should be straightforward
-        pass
+        test_position = position.Position('4k3/8/8/8/8/8/4r3/4K3 w - - 0 1')
+        self.assertTrue(test_position.is_check())
+        test_position = position.Position('4k3/8/8/8/8/8/R7/4K3 b - - 0 1')
+        self.assertFalse(test_position.is_check())
+        test_position = position.Position('4k3/8/8/1B6/8/8/8/4K3 b - - 0 1')
+        self.assertTrue(test_position.is_check())
     
     def test_is_legal_move(self):
-        pass
+        fen = '4k3/8/8/8/1b6/8/3N4/4K2r w - - 0 1'
+        test_position = position.Position(fen)
+        knight_d2 = piece.PieceFactory.create('N', (6, 3))
+        king_e1 = piece.PieceFactory.create('K', (7, 4))
+        # The knight is pinned and the king cannot stay on the first rank.
+        self.assertFalse(test_position.is_legal_move(knight_d2, (4, 4)))
+        self.assertFalse(test_position.is_legal_move(king_e1, (7, 5)))
+        self.assertTrue(test_position.is_legal_move(king_e1, (6, 4)))
+        # The board must be restored whatever the answer.
+        self.assertEqual(test_position.generate_fen(), fen)
+
+    def test_pins(self):
+        fen = '4k3/8/8/8/1b6/8/3N4/4K2r w - - 0 1'
+        test_position = position.Position(fen)
+        self.assertEqual(test_position.pinned(), {(6, 3)})
+        self.assertEqual(test_position.pinned('b'), set())
+        self.assertEqual(test_position.check_blockers(),
+                         {(7, 5), (7, 6), (7, 7)})
+        test_position = position.Position('4k3/4r3/8/8/8/8/4R3/4K3 w - - 0 1')
+        self.assertIsNone(test_position.check_blockers())
+        self.assertEqual(test_position.pinned(), {(6, 4)})
+        self.assertEqual(tables.line((7, 4), (6, 4)),
+                         {(row, 4) for row in range(8)})
+        constraints = test_position.pinned(), None
+        rook_e2 = piece.PieceFactory.create('R', (6, 4))
+        for end, legal in [((1, 4), True), ((3, 4), True), ((6, 3), False)]:
+            self.assertEqual(test_position.is_legal_move(rook_e2, end), legal)
+            self.assertEqual(test_position.is_legal_move(
+                rook_e2, end, constraints=constraints), legal)
+        # Double check leaves nothing to block.
+        test_position = position.Position(
+            '4r1k1/8/8/8/8/3n4/2PP1P2/3QKB2 w - - 0 1')
+        self.assertEqual(test_position.check_blockers(), set())
+
+    def test_checkmate_and_stalemate(self):
+        checkmates = [
+            # Back rank mate, the king has no flight squares.
+            '3R2k1/5ppp/8/8/8/8/8/6K1 b - - 0 1',
+            # Double check: capturing one checker is not enough.
+            '4r1k1/8/8/8/8/3n4/2PP1P2/3QKB2 w - - 0 1',
+            # Smothered mate.
+            '6rk/5Npp/8/8/8/8/8/6K1 b - - 0 1',
+        ]
+        stalemates = [
+            '7k/5Q2/8/8/8/8/8/6K1 b - - 0 1',
+            '8/8/8/8/8/1k6/p7/K7 w - - 0 1',
+        ]
+        playable = [
+            # The checking rook can be captured.
+            '3R2k1/5ppp/8/8/8/8/7K/3r4 b - - 0 1',
+            # The check can be blocked by a pawn push.
+            '4k3/8/8/8/7b/8/3PP1P1/3QKB2 w - - 0 1',
+            # The checking pawn can be captured en passant.
+            '8/8/8/2k5/3Pp3/8/8/4K3 b - d3 0 1',
+            position.FEN_START,
+        ]
+        for fen in checkmates:
+            test_position = position.Position(fen)
+            self.assertTrue(test_position.is_checkmate(), fen)
+            self.assertFalse(test_position.is_stalemate(), fen)
+        for fen in stalemates:
+            test_position = position.Position(fen)
+            self.assertTrue(test_position.is_stalemate(), fen)
+            self.assertFalse(test_position.is_checkmate(), fen)
+        for fen in playable:
+            test_position = position.Position(fen)
+            self.assertFalse(test_position.is_checkmate(), fen)
+            self.assertFalse(test_position.is_stalemate(), fen)
+            self.assertEqual(test_position.generate_fen(), fen)
+
+    def test_generate_moves(self):
+        perft = [
+            (position.FEN_START, 20),
+            ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R '
+             'w KQkq - 0 1', 48),
+            ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', 14),
+        ]
+        for fen, count in perft:
+            test_position = position.Position(fen)
+            self.assertEqual(len(list(test_position.legal_moves())), count)
+            self.assertEqual(test_position.generate_fen(), fen)
+
+        # Hash move first, then captures by MVV-LVA, checks, quiet moves.
+        fen = '4k3/8/q7/3p4/4P3/8/8/R2QK3 w - - 0 1'
+        test_position = position.Position(fen)
+        moves = [(p.square, end) for p, end in
+                 test_position.generate_moves(((7, 0), (6, 0)))]
+        self.assertEqual(moves[0], ((7, 0), (6, 0)))
+        self.assertEqual(moves[1:4], [((7, 0), (2, 0)), ((4, 4), (3, 3)),
+                                      ((7, 3), (3, 3))])
+        self.assertCountEqual(moves[4:6], [((7, 3), (4, 0)),
+                                           ((7, 3), (3, 7))])
+        self.assertEqual(len(moves), len(set(moves)))
+
+    def test_attackers(self):
+        fen = '4k3/8/5n2/3r4/4P3/5B2/8/3QK3 w - - 0 1'
+        test_position = position.Position(fen)
+        # The bishop on f3 is blocked by the pawn on e4.
+        self.assertCountEqual(
+            test_position.attackers((3, 3), 'w'),
+            [((4, 4), 'P'), ((7, 3), 'Q')]
+        )
+        self.assertCountEqual(
+            test_position.attackers((4, 4), 'b'),
+            [((2, 5), 'n')]
+        )
+        self.assertTrue(test_position.is_attacked((7, 7), 'w'))
+        self.assertFalse(test_position.is_attacked((0, 0), 'b'))
+
+    def test_see(self):
+        # Pawn takes a rook defended by a knight.
+        fen = '4k3/8/5n2/3r4/4P3/5B2/8/3QK3 w - - 0 1'
+        test_position = position.Position(fen)
+        pawn_e4 = piece.PieceFactory.create('P', (4, 4))
+        queen_d1 = piece.PieceFactory.create('Q', (7, 3))
+        self.assertEqual(test_position.see(pawn_e4, (3, 3)), 5)
+        # The queen is lost for a rook and a knight.
+        self.assertEqual(test_position.see(queen_d1, (3, 3)), -1)
+
+        # Queen takes a pawn defended by a pawn.
+        fen = '4k3/2p5/3p4/8/8/8/8/3QK3 w - - 0 1'
+        test_position = position.Position(fen)
+        queen_d1 = piece.PieceFactory.create('Q', (7, 3))
+        self.assertEqual(test_position.see(queen_d1, (2, 3)), -8)
+
+        # X-ray: the rook behind the queen joins the exchange.
+        fen = '3rk3/3r4/8/8/8/3P4/3Q4/4K3 b - - 0 1'
+        test_position = position.Position(fen)
+        rook_d7 = piece.PieceFactory.create('r', (1, 3))
+        self.assertEqual(test_position.see(rook_d7, (5, 3)), 1)
+        test_position.board[0][3] = '-'
+        self.assertEqual(test_position.see(rook_d7, (5, 3)), -4)
+
+        # En passant and a king that cannot recapture.
+        fen = '4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1'
+        test_position = position.Position(fen)
+        pawn_e5 = piece.PieceFactory.create('P', (3, 4))
+        self.assertEqual(test_position.see(pawn_e5, (2, 3)), 1)
+        fen = '8/8/8/8/8/4k3/3p3R/3K4 w - - 0 1'
+        test_position = position.Position(fen)
+        rook_h2 = piece.PieceFactory.create('R', (6, 7))
+        self.assertEqual(test_position.see(rook_h2, (6, 3)), 1)
+        self.assertEqual(test_position.board[6][3], 'p')
+
+    def test_push_pop_redo(self):
+        test_position = position.Position(position.FEN_START)
+        start_key = test_position.key
+        moves = [((6, 4), (4, 4)), ((1, 2), (3, 2)), ((7, 6), (5, 5)),
+                 ((0, 1), (2, 2)), ((7, 5), (4, 2)), ((1, 6), (2, 6))]
+        fens = [position.FEN_START]
+        for start, end in moves:
+            symbol = test_position.board[start[0]][start[1]]
+            test_position.push(piece.PieceFactory.create(symbol, start), end)
+            fens.append(test_position.generate_fen())
+            self.assertEqual(test_position.key, test_position.hash_key())
+        self.assertEqual(fens[1],
+            'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1')
+
+        # White castles, losing both castling rights.
+        king_e1 = piece.PieceFactory.create('K', (7, 4))
+        test_position.push(king_e1, (7, 6))
+        self.assertEqual(test_position.castling, 'kq')
+        self.assertEqual(test_position.white_king, (7, 6))
+        self.assertEqual(test_position.board[7][5], 'R')
+
+        test_position.pop()
+        for fen in reversed(fens[:-1]):
+            test_position.pop()
+            self.assertEqual(test_position.generate_fen(), fen)
+        self.assertIsNone(test_position.pop())
+        self.assertEqual(test_position.key, start_key)
+
+        for fen in fens[1:]:
+            test_position.redo()
+            self.assertEqual(test_position.generate_fen(), fen)
+        self.assertEqual(test_position.castling, 'KQkq')
+        # A new move discards the moves available for redo.
+        test_position.pop()
+        test_position.push(piece.PieceFactory.create('p', (1, 7)), (2, 7))
+        self.assertIsNone(test_position.redo())
+
+    def test_promotion(self):
+        fen = '8/4P3/8/8/8/2k5/8/4K3 w - - 0 1'
+        test_position = position.Position(fen)
+        pawn_e7 = piece.PieceFactory.create('P', (1, 4))
+        test_position.push(pawn_e7, (0, 4))
+        self.assertEqual(test_position.board[0][4], 'Q')
+        self.assertEqual(test_position.key, test_position.hash_key())
+        test_position.pop()
+        test_position.push(pawn_e7, (0, 4), 'n')
+        self.assertEqual(test_position.board[0][4], 'N')
+        test_position.pop()
+        self.assertEqual(test_position.generate_fen(), fen)
+
+    def test_repetition(self):
+        test_position = position.Position('4k3/8/8/8/8/8/8/4K2N w - - 0 1')
+        shuffle = [((7, 7), (5, 6)), ((0, 4), (0, 3)),
+                   ((5, 6), (7, 7)), ((0, 3), (0, 4))]
+        for i in range(2):
+            self.assertFalse(test_position.is_repetition())
+            for start, end in shuffle:
+                symbol = test_position.board[start[0]][start[1]]
+                test_position.push(piece.PieceFactory.create(symbol, start),
+                                   end)
+        self.assertTrue(test_position.is_repetition())
+        test_position.pop()
+        self.assertFalse(test_position.is_repetition())
+        self.assertTrue(test_position.is_repetition(2))
+
+    def test_castling_rights(self):
+        fen = 'r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1'
+        king_e1 = piece.PieceFactory.create('K', (7, 4))
+        test_position = position.Position(fen)
+        self.assertTrue(test_position.is_legal_move(king_e1, (7, 6)))
+        test_position.castling = 'Qkq'
+        self.assertFalse(test_position.is_legal_move(king_e1, (7, 6)))
+        # Castling through an attacked square is illegal.
+        test_position = position.Position(
+            'r3k2r/8/8/8/8/8/5r2/R3K2R w KQkq - 0 1'
+        )
+        self.assertFalse(test_position.is_legal_move(king_e1, (7, 6)))
+        self.assertTrue(test_position.is_legal_move(king_e1, (7, 2)))
+        # So is castling past a piece, even one the king does not cross.
+        test_position = position.Position(position.FEN_START)
+        self.assertFalse(test_position.is_legal_move(king_e1, (7, 6)))
+        test_position = position.Position(
+            'r3k2r/8/8/8/8/8/8/RN2K2R w KQkq - 0 1'
+        )
+        self.assertFalse(test_position.is_legal_move(king_e1, (7, 2)))
+        # Capturing a rook removes the matching right.
+        test_position = position.Position(fen)
+        rook_a1 = piece.PieceFactory.create('R', (7, 0))
+        test_position.push(rook_a1, (0, 0))
+        self.assertEqual(test_position.castling, 'Kk')
 
     def test_fen_to_board(self):
         """Test the board generation from FEN input.
@@ -255,6 +516,25 @@ class TestPosition(unittest.TestCase):
 
 class TestPiece(unittest.TestCase):
 
+    def test_attacks(self):
+        board = position.Position(
+            '4k3/8/8/3p4/8/1N3B2/8/4K2R w - - 0 1'
+        ).board
+        pawn_d5 = piece.PieceFactory.create('p', (3, 3))
+        knight_b3 = piece.PieceFactory.create('N', (5, 1))
+        bishop_f3 = piece.PieceFactory.create('B', (5, 5))
+        rook_h1 = piece.PieceFactory.create('R', (7, 7))
+        self.assertCountEqual(pawn_d5.attacks(board), [(4, 2), (4, 4)])
+        self.assertCountEqual(knight_b3.attacks(board),
+            [(3, 0), (3, 2), (4, 3), (6, 3), (7, 0), (7, 2)]
+        )
+        self.assertCountEqual(bishop_f3.attacks(board),
+            [(4, 4), (3, 3), (4, 6), (3, 7), (6, 4), (7, 3), (6, 6), (7, 7)]
+        )
+        self.assertCountEqual(rook_h1.attacks(board),
+            [(7, 6), (7, 5), (7, 4)] + [(r, 7) for r in range(7)]
+        )
+
     def test_pawn_calculate_scope(self):
         
         pawn_fen = (
@@ -415,5 +695,971 @@ class TestPiece(unittest.TestCase):
         self.assertCountEqual(king_e8.calculate_scope(castling_pos),
             [(1,5), (1,4), (1,3), (0,3), (0,2)])
 
+class TestInstrument(unittest.TestCase):
+
+    def tearDown(self):
+        instrument.disable()
+
+    def test_enable_disable(self):
+        original = position.Position.is_check
+        instrument.enable(include_graphics=False)
+        instrument.reset()
+        test_position = position.Position(position.FEN_START)
+        self.assertEqual(len(list(test_position.legal_moves())), 20)
+        report = instrument.report()
+        self.assertEqual(report['Position.is_legal_move']['calls'], 20)
+        # No piece is pinned, so no move is played to test it.
+        self.assertEqual(report['Position.make_move']['calls'], 0)
+        self.assertGreater(report['Knight.calculate_scope']['calls'], 0)
+        self.assertIn('"Position.is_check"', instrument.to_json())
+
+        instrument.disable()
+        self.assertIs(position.Position.is_check, original)
+        self.assertFalse(instrument.is_enabled())
+        test_position.generate_fen()
+        self.assertEqual(
+            instrument.report()['Position.generate_fen']['calls'], 0
+        )
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_frame_stats(self):
+        self.assertEqual(telemetry.percentile([], 0.5), 0)
+        self.assertEqual(telemetry.percentile(range(1, 101), 0.9), 91)
+
+        frame_stats = telemetry.FrameStats(window=4, bucket_ms=10)
+        for frame_ms, rect_count in [(33, None), (34, 2), (35, 3), (52, 1),
+                                     (33, None), (33, 0)]:
+            frame_stats.record_frame(frame_ms, 5, rect_count)
+        frame_stats.record_latency(12.5)
+        self.assertEqual(frame_stats.frames, 6)
+        self.assertEqual(list(frame_stats.frame_times), [35, 52, 33, 33])
+        self.assertEqual(frame_stats.full_updates, 2)
+        self.assertEqual(frame_stats.partial_updates, 3)
+        self.assertEqual(frame_stats.histogram, {30: 5, 50: 1})
+        summary = frame_stats.summary()
+        self.assertEqual(summary[3], 'Updates full 2  partial 3')
+        self.assertEqual(summary[4], 'Drop latency ms p50 12.5  max 12.5')
+
+
+class TestBench(unittest.TestCase):
+
+    def test_compare(self):
+        baseline = {'fen_parsing': 10.0, 'generate_fen': 5.0}
+        results = {'fen_parsing': 11.5, 'generate_fen': 5.2, 'new': 1.0}
+        regressions = bench.compare(results, baseline, 0.1)
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(regressions[0][0], 'fen_parsing')
+        self.assertAlmostEqual(regressions[0][3], 0.15)
+
+    def test_run_benchmarks(self):
+        results = bench.run_benchmarks(['generate_fen', 'make_undo'],
+                                       min_time=0.001, repeat=1)
+        self.assertEqual(sorted(results), ['generate_fen', 'make_undo'])
+        self.assertTrue(all(result > 0 for result in results.values()))
+
+
+class TestReplay(unittest.TestCase):
+
+    def tearDown(self):
+        pygame.quit()
+
+    def test_record_and_replay(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'session.jsonl')
+        recorder = replay.Recorder(path, position.FEN_START)
+        # Drag the e2 pawn to e4.
+        for event_type, pos in [(pygame.MOUSEBUTTONDOWN, (330, 480)),
+                                (pygame.MOUSEMOTION, (330, 405)),
+                                (pygame.MOUSEBUTTONUP, (330, 330))]:
+            if event_type == pygame.MOUSEMOTION:
+                event = pygame.event.Event(event_type, pos=pos)
+            else:
+                event = pygame.event.Event(event_type, pos=pos, button=1)
+            recorder.record(event)
+        recorder.record(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_d))
+        recorder.close()
+
+        fen, lines, events = replay.load(path)
+        self.assertEqual((fen, lines), (position.FEN_START, None))
+        self.assertEqual([e['type'] for e in events],
+                         ['down', 'motion', 'up'])
+
+        timings = replay.replay(path)
+        for stage in replay.STAGES + ['drop']:
+            self.assertEqual(len(timings[stage]), 1, stage)
+        self.assertEqual(replay.summarise(timings)['drop']['count'], 1)
+
+    def test_replay_board_events(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'session.jsonl')
+        events = [
+            # 1. e4, taken back, then the hinted 1. d4 slides in.
+            {'t': 0, 'type': 'down', 'pos': [330, 480], 'button': 1},
+            {'t': 10, 'type': 'up', 'pos': [330, 330], 'button': 1},
+            {'t': 20, 'type': 'takeback'},
+            {'t': 30, 'type': 'hint', 'move': [[6, 3], [4, 3]]},
+            # A click during the slide, Nc6, is ignored.
+            {'t': 50, 'type': 'down', 'pos': [105, 30], 'button': 1},
+            {'t': 60, 'type': 'up', 'pos': [180, 180], 'button': 1},
+            # 1... Nf6, then 2. Nf3 Nc6 on a board of 50-pixel squares.
+            {'t': 1000, 'type': 'down', 'pos': [480, 30], 'button': 1},
+            {'t': 1010, 'type': 'up', 'pos': [405, 180], 'button': 1},
+            {'t': 1100, 'type': 'resize',
+             'size': [400, 400 + graphics.TEXT_HEIGHT]},
+            {'t': 1200, 'type': 'down', 'pos': [325, 375], 'button': 1},
+            {'t': 1210, 'type': 'up', 'pos': [275, 275], 'button': 1},
+            {'t': 1300, 'type': 'down', 'pos': [75, 25], 'button': 1},
+            {'t': 1310, 'type': 'up', 'pos': [125, 125], 'button': 1},
+        ]
+        with open(path, 'w') as f:
+            f.write(json.dumps({'fen': position.FEN_START}) + '\n')
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+        timings = replay.replay(path)
+        self.assertEqual(len(timings['drop']), 5)
+        self.assertEqual(len(timings['update_position']), 4)
+
+        recorder = replay.Recorder(path, position.FEN_START)
+        recorder.record(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_LEFT))
+        recorder.record(pygame.event.Event(pygame.VIDEORESIZE, w=400, h=600))
+        recorder.record_hint((6, 3), (4, 3))
+        recorder.close()
+        self.assertEqual([event['type'] for event in replay.load(path)[2]],
+                         ['takeback', 'resize', 'hint'])
+
+    def test_replay_puzzle(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'session.jsonl')
+        fen = '7k/8/5K2/8/8/8/8/6R1 w - - 0 1'
+        tree = solution.SolutionTree(fen, [['Kf7', 'Kh7', 'Rh1#']])
+        replay.Recorder(path, fen, tree).close()
+        self.assertEqual(replay.load(path)[:2],
+                         (fen, [['Kf7', 'Kh7', 'Rh1#']]))
+        # Kf7, answered by Kh7, then Rh1#.
+        with open(path, 'a') as f:
+            for t, kind, pos in [(0, 'down', [405, 180]),
+                                 (10, 'up', [405, 105]),
+                                 (1000, 'down', [480, 555]),
+                                 (1010, 'up', [555, 555])]:
+                f.write(json.dumps({'t': t, 'type': kind, 'pos': pos,
+                                    'button': 1}) + '\n')
+        timings = replay.replay(path)
+        self.assertEqual(len(timings['drop']), 2)
+        self.assertEqual(len(timings['update_position']), 2)
+
+
+class TestNotation(unittest.TestCase):
+
+    def test_parse_san(self):
+        test_position = position.Position(
+            'r3k2r/1P6/8/8/8/2N3N1/8/R3K2R w KQkq - 0 1'
+        )
+        own_piece, end, promotion = notation.parse_san(test_position, 'Nce4')
+        self.assertEqual((own_piece.square, end, promotion),
+                         ((5, 2), (4, 4), None))
+        own_piece, end, promotion = notation.parse_san(test_position,
+                                                       'bxa8=N+')
+        self.assertEqual((own_piece.square, end, promotion),
+                         ((1, 1), (0, 0), 'N'))
+        own_piece, end, promotion = notation.parse_san(test_position, 'O-O-O')
+        self.assertEqual((own_piece.square, end), ((7, 4), (7, 2)))
+        for san in ('Ne4', 'Nd4', 'Kf3', 'Z9'):
+            with self.assertRaises(ValueError):
+                notation.parse_san(test_position, san)
+        # Castling through pieces.
+        for san in ('O-O', 'O-O-O'):
+            with self.assertRaises(ValueError):
+                notation.parse_san(position.Position(position.FEN_START), san)
+
+    def test_format_san(self):
+        test_position = position.Position(
+            'r3k2r/1P6/8/8/8/2N3N1/8/R3K2R w KQkq - 0 1'
+        )
+        knight = piece.PieceFactory.create('N', (5, 2))
+        self.assertEqual(notation.format_san(test_position, knight, (4, 4)),
+                         'Nce4')
+        self.assertEqual(notation.format_san(test_position, knight, (3, 3)),
+                         'Nd5')
+        pawn = piece.PieceFactory.create('P', (1, 1))
+        self.assertEqual(notation.format_san(test_position, pawn, (0, 0)),
+                         'bxa8=Q+')
+        rook = piece.PieceFactory.create('R', (7, 0))
+        self.assertEqual(notation.format_san(test_position, rook, (0, 0)),
+                         'Rxa8+')
+        self.assertEqual(test_position.ply, 0)
+
+    def test_format_san_history(self):
+        test_position = position.Position(position.FEN_START)
+        shuffle = [((7, 6), (5, 5)), ((0, 6), (2, 5)),
+                   ((5, 5), (7, 6)), ((2, 5), (0, 6))]
+        for i in range(position.Position.HISTORY_SIZE // 4):
+            for start, end in shuffle:
+                symbol = test_position.board[start[0]][start[1]]
+                test_position.push(piece.PieceFactory.create(symbol, start),
+                                   end)
+        # The history stack is full.
+        knight = piece.PieceFactory.create('N', (7, 6))
+        self.assertEqual(notation.format_san(test_position, knight, (5, 5)),
+                         'Nf3')
+        # Trying a move keeps the move taken back for redo.
+        test_position.pop()
+        pawn = piece.PieceFactory.create('p', (1, 4))
+        self.assertEqual(notation.format_san(test_position, pawn, (3, 4)),
+                         'e5')
+        self.assertIsNotNone(test_position.redo())
+        self.assertEqual(test_position.generate_fen(), position.FEN_START)
+
+    def test_uci(self):
+        test_position = position.Position(
+            'r3k2r/1P6/8/8/8/2N3N1/8/R3K2R w KQkq - 0 1'
+        )
+        own_piece, end, promotion = notation.parse_uci(test_position, 'b7a8n')
+        self.assertEqual((own_piece.square, end, promotion),
+                         ((1, 1), (0, 0), 'N'))
+        self.assertEqual(notation.format_uci(own_piece, end, promotion),
+                         'b7a8n')
+        own_piece, end, promotion = notation.parse_uci(test_position, 'e1g1')
+        self.assertEqual(notation.format_uci(own_piece, end), 'e1g1')
+        for uci in ('e1e3', 'a8a7', 'c3c4', 'e2e4', 'b7b8x'):
+            with self.assertRaises(ValueError):
+                notation.parse_uci(test_position, uci)
+        for uci in ('e1g1', 'e1c1'):
+            with self.assertRaises(ValueError):
+                notation.parse_uci(position.Position(position.FEN_START), uci)
+
+    def test_lines(self):
+        sans = ['e4', 'e5', 'Bc4', 'Nc6', 'Qh5', 'Nf6', 'Qxf7#']
+        ucis = notation.san_to_uci(position.Position(position.FEN_START),
+                                   sans)
+        self.assertEqual(ucis, ['e2e4', 'e7e5', 'f1c4', 'b8c6', 'd1h5',
+                                'g8f6', 'h5f7'])
+        self.assertEqual(
+            notation.uci_to_san(position.Position(position.FEN_START), ucis),
+            sans
+        )
+        moves = notation.parse_line(position.Position(position.FEN_START),
+                                    ucis, notation.parse_uci)
+        self.assertEqual(
+            notation.format_line(position.Position(position.FEN_START),
+                                 moves),
+            sans
+        )
+
+
+class TestPgn(unittest.TestCase):
+
+    PGN = (
+        '[Event "Casual"]\n[Result "1-0"]\n\n'
+        '1. e4 e5 2. Bc4 {aiming at f7} Nc6 3. Qh5 Nf6?? '
+        '(3... g6 4. Qf3 Nf6) 4. Qxf7# 1-0\n\n'
+        '[Event "Casual"]\n[Result "1/2-1/2"]\n\n1. d4 d5 $1 2. c4 1/2-1/2\n'
+    )
+
+    def test_games(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'games.pgn')
+        with open(path, 'w') as f:
+            f.write(self.PGN)
+        ranges = pgn.shards(path, 10)
+        self.assertEqual(len(ranges), 2)
+        with open(path, 'rb') as f:
+            found = [list(pgn.games(f, start, end)) for start, end in ranges]
+        self.assertEqual([len(shard) for shard in found], [1, 1])
+        headers, moves = found[0][0]
+        self.assertEqual(headers['Result'], '1-0')
+        self.assertEqual(moves, ['e4', 'e5', 'Bc4', 'Nc6', 'Qh5', 'Nf6??',
+                                 'Qxf7#'])
+        self.assertEqual(pgn.mine(path, *ranges[0]), [(
+            'r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR '
+            'w KQkq - 0 1', ['Qxf7#']
+        )])
+        self.assertEqual(pgn.mine(path, *ranges[1]), [])
+
+
+class TestDedup(unittest.TestCase):
+
+    def test_canonical_fen(self):
+        fen = '6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1'
+        equivalents = [
+            '6k1/5ppp/8/8/8/8/8/R5K1 w - - 7 40',
+            'r5k1/8/8/8/8/8/5PPP/6K1 b - - 0 1',     # Colours swapped.
+            '1k6/ppp5/8/8/8/8/8/1K5R w - - 0 1',     # Mirrored.
+            '1k5r/8/8/8/8/8/PPP5/1K6 b - - 0 1',     # Both.
+        ]
+        for other in equivalents:
+            self.assertEqual(dedup.canonical_fen(other),
+                             dedup.canonical_fen(fen))
+        self.assertNotEqual(
+            dedup.canonical_fen('6k1/5ppp/8/8/8/8/8/R5K1 b - - 0 1'),
+            dedup.canonical_fen(fen)
+        )
+        # Castling rights rule out mirroring.
+        self.assertNotEqual(
+            dedup.canonical_fen('r3k3/8/8/8/8/8/8/4K3 b q - 0 1'),
+            dedup.canonical_fen('3k3r/8/8/8/8/8/8/3K4 b k - 0 1')
+        )
+        self.assertEqual(
+            dedup.canonical_fen('r3k3/8/8/8/8/8/8/4K3 b q - 0 1'),
+            dedup.canonical_fen('4k3/8/8/8/8/8/8/R3K3 w Q - 0 1')
+        )
+
+    def test_dedup(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'puzzles.tsv')
+        with open(path, 'w') as f:
+            f.write('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1\tRa8#\n'
+                    'not a puzzle\n'
+                    '1k5r/8/8/8/8/8/PPP5/1K6 b - - 0 1\tRh1#\n'
+                    + position.FEN_START + '\n'
+                    '6k1/5ppp/8/8/8/8/8/R5K1 w - - 3 9\tRa8#\n')
+        names, read = dedup.partition([path], directory, 3)
+        self.assertEqual(read, 4)
+        lines = []
+        for name in names:
+            output = io.StringIO()
+            dedup.dedup_partition(name, output)
+            lines.extend(output.getvalue().splitlines())
+        self.assertEqual(sorted(lines), [
+            '6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1\tRa8#', position.FEN_START
+        ])
+
+        output_path = os.path.join(directory, 'distinct.tsv')
+        self.assertEqual(dedup.dedup([path, path], output_path), (8, 2))
+
+
+class TestGenerate(unittest.TestCase):
+
+    def test_screen(self):
+        back_rank = position.Position('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1')
+        self.assertEqual(generate.flights(back_rank), 2)
+        self.assertTrue(generate.has_check(back_rank))
+        self.assertTrue(generate.screen(back_rank))
+        self.assertFalse(generate.screen(back_rank, max_flights=1))
+        # Nothing to mate with.
+        bare = position.Position('4k3/8/8/8/8/8/4P3/4K3 w - - 0 1')
+        self.assertFalse(generate.screen(bare))
+        # Too many flight squares.
+        open_king = position.Position('4k3/8/8/8/8/8/8/R3K3 w - - 0 1')
+        self.assertEqual(generate.flights(open_king), 5)
+        self.assertFalse(generate.screen(open_king))
+
+    def test_prove(self):
+        self.assertEqual(
+            generate.prove('7k/8/5K2/8/8/8/8/6R1 w - - 0 1', 2),
+            ['Kf7', 'Kh7', 'Rh1#']
+        )
+        # Either rook mates.
+        self.assertEqual(len(search.mating_moves(
+            '6k1/5ppp/8/8/8/8/8/RR4K1 w - - 0 1', 1)), 2)
+        self.assertIsNone(
+            generate.prove('6k1/5ppp/8/8/8/8/8/RR4K1 w - - 0 1', 2))
+
+    def test_main(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'puzzles.tsv')
+        seeds = os.path.join(directory, 'seeds.txt')
+        with open(seeds, 'w') as f:
+            f.write('6k1/5ppp/8/8/8/8/8/R5K1 b - - 0 1\n')
+        report = io.StringIO()
+        with contextlib.redirect_stderr(report):
+            # Black makes one random move, then White's position is
+            # screened.
+            generate.main(['-o', path, '--seeds', seeds, '--workers', '1',
+                           '--batches', '3', '--batch-size', '4',
+                           '--plies', '1', '--seed', '1'])
+        with open(path) as f:
+            self.assertEqual(f.read(),
+                             '7k/5ppp/8/8/8/8/8/R5K1 w - - 0 1\tRa8#\n')
+        self.assertIn('12 positions', report.getvalue())
+
+
+class TestSolution(unittest.TestCase):
+
+    def test_transposition(self):
+        tree = solution.SolutionTree(position.FEN_START, [
+            ['Nf3', 'Nf6', 'Nc3'], ['Nc3', 'Nf6', 'Nf3'], ['Nc3', 'd5', 'd4']
+        ])
+        # Nothing is parsed until a position is reached.
+        self.assertEqual(len(tree.nodes), 1)
+        game = position.Position(position.FEN_START)
+        self.assertTrue(tree.accepts(game, (7, 6), (5, 5)))
+        self.assertTrue(tree.accepts(game, (7, 1), (5, 2)))
+        self.assertFalse(tree.accepts(game, (6, 4), (4, 4)))
+        self.assertEqual(len(tree.nodes), 3)
+
+        game.push(*notation.parse_san(game, 'Nc3'))
+        self.assertEqual(tree.replies(game), [((0, 6), (2, 5)),
+                                              ((1, 3), (3, 3))])
+        for san in ['Nf6', 'Nf3']:
+            tree.expand(game)
+            game.push(*notation.parse_san(game, san))
+        self.assertTrue(tree.is_solved(game))
+
+        # The other order reaches the same final node.
+        other = position.Position(position.FEN_START)
+        for san in ['Nf3', 'Nf6', 'Nc3']:
+            tree.expand(other)
+            other.push(*notation.parse_san(other, san))
+        self.assertEqual(other.key, game.key)
+        # Seven nodes have been created: the transposed final position
+        # is shared, and the position after 1. Nc3 d5 2. d4 is missing, as
+        # the position before 2. d4 has not been expanded.
+        self.assertEqual(len(tree.nodes), 7)
+        self.assertFalse(tree.is_solved(position.Position(position.FEN_START)))
+
+    def test_full_history(self):
+        tree = solution.SolutionTree(position.FEN_START, [['e4', 'e5']])
+        game = position.Position(position.FEN_START)
+        for i in range(position.Position.HISTORY_SIZE // 4):
+            for san in ['Nf3', 'Nf6', 'Ng1', 'Ng8']:
+                game.push(*notation.parse_san(game, san))
+        self.assertTrue(tree.accepts(game, (6, 4), (4, 4)))
+        self.assertEqual(game.ply, position.Position.HISTORY_SIZE)
+
+    def test_load(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'puzzles.tsv')
+        fen = '7k/8/5K2/8/8/8/8/6R1 w - - 0 1'
+        with open(path, 'w') as f:
+            f.write(fen + '\tKf7 Kh7 Rh1#\n'
+                    'bad fen\tKf7\n'
+                    '7k/8/5K2/8/8/8/8/6R1 w - -\tKg6 Kg8 Rg1#\n'
+                    + position.FEN_START + '\te4\n')
+        puzzles = solution.load(path)
+        self.assertEqual(list(puzzles), [fen, position.FEN_START])
+        tree = puzzles[fen]
+        self.assertEqual(tree.solver, 'w')
+        self.assertEqual(len(tree.lines), 2)
+        self.assertEqual(tree.replies(position.Position(fen)),
+                         [((2, 5), (1, 5)), ((2, 5), (2, 6))])
+
+
+class TestThemes(unittest.TestCase):
+
+    PUZZLES = [
+        ('6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1', 'Rd8#', ['backRankMate']),
+        ('r3k3/8/8/1N6/8/8/8/4K3 w - - 0 1', 'Nc7+', ['fork']),
+        ('4k3/8/2n5/8/8/8/8/3BK3 w - - 0 1', 'Ba4', ['pin']),
+        ('8/8/8/q2k4/8/8/8/5K1R w - - 0 1', 'Rh5+', ['skewer']),
+        ('4k3/8/8/8/8/8/4N3/4R1K1 w - - 0 1', 'Nc3+', ['discoveredCheck']),
+        # The queen is drawn away from the diagonal guarding h4.
+        ('3q3k/6pp/8/8/7p/6Q1/8/4R1K1 w - - 0 1', 'Re8+ Qxe8 Qxh4',
+         ['fork', 'pin', 'deflection']),
+    ]
+
+    def test_tables(self):
+        self.assertEqual(tables.between((7, 0), (4, 3)), ((6, 1), (5, 2)))
+        self.assertEqual(tables.between((0, 0), (1, 2)), ())
+        self.assertEqual(tables.RAYS[(0, 0)][(1, 1)][-1], (7, 7))
+        test_position = position.Position(position.FEN_START)
+        for start in tables.SQUARES:
+            for end in tables.SQUARES:
+                self.assertEqual(list(tables.between(start, end)),
+                                 test_position.squares_between(start, end)
+                                 if start != end else [])
+
+    def test_classify(self):
+        for fen, moves, expected in self.PUZZLES:
+            self.assertEqual(themes.classify(fen, moves.split()), expected)
+
+    def test_classify_line(self):
+        fen, moves, expected = self.PUZZLES[0]
+        self.assertEqual(themes.classify_line(fen + '\t' + moves + '\n'),
+                         fen + '\t' + moves + '\tbackRankMate')
+        self.assertIsNone(themes.classify_line(fen + '\tQd8#'))
+        lines = ['a\n', '\n', 'b\n', 'c\n']
+        self.assertEqual(list(themes.chunks(lines, 2)),
+                         [['a\n', 'b\n'], ['c\n']])
+
+
+class TestCorpus(unittest.TestCase):
+
+    FENS = [
+        position.FEN_START,
+        'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w Kq - 0 1',
+        'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 1',
+        '4k3/8/8/8/3pP3/8/8/4K3 b - e3 0 1',
+    ]
+
+    def test_positions(self):
+        with corpus.Corpus.from_fens(self.FENS + ['not a fen']) as shared:
+            self.assertEqual(len(shared), 4)
+            for fen, game in zip(self.FENS, shared.positions()):
+                expected = position.Position(fen)
+                self.assertEqual(game.generate_fen(), fen)
+                self.assertEqual(game.key, expected.key)
+                self.assertEqual(game.white_king, expected.white_king)
+                self.assertEqual(game.black_king, expected.black_king)
+                self.assertEqual(len(list(game.legal_moves())),
+                                 len(list(expected.legal_moves())))
+            # Positions are independent of the corpus and of each other.
+            game = shared.position(2)
+            game.push(piece.PieceFactory.create('P', (3, 4)), (2, 5))
+            self.assertEqual(shared.position(2).generate_fen(), self.FENS[2])
+            self.assertRaises(IndexError, shared.position, 4)
+
+            attached = corpus.Corpus.attach(shared.name)
+            self.assertEqual(attached.position(3).generate_fen(),
+                             self.FENS[3])
+            attached.close()
+            name = shared.name
+        self.assertRaises(FileNotFoundError, corpus.Corpus.attach, name)
+
+    def test_from_board(self):
+        game = position.Position(self.FENS[1])
+        built = position.Position.from_board(
+            [list(rank) for rank in game.board], 'w', 'Kq', '-'
+        )
+        self.assertEqual(built.generate_fen(), self.FENS[1])
+        self.assertEqual((built.key, built.white_king, built.black_king),
+                         (game.key, game.white_king, game.black_king))
+
+    def test_imap(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'puzzles.tsv')
+        with open(path, 'w') as f:
+            f.write('6k1/5ppp/8/8/8/8/8/R5K1 w - -\tRa8#\n'
+                    'not a puzzle\n'
+                    + '\n'.join(self.FENS) + '\n')
+        with corpus.Corpus.from_file(path) as shared:
+            expected = [17, 20, 47, 31, 7]
+            self.assertEqual(list(corpus.imap(_count_moves, shared, 1)),
+                             expected)
+            self.assertEqual(
+                list(corpus.imap(_count_moves, shared, 2, chunk_size=2)),
+                expected
+            )
+
+    @unittest.skipIf(batch is None, 'NumPy is not installed')
+    def test_batch(self):
+        with corpus.Corpus.from_fens(self.FENS) as shared:
+            features = shared.batch(1, 3)
+            expected = batch.Batch.from_positions(
+                [position.Position(fen) for fen in self.FENS[1:3]]
+            )
+            self.assertTrue((features.board == expected.board).all())
+            self.assertEqual(list(features.white), [True, True])
+
+
+def _count_moves(game):
+    return len(list(game.legal_moves()))
+
+
+@unittest.skipIf(batch is None, 'NumPy is not installed')
+class TestBatch(unittest.TestCase):
+
+    FENS = [
+        position.FEN_START,
+        'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        '4k3/8/8/8/1b6/8/3P4/4K3 w - - 0 1',
+        '4k3/8/8/8/1b6/8/3P4/4K3 b - - 0 1',
+        '6k1/5ppp/8/8/4n3/8/8/R3Q1K1 w - - 0 1',
+    ]
+
+    def test_attacks(self):
+        positions = [position.Position(fen) for fen in self.FENS]
+        features = batch.Batch.from_positions(positions)
+        for colour in 'wb':
+            attacks = features.attacks(colour)
+            for i, test_position in enumerate(positions):
+                for square in range(64):
+                    self.assertEqual(
+                        bool(int(attacks[i]) >> square & 1),
+                        test_position.is_attacked(divmod(square, 8), colour)
+                    )
+
+    def test_features(self):
+        positions = [position.Position(fen) for fen in self.FENS]
+        features = batch.Batch.from_positions(positions).features()
+        self.assertEqual(list(features['mobility']), [20, 46, 6, 13, 29])
+        self.assertEqual(list(features['opponent_mobility']),
+                         [20, 41, 13, 6, 16])
+        self.assertFalse(features['in_check'].any())
+        # Bxd2+ and Ra8#.
+        self.assertEqual(list(features['checks']), [0, 0, 0, 1, 1])
+        # The knight on e4.
+        self.assertEqual(list(features['hanging']), [0, 1, 0, 0, 1])
+        self.assertEqual(list(features['own_hanging']), [0, 0, 0, 0, 0])
+
+
+class TestStartup(unittest.TestCase):
+
+    def tearDown(self):
+        pygame.quit()
+
+    def test_startup_timer(self):
+        timer = telemetry.StartupTimer(start=10.0)
+        timer.marks = [('imports', 10.25), ('first frame', 10.5)]
+        self.assertEqual(timer.report(), [
+            'imports             250.0 ms  (at    250.0 ms)',
+            'first frame         250.0 ms  (at    500.0 ms)',
+        ])
+
+    def test_images_decoded_once(self):
+        pygame.display.init()
+        pygame.display.set_mode((graphics.SCREEN_WIDTH,
+                                 graphics.SCREEN_HEIGHT))
+        board = graphics.Board(position.FEN_START)
+        board.add_sprites()
+        pawns = [sprite for sprite in board.sprite_list
+                 if sprite.piece.symbol == 'P']
+        self.assertEqual(len(pawns), 8)
+        self.assertTrue(all(sprite.image is pawns[0].image
+                            for sprite in pawns))
+
+
+class TestBoard(unittest.TestCase):
+
+    def setUp(self):
+        pygame.display.init()
+        self.screen = pygame.display.set_mode((graphics.SCREEN_WIDTH,
+                                               graphics.SCREEN_HEIGHT))
+        graphics.PieceSprite.selected_count = 0
+
+    def tearDown(self):
+        pygame.quit()
+
+    def assertSameBoard(self, board):
+        """ Compare the screen with a full redraw of 'board'. """
+        expected = pygame.Surface(self.screen.get_size())
+        fresh = graphics.Board(board.generate_fen(), board.board_size)
+        fresh.add_sprites()
+        fresh.draw_squares(expected, board.board_size)
+        fresh.sprite_list.draw(expected)
+        area = board.board_rect
+        self.assertEqual(
+            pygame.image.tobytes(self.screen.subsurface(area), 'RGB'),
+            pygame.image.tobytes(expected.subsurface(area), 'RGB')
+        )
+
+    def test_drag_and_drop(self):
+        board = graphics.Board(position.FEN_START)
+        board.add_sprites()
+        board.draw(self.screen, graphics.BOARD_SIZE)
+        board.clear_updated_rects()
+
+        # Drag the e2 pawn to e4, a frame at a time.
+        board.select_piece((330, 480))
+        board.start_drag((330, 480))
+        for y in range(470, 320, -10):
+            board.drag(self.screen, (330, y))
+            self.assertFalse(board.whole_board_update())
+            self.assertLessEqual(len(board.updated_rects), 2)
+            board.clear_updated_rects()
+        move_data = board.process_move(self.screen, (330, 330))
+        self.assertIsNotNone(move_data)
+        board.update_board(self.screen, board.update_position(move_data))
+        self.assertSameBoard(board)
+        self.assertEqual(graphics.PieceSprite.selected_count, 0)
+
+        # An illegal drop and a drop off the board return the bishop.
+        for drop in [(420, 100), (420, 700)]:
+            board.select_piece((440, 30))
+            board.start_drag((440, 30))
+            board.drag(self.screen, drop)
+            self.assertIsNone(board.process_move(self.screen, drop))
+            self.assertSameBoard(board)
+            self.assertEqual(graphics.PieceSprite.selected_count, 0)
+
+    def test_updated_rects(self):
+        board = graphics.Board('4k3/8/8/8/8/8/8/RN2K2R w K - 0 1')
+        board.add_sprites()
+        board.draw(self.screen, graphics.BOARD_SIZE)
+        board.clear_updated_rects()
+        size = board.square_size
+
+        def square_rect(square):
+            return pygame.Rect(board.coordinates_from_square(square),
+                               (size, size))
+
+        def updated(square):
+            return any(rect.contains(square_rect(square))
+                       for rect in board.updated_rects)
+
+        # Grab the b1 knight by its top right corner and drop it on the
+        # bottom left of c3: the whole of c3 must be redrawn.
+        grab = square_rect((7, 1)).move(-2, 2).topright
+        drop = square_rect((5, 2)).move(2, -2).bottomleft
+        board.select_piece(grab)
+        board.start_drag(grab)
+        board.drag(self.screen, drop)
+        board.clear_updated_rects()
+        move_data = board.process_move(self.screen, drop)
+        board.update_board(self.screen, board.update_position(move_data))
+        self.assertTrue(updated((7, 1)) and updated((5, 2)))
+
+        # Castling redraws the squares of the king and of the rook.
+        black_king = board.find_piece_on_square((0, 4))
+        board.update_board(self.screen,
+                           board.update_position((black_king, (0, 3))))
+        board.clear_updated_rects()
+        board.select_piece(square_rect((7, 4)).center)
+        move_data = board.process_move(self.screen,
+                                       square_rect((7, 6)).center)
+        board.update_board(self.screen, board.update_position(move_data))
+        for square in [(7, 4), (7, 5), (7, 6), (7, 7)]:
+            self.assertTrue(updated(square))
+        self.assertSameBoard(board)
+
+    def test_solution(self):
+        fen = '7k/8/5K2/8/8/8/8/6R1 w - - 0 1'
+        board = graphics.Board(fen)
+        board.solution = solution.SolutionTree(fen, [['Kf7', 'Kh7', 'Rh1#']])
+        board.add_sprites()
+        board.draw(self.screen, graphics.BOARD_SIZE)
+        # Rg8+ is legal but not the solution.
+        board.select_piece((480, 555))
+        self.assertIsNone(board.process_move(self.screen, (480, 30)))
+        self.assertEqual(graphics.PieceSprite.selected_count, 0)
+        board.select_piece((405, 180))
+        self.assertIsNotNone(board.process_move(self.screen, (405, 105)))
+
+    def test_finish_move(self):
+        fen = '7k/8/5K2/8/8/8/8/6R1 w - - 0 1'
+        board = graphics.Board(fen)
+        board.solution = solution.SolutionTree(fen, [['Kf7', 'Kh7', 'Rh1#']])
+        board.add_sprites()
+        board.draw(self.screen, graphics.BOARD_SIZE)
+
+        def play(start, end):
+            board.play_line([(start, end)])
+            now = 0
+            while board.is_animating():
+                board.step_animations(self.screen, now)
+                now += 16
+
+        # Rg8+ is not the solution; Kf7 is, and is answered by Kh7.
+        self.assertFalse(board.keeps_to_solution((7, 6), (0, 6)))
+        self.assertTrue(board.keeps_to_solution((2, 5), (1, 5)))
+        play((2, 5), (1, 5))
+        board.finish_move(self.screen)
+        self.assertEqual(board.pending_moves, [((0, 7), (1, 7))])
+        play(*board.pending_moves.pop())
+        self.assertTrue(board.keeps_to_solution((7, 6), (7, 7)))
+        play((7, 6), (7, 7))
+        board.finish_move(self.screen)
+        self.assertFalse(board.is_animating())
+        self.assertEqual(board.textbox.lines, ['Checkmate.', 'Solved.'])
+
+    def test_animation(self):
+        fen = 'r3k3/8/8/8/8/8/8/R3K2R w KQq - 0 1'
+        board = graphics.Board(fen)
+        board.add_sprites()
+        board.draw(self.screen, graphics.BOARD_SIZE)
+        board.clear_updated_rects()
+
+        # Castle, black takes on a1 and the f1 rook takes back.
+        board.play_line([((7, 4), (7, 6)), ((0, 0), (7, 0)),
+                         ((7, 5), (7, 0))])
+        now = 0
+        frames = 0
+        while board.is_animating():
+            board.step_animations(self.screen, now)
+            self.assertFalse(board.whole_board_update())
+            # At most the captured square and one union per sprite.
+            self.assertLessEqual(len(board.updated_rects), 3)
+            board.clear_updated_rects()
+            now += 16
+            frames += 1
+        self.assertGreater(frames, 3 * graphics.ANIMATION_MS // 16)
+        self.assertEqual(board.generate_fen(),
+                         '4k3/8/8/8/8/8/8/R5K1 b - - 0 1')
+        self.assertEqual(len(board.sprite_list), 3)
+        self.assertSameBoard(board)
+
+        # A queued move which is no longer legal drops the queue.
+        board.play_line([((7, 4), (7, 6)), ((0, 4), (0, 5))])
+        board.step_animations(self.screen, now)
+        self.assertFalse(board.is_animating())
+        self.assertEqual(board.generate_fen(),
+                         '4k3/8/8/8/8/8/8/R5K1 b - - 0 1')
+
+    def test_slide(self):
+        slide = graphics.Slide(None, (0, 0), (100, 200), 1000, 100)
+        self.assertEqual(slide.position(900), (0, 0))
+        self.assertEqual(slide.position(1050), (75, 150))
+        self.assertEqual(slide.position(1200), (100, 200))
+        self.assertFalse(slide.finished(1099))
+        self.assertTrue(slide.finished(1100))
+
+    def test_resize(self):
+        board = graphics.Board(position.FEN_START)
+        board.add_sprites()
+        board.draw(self.screen, graphics.BOARD_SIZE)
+        board.resize(self.screen, 403)
+        self.assertEqual(board.board_size, 400)
+        self.assertEqual(board.square_size, 50)
+        self.assertEqual(board.textbox.rect.top, 400)
+        self.assertEqual(board.square_from_cursor((399, 399)), (7, 7))
+        self.assertSameBoard(board)
+        self.assertTrue(all(sprite.image.get_size() == (50, 50)
+                            for sprite in board.sprite_list))
+
+        # Going back to the original size reuses the cached images.
+        misses = graphics.IMAGE_CACHE.misses
+        board.resize(self.screen, graphics.BOARD_SIZE)
+        self.assertEqual(graphics.IMAGE_CACHE.misses, misses)
+        self.assertSameBoard(board)
+
+    def test_grid(self):
+        fens = [position.FEN_START, 'k7/8/8/8/8/8/8/7K w - - 0 1'] * 8
+        grid = graphics.BoardGrid(fens, 4, self.screen.get_rect())
+        self.assertEqual(grid.square_size, 18)
+        grid.draw(self.screen)
+        self.assertEqual(grid.cell_at((1, 1)), 0)
+        self.assertEqual(grid.cell_at((160, 1)), 1)
+        self.assertIsNone(grid.cell_at((145, 1)))    # In the gap.
+
+        # Each cell looks like a full board drawn at the same size.
+        board = graphics.Board(position.FEN_START, 144)
+        board.add_sprites()
+        expected = pygame.Surface((144, 144))
+        board.draw_squares(expected, 144)
+        board.sprite_list.draw(expected)
+        self.assertEqual(
+            pygame.image.tobytes(self.screen.subsurface(grid.cell_rect(0)),
+                                 'RGB'),
+            pygame.image.tobytes(expected, 'RGB')
+        )
+
+        grid.clear_updated_rects()
+        grid.set_cell(self.screen, 1, position.FEN_START)
+        self.assertEqual(grid.updated_rects, [grid.cell_rect(1)])
+        self.assertEqual(self.screen.subsurface(grid.cell_rect(1)).get_at(
+            (0, 0)), self.screen.subsurface(grid.cell_rect(0)).get_at((0, 0)))
+
+    def test_text(self):
+        board = graphics.Board(position.FEN_START)
+        board.add_sprites()
+        board.draw(self.screen, graphics.BOARD_SIZE)
+        board.clear_updated_rects()
+        textbox = board.textbox
+        for line in ('Frame ms p50 16.7', 'Busy ms p50 2.0', 'e2-e4'):
+            board.print_text(self.screen, line)
+        self.assertEqual(board.updated_rects,
+                         [textbox.line_rect(i) for i in range(3)])
+        board.clear_updated_rects()
+
+        # Only the changed line is repainted, the leftover one erased.
+        board.erase_text(self.screen)
+        board.print_text(self.screen, 'Frame ms p50 16.7')
+        board.print_text(self.screen, 'Busy ms p50 2.5')
+        board.flush_text(self.screen)
+        self.assertEqual(board.updated_rects,
+                         [textbox.line_rect(1), textbox.line_rect(2)])
+        self.assertEqual(textbox.lines, ['Frame ms p50 16.7',
+                                         'Busy ms p50 2.5'])
+        erased = textbox.line_rect(2)
+        self.assertEqual(
+            pygame.image.tobytes(self.screen.subsurface(erased), 'RGB'),
+            bytes(textbox.colour) * (erased.width * erased.height)
+        )
+
+        self.assertIs(textbox.render('e2-e4'), textbox.render('e2-e4'))
+
+    def test_surface_cache(self):
+        cache = graphics.SurfaceCache(2)
+        created = []
+
+        def create():
+            created.append(pygame.Surface((1, 1)))
+            return created[-1]
+
+        first = cache.get('a', create)
+        cache.get('b', create)
+        self.assertIs(cache.get('a', create), first)
+        cache.get('c', create)    # Evicts 'b', the least recently used.
+        self.assertEqual(list(cache.surfaces), ['a', 'c'])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+
+class TestSearch(unittest.TestCase):
+
+    def test_finds_mate(self):
+        hint = search.Search('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1')
+        results = []
+        while not hint.finished:
+            results.extend(hint.step(5))
+        self.assertEqual(hint.best_move, ((7, 0), (0, 0)))
+        self.assertEqual(hint.score, search.MATE_SCORE - 1)
+        self.assertEqual([r[0] for r in results], [1, 2])
+        self.assertEqual(hint.position.generate_fen(),
+                         '6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1')
+
+    def test_mate_in(self):
+        line = search.mate_in('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1', 2)
+        self.assertEqual([(p.square, end) for p, end in line],
+                         [((7, 0), (0, 0))])
+        # King and rook against king: 1. Kf7 Kh7 2. Rh1#.
+        line = search.mate_in('7k/8/5K2/8/8/8/8/6R1 w - - 0 1', 2)
+        self.assertIsNone(search.mate_in('7k/8/5K2/8/8/8/8/6R1 w - - 0 1', 1))
+        self.assertEqual(len(line), 3)
+        self.assertIsNone(search.mate_in(position.FEN_START, 2))
+
+    def test_close(self):
+        hint = search.Search(position.FEN_START, yield_every=1)
+        self.assertEqual(hint.step(0), [])
+        hint.close()
+        self.assertTrue(hint.finished)
+        self.assertEqual(hint.step(10), [])
+
+    def test_cache(self):
+        cache = movecache.MoveCache()
+        fen = '7k/8/5K2/8/8/8/8/6R1 w - - 0 1'
+        self.assertEqual(len(search.mate_in(fen, 2, cache)), 3)
+        misses = cache.misses
+        # Trying the puzzle again only looks up positions already seen.
+        self.assertEqual(len(search.mate_in(fen, 2, cache)), 3)
+        self.assertEqual(cache.misses, misses)
+        self.assertGreater(cache.hits, 0)
+
+        hint = search.Search('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1', cache=cache)
+        while not hint.finished:
+            hint.step(5)
+        self.assertEqual(hint.best_move, ((7, 0), (0, 0)))
+
+
+class TestMoveCache(unittest.TestCase):
+
+    def test_get(self):
+        cache = movecache.MoveCache(capacity=2)
+        test_position = position.Position(position.FEN_START)
+        legal = cache.get(test_position)
+        self.assertEqual(len(legal.moves), 20)
+        self.assertTrue(legal.is_legal((6, 4), (4, 4)))
+        self.assertFalse(legal.is_legal((6, 4), (3, 4)))
+        self.assertFalse(legal.is_legal((1, 4), (3, 4)))
+        self.assertFalse(legal.check or legal.checkmate or legal.stalemate)
+        ordered = legal.ordered(((7, 6), (5, 5)))
+        self.assertEqual((ordered[0][0].square, ordered[0][1]),
+                         ((7, 6), (5, 5)))
+        self.assertEqual(len(ordered), 20)
+        self.assertIs(cache.get(test_position), legal)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        mated = position.Position('3R2k1/5ppp/8/8/8/8/8/6K1 b - - 0 1')
+        self.assertTrue(cache.is_checkmate(mated))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertTrue(cache.get(mated).checkmate)
+        stalemated = position.Position('7k/5Q2/8/8/8/8/8/6K1 b - - 0 1')
+        self.assertTrue(cache.get(stalemated).stalemate)
+        # The start position was least recently used.
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn(test_position.key, cache.entries)
+        self.assertEqual(cache.stats()['misses'], 3)
+        cache.clear()
+        self.assertEqual((len(cache), cache.hit_rate()), (0, 0.0))
+
+
 if __name__ == '__main__':
     main() 
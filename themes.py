@@ -0,0 +1,258 @@
+"""
+Module for tagging puzzles with the tactical motifs of their solutions.
+
+A puzzle file holds one puzzle per line: its FEN, a tab and the solution in
+SAN, as written by pgn.py. Each solution is played through once. After each
+of the solver's moves the position reached is examined with the piece
+attack sets and the ray tables of tables.py; no move is tried and taken
+back to test a motif. The classifier streams the file through a pool of
+worker processes, keeping the input order:
+
+    python themes.py puzzles.tsv -o tagged.tsv --workers 8
+
+Each output line is the input line followed by a tab and the comma
+separated themes of the puzzle.
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+
+import notation
+import piece
+import position
+import tables
+
+THEMES = ('fork', 'pin', 'skewer', 'discoveredCheck', 'backRankMate',
+          'deflection')
+
+# Puzzles given to a worker at a time.
+CHUNK_SIZE = 500
+
+# Ray directions of each kind of sliding piece.
+SLIDER_STEPS = {
+    'b': piece.DIAGONAL_STEPS,
+    'r': piece.LINE_STEPS,
+    'q': piece.DIAGONAL_STEPS + piece.LINE_STEPS,
+}
+
+
+def classify(fen, moves):
+    """ Return the themes, in the order of THEMES, shown by the solver's
+        moves of a puzzle. Raise ValueError if the FEN or a move is
+        invalid.
+
+    Args: fen (str): FEN string of the puzzle, with the solver to move.
+          moves (str[]): Solution in SAN, alternating the solver's moves
+                         and the replies.
+    """
+    game = position.Position(fen)
+    solver = game.turn
+    found = set()
+    forcing = False
+    # (square, covered squares) of a defender driven away by a reply.
+    deflected = None
+
+    for ply, san in enumerate(moves):
+        own_piece, end, promotion = notation.parse_san(game, san)
+        if ply % 2:
+            # Remember what the replying piece guarded before moving.
+            deflected = None
+            if forcing:
+                deflected = end, set(own_piece.attacks(game.board))
+            game.push(own_piece, end, promotion)
+            continue
+
+        move_data = game.push(own_piece, end, promotion)
+        moved = piece.PieceFactory.create(game.board[end[0]][end[1]], end)
+        landed = {end}
+        if move_data[4] is not None:
+            landed.add(position.CASTLE_ROOKS[move_data[4]][1])
+        checkers = list(game.attackers(_king(game, game.turn), solver))
+        capture = move_data[3] is not None
+        forcing = capture or bool(checkers)
+
+        if any(square not in landed for square, symbol in checkers):
+            found.add('discoveredCheck')
+        if _is_fork(game, moved):
+            found.add('fork')
+        found.update(_line_motifs(game.board, moved))
+        if deflected is not None and _is_deflection(game, deflected, end):
+            found.add('deflection')
+        if (ply == len(moves) - 1 and checkers
+                and _is_back_rank_mate(game, checkers)):
+            found.add('backRankMate')
+
+    return [theme for theme in THEMES if theme in found]
+
+
+def _king(game, colour):
+    return game.white_king if colour == 'w' else game.black_king
+
+
+def _is_enemy(symbol, colour):
+    return symbol != '-' and symbol.isupper() != (colour == 'w')
+
+
+def _is_fork(game, moved):
+    """ Return True if the piece just moved attacks two or more enemy
+        pieces, each of them the king, worth more than it or undefended. """
+    board = game.board
+    colour = 'w' if moved.symbol.isupper() else 'b'
+    enemy = 'b' if colour == 'w' else 'w'
+    value = position.piece_value(moved.symbol)
+    targets = 0
+    for row, col in moved.attacks(board):
+        target = board[row][col]
+        if not _is_enemy(target, colour):
+            continue
+        if (target in 'Kk' or position.piece_value(target) > value
+                or not game.is_attacked((row, col), enemy)):
+            targets += 1
+    return targets >= 2
+
+
+def _line_motifs(board, moved):
+    """ Return the pins and skewers made by the piece just moved: two
+        enemy pieces in a row on one of its rays. The front piece is
+        pinned if the one behind it is worth more, and skewered if it is
+        worth more itself. """
+    steps = SLIDER_STEPS.get(moved.symbol.lower())
+    if steps is None:
+        return set()
+    colour = 'w' if moved.symbol.isupper() else 'b'
+    motifs = set()
+    for step in steps:
+        pieces = tables.first_pieces(board, moved.square, step)
+        if len(pieces) < 2:
+            continue
+        (front_square, front), (back_square, back) = pieces
+        if not (_is_enemy(front, colour) and _is_enemy(back, colour)):
+            continue
+        front_value = position.piece_value(front)
+        back_value = position.piece_value(back)
+        if back_value > front_value:
+            motifs.add('pin')
+        elif front_value > back_value:
+            motifs.add('skewer')
+    return motifs
+
+
+def _is_deflection(game, deflected, end):
+    """ Return True if the solver's move lands on a square the last reply
+        stopped guarding. """
+    square, covered = deflected
+    if end not in covered or end == square:
+        return False
+    symbol = game.board[square[0]][square[1]]
+    defender = piece.PieceFactory.create(symbol, square)
+    return end not in defender.attacks(game.board)
+
+
+def _is_back_rank_mate(game, checkers):
+    """ Return True if the side to move is mated on its back rank by a rook
+        or queen along that rank, its own pieces blocking its escape. """
+    if len(checkers) != 1:
+        return False
+    colour = game.turn
+    row, col = _king(game, colour)
+    back_rank, forward = (7, -1) if colour == 'w' else (0, 1)
+    checker_square, checker = checkers[0]
+    if row != back_rank or checker_square[0] != row or checker in 'BbNnPp':
+        return False
+    board = game.board
+    for c in range(max(0, col - 1), min(7, col + 1) + 1):
+        symbol = board[row + forward][c]
+        if symbol == '-' or _is_enemy(symbol, colour):
+            return False
+    return not game.has_legal_move()
+
+
+def classify_line(line):
+    """ Return a line of a puzzle file with its themes appended after a
+        tab, or None if the puzzle is invalid.
+
+    Args: line (str): Line of a puzzle file.
+    """
+    line = line.rstrip('\n')
+    fen, _, moves = line.partition('\t')
+    fen = fen.strip()
+    if len(fen.split()) == 4:
+        fen += ' 0 1'
+    try:
+        themes = classify(fen, moves.split())
+    except ValueError:
+        return None
+    return '%s\t%s' % (line, ','.join(themes))
+
+
+def _classify_chunk(lines):
+    return [classify_line(line) for line in lines]
+
+
+def chunks(lines, size=CHUNK_SIZE):
+    """ Generate lists of up to 'size' non-blank lines.
+
+    Args: lines: Iterable of lines, e.g. an open file.
+          size (int): Lines per list.
+    """
+    lines = (line for line in lines if line.strip())
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Tag puzzles with the tactical motifs of their '
+                    'solutions.'
+    )
+    parser.add_argument('puzzles')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the tagged puzzles to FILE instead of '
+                             'standard output')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='puzzles given to a worker at a time')
+    args = parser.parse_args(argv)
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        with open(args.puzzles) as f:
+            jobs = chunks(f, args.chunk_size)
+            if args.workers > 1:
+                with multiprocessing.Pool(args.workers) as pool:
+                    # Hand out a few chunks per worker at a time, so that
+                    # the file is never read far ahead of the output.
+                    while True:
+                        window = list(itertools.islice(jobs,
+                                                       4 * args.workers))
+                        if not window:
+                            break
+                        for tagged in pool.imap(_classify_chunk, window):
+                            _write(output, tagged)
+                    pool.close()
+                    pool.join()
+            else:
+                for chunk in jobs:
+                    _write(output, _classify_chunk(chunk))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+def _write(output, tagged):
+    for line in tagged:
+        if line is not None:
+            output.write(line + '\n')
+    output.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())